@@ -1 +1,3 @@
 awk '{gsub(/ /,""); print}' red_preprocessed_tcpdump_20251230_141308.hex > red_preprocessed_tcpdump_20251230_141308.txt
+# From a binary payload store (.pkt) instead of the .hex file:
+# python ../../../../protocol_reverse_engineering/payload_store.py --store red_preprocessed_tcpdump_20251230_141308.pkt --dump txt > red_preprocessed_tcpdump_20251230_141308.txt
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
 
 
@@ -7,11 +8,15 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Parse SRTP, SRTCP, STUN, and DTLS packets from hex dump lines."
     )
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "--target",
-        required=True,
         help="Path to input file containing one UDP payload (hex) per line.",
     )
+    source.add_argument(
+        "--store",
+        help="Path to a binary payload store (.pkt directory) instead of a hex file.",
+    )
     parser.add_argument(
         "--count",
         type=int,
@@ -21,6 +26,20 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def iter_store_payloads(store_dir: str):
+    """
+    Yield each payload of a binary payload store as a list of integers.
+    The store keeps a zero-padded uint8 matrix plus the per-row length,
+    both as memory-mapped .npy files.
+    """
+    import numpy as np
+
+    payload = np.load(os.path.join(store_dir, "payload.npy"), mmap_mode="r")
+    length = np.load(os.path.join(store_dir, "length.npy"), mmap_mode="r")
+    for row, n in zip(payload, length):
+        yield row[:n].tolist()
+
+
 def hex_line_to_bytes(line: str) -> list[int]:
     """
     Convert a line containing hex bytes into a list of integers.
@@ -409,9 +428,34 @@ def parse_dtls_records(payload: list[int]) -> str:
     return " ".join(segments)
 
 
+def parse_payload(payload_bytes: list[int]) -> str:
+    # Decide type: STUN first, then DTLS, then SRTCP, otherwise SRTP
+    if is_stun_packet(payload_bytes):
+        return parse_stun_message(payload_bytes)
+    if is_dtls_packet(payload_bytes):
+        return parse_dtls_records(payload_bytes)
+    if len(payload_bytes) >= 2 and is_rtcp_packet(payload_bytes[1]):
+        return parse_srtcp_packet(payload_bytes)
+    return parse_srtp_packet(payload_bytes)
+
+
 def main() -> None:
     args = parse_args()
 
+    if args.store:
+        if not os.path.isdir(args.store):
+            print(f"Store not found: {args.store}", file=sys.stderr)
+            sys.exit(1)
+        line_index = 0
+        for payload_bytes in iter_store_payloads(args.store):
+            if args.count is not None and line_index >= args.count:
+                break
+            if not payload_bytes:
+                continue
+            print(parse_payload(payload_bytes))
+            line_index += 1
+        return
+
     try:
         with open(args.target, "r", encoding="utf-8") as f:
             line_index = 0
@@ -434,17 +478,7 @@ def main() -> None:
                     line_index += 1
                     continue
 
-                # Decide type: STUN first, then DTLS, then SRTCP, otherwise SRTP
-                if is_stun_packet(payload_bytes):
-                    parsed = parse_stun_message(payload_bytes)
-                elif is_dtls_packet(payload_bytes):
-                    parsed = parse_dtls_records(payload_bytes)
-                elif len(payload_bytes) >= 2 and is_rtcp_packet(payload_bytes[1]):
-                    parsed = parse_srtcp_packet(payload_bytes)
-                else:
-                    parsed = parse_srtp_packet(payload_bytes)
-
-                print(parsed)
+                print(parse_payload(payload_bytes))
                 line_index += 1
     except FileNotFoundError:
         print(f"File not found: {args.target}", file=sys.stderr)
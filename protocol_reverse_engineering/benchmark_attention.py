@@ -0,0 +1,130 @@
+# benchmark_attention.py
+#
+# Training / inference throughput of ByteBERT with the SDPA attention path
+# (CustomTransformerLayer.fast_attn = True) against the nn.MultiheadAttention
+# path that materialises per-head weights (fast_attn = False).
+import argparse, time, torch
+import torch.nn as nn
+
+from bytebert_utils import (
+    FullPacketDataset, ByteBERT, mask_inputs, make_key_padding_mask,
+    PAD_IDX, VOCAB_SIZE
+)
+
+
+def set_fast_attn(model, enabled):
+    for layer in model.layers:
+        layer.fast_attn = enabled
+
+
+def make_batches(args):
+    # Real packets from --hex_file, or random full-length ones
+    g = torch.Generator().manual_seed(0)
+    if args.hex_file:
+        ds = FullPacketDataset(args.hex_file, max_len=args.max_len)
+        n = min(len(ds), args.batch_size * args.batches)
+        rows = [ds[i] for i in range(n)]
+        x = torch.stack([r[0] for r in rows])
+        lengths = torch.stack([r[1] for r in rows])
+    else:
+        n = args.batch_size * args.batches
+        lengths = torch.randint(8, args.max_len + 1, (n,), generator=g)
+        x = torch.randint(0, 256, (n, args.max_len), generator=g)
+        x[torch.arange(args.max_len)[None, :] >= lengths[:, None]] = PAD_IDX
+    return list(zip(x.split(args.batch_size), lengths.split(args.batch_size)))
+
+
+def bench_inference(model, batches, device, repeat):
+    model.eval()
+    n = 0
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for x, lengths in batches:
+                x = x.to(device); lengths = lengths.to(device)
+                model(x, key_padding_mask=make_key_padding_mask(lengths, x.size(1)))
+                n += x.size(0)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+    return n / (time.perf_counter() - start)
+
+
+def bench_training(model, batches, device, repeat):
+    model.train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    loss_fn = nn.CrossEntropyLoss(ignore_index=-100)
+    torch.manual_seed(0)
+    n = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for x, lengths in batches:
+            x = x.to(device); lengths = lengths.to(device)
+            masked, labels = mask_inputs(x)
+            logits = model(masked, key_padding_mask=make_key_padding_mask(lengths, x.size(1)))
+            loss = loss_fn(logits.view(-1, VOCAB_SIZE), labels.view(-1))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            n += x.size(0)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return n / (time.perf_counter() - start)
+
+
+def max_abs_diff(model, batches, device):
+    # Logits of both paths on the first batch, compared at non-padding positions
+    model.eval()
+    x, lengths = batches[0]
+    x = x.to(device); lengths = lengths.to(device)
+    key_pad = make_key_padding_mask(lengths, x.size(1))
+    with torch.no_grad():
+        set_fast_attn(model, False)
+        ref = model(x, key_padding_mask=key_pad)
+        set_fast_attn(model, True)
+        out = model(x, key_padding_mask=key_pad)
+    return (out - ref)[~key_pad].abs().max().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ByteBERT throughput with and without the SDPA attention path")
+    parser.add_argument("--hex_file", type=str, default=None, help="Packets to benchmark on (default: random)")
+    parser.add_argument("--model_path", type=str, default=None, help="Optional checkpoint (weights do not affect speed)")
+    parser.add_argument("--max_len", type=int, default=80)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    torch.manual_seed(0)
+    model = ByteBERT(seq_len=args.max_len)
+    if args.model_path:
+        model.load_state_dict(torch.load(args.model_path, map_location="cpu"))
+    model.to(device)
+    batches = make_batches(args)
+
+    print(f"device={device} threads={torch.get_num_threads()} batches={len(batches)}x{args.batch_size}")
+    print(f"max |logit diff| (sdpa vs mha): {max_abs_diff(model, batches, device):.3e}")
+
+    results = {}
+    for name, fast in (("mha", False), ("sdpa", True)):
+        set_fast_attn(model, fast)
+        # One untimed pass so allocator / kernel selection does not count
+        bench_inference(model, batches[:1], device, 1)
+        state = {k: v.clone() for k, v in model.state_dict().items()}
+        results[name] = (bench_inference(model, batches, device, args.repeat),
+                         bench_training(model, batches, device, args.repeat))
+        model.load_state_dict(state)
+
+    print(f"{'path':<6}{'inference pkt/s':>18}{'training pkt/s':>18}")
+    for name, (inf, train) in results.items():
+        print(f"{name:<6}{inf:>18.1f}{train:>18.1f}")
+    (inf0, train0), (inf1, train1) = results["mha"], results["sdpa"]
+    print(f"speedup: inference x{inf1 / inf0:.2f}, training x{train1 / train0:.2f}")
+
+
+if __name__ == "__main__":
+    main()
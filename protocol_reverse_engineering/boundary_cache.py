@@ -0,0 +1,92 @@
+# boundary_cache.py
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+
+
+def checkpoint_hash(path, chunk_size=1 << 20):
+    # Content hash of a model checkpoint; cached scores are only reused for the same weights
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+class BoundaryCache:
+    """Per-packet `final` boundary scores, keyed by (checkpoint hash, packet bytes).
+
+    The key is the packet itself (already cut to max_len), so there are no hash
+    collisions. Boundary flags are derived from the cached scores, so the
+    threshold / peak settings can change without invalidating the cache. Lookups
+    go through an in-memory LRU of up to max_memory packets first; new entries
+    are written in batches.
+    """
+
+    def __init__(self, path, model_hash, commit_every=1000, max_memory=100000):
+        self.model_hash = model_hash
+        self.commit_every = commit_every
+        self.max_memory = max_memory
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " model TEXT NOT NULL, packet BLOB NOT NULL, final BLOB NOT NULL,"
+            " PRIMARY KEY (model, packet)) WITHOUT ROWID"
+        )
+        self.memory = OrderedDict()
+        self.pending = []
+        self.hits = self.misses = self.duplicates = 0
+
+    def get(self, packet):
+        final = self.memory.get(packet)
+        if final is not None:
+            self.memory.move_to_end(packet)
+        else:
+            row = self.conn.execute(
+                "SELECT final FROM scores WHERE model = ? AND packet = ?",
+                (self.model_hash, packet)).fetchone()
+            if row is not None:
+                final = np.frombuffer(row[0], dtype=np.float64)
+                self._remember(packet, final)
+        if final is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return final
+
+    def _remember(self, packet, final):
+        self.memory[packet] = final
+        self.memory.move_to_end(packet)
+        if len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+
+    def count_duplicate(self):
+        # Identical payload already queued for the model in this run
+        self.duplicates += 1
+
+    def put(self, packet, final):
+        final = np.asarray(final, dtype=np.float64)
+        self._remember(packet, final)
+        self.pending.append((self.model_hash, packet, final.tobytes()))
+        if len(self.pending) >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?)", self.pending)
+            self.conn.commit()
+            self.pending = []
+
+    def summary(self):
+        looked_up = self.hits + self.misses + self.duplicates
+        saved = self.hits + self.duplicates
+        rate = 100.0 * saved / looked_up if looked_up else 0.0
+        return (f"Cache: {self.hits} hits, {self.duplicates} in-run duplicates, {self.misses} misses "
+                f"({rate:.1f}% of packets skipped the model)")
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,205 @@
+# bytebert_runtime.py
+#
+# Export ByteBERT's leave-one-out head (encoder + output layer, see LOOHead) to a
+# standalone TorchScript or ONNX artifact, load it back for infer_structure.py
+# --runtime, and check that an artifact reproduces the eager model's boundaries.
+#
+#   python bytebert_runtime.py --model_path model.pt --format onnx --int8 --out bytebert
+#   python bytebert_runtime.py --model_path model.pt --validate bytebert.onnx --hex_file x.hex
+import argparse, os, time, torch
+import torch.nn as nn
+
+from bytebert_utils import ByteBERT, LOOHead, FullPacketDataset
+
+RUNTIMES = ("eager", "torchscript", "onnx")
+INPUT_NAMES = ("x", "lengths", "pos")
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def load_checkpoint(model_path, max_len=80, int8=False):
+    model = ByteBERT(seq_len=max_len)
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    model.eval()
+    if int8:
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return LOOHead(model).eval()
+
+
+def example_inputs(max_len, batch=4):
+    # Full-width rows; B and T are exported as dynamic axes
+    x = torch.randint(0, 256, (batch, max_len))
+    lengths = torch.full((batch,), max_len, dtype=torch.long)
+    pos = torch.arange(batch, dtype=torch.long) % max_len
+    return x, lengths, pos
+
+
+def export_torchscript(head, path, max_len):
+    with torch.no_grad():
+        traced = torch.jit.trace(head, example_inputs(max_len))
+    torch.jit.save(traced, path)
+    return path
+
+
+def export_onnx(head, path, max_len):
+    B = torch.export.Dim("B")
+    T = torch.export.Dim("T", max=max_len)
+    torch.onnx.export(
+        head, example_inputs(max_len), path,
+        input_names=list(INPUT_NAMES), output_names=["logits"],
+        dynamic_shapes={"x": {0: B, 1: T}, "lengths": {0: B}, "pos": {0: B}},
+        dynamo=True, external_data=False,
+    )
+    return path
+
+
+def quantize_onnx(src, dst):
+    # int8 dynamic quantization of the exported graph's MatMul weights
+    try:
+        import onnx
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        raise SystemExit("ONNX int8 export needs onnx and onnxruntime (pip install onnx onnxruntime)")
+    model = onnx.load(src)
+    # Intermediate shape annotations from the exporter trip the quantizer's shape inference
+    del model.graph.value_info[:]
+    quantize_dynamic(model, dst, weight_type=QuantType.QInt8)
+    return dst
+
+
+# -----------------------------
+# Runtimes
+# -----------------------------
+class OnnxLOOHead:
+    # Same call signature as LOOHead, backed by an onnxruntime CPU session.
+    # The exported attention is unfused ([B, H, T, T] scores per layer), so large
+    # calls are split into max_rows sub-batches to bound memory.
+    def __init__(self, path, threads=None, max_rows=256):
+        self.max_rows = max_rows
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise SystemExit("--runtime onnx needs onnxruntime (pip install onnxruntime)")
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads or torch.get_num_threads()
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+    def __call__(self, x, lengths, pos):
+        out = []
+        for start in range(0, x.size(0), self.max_rows):
+            feeds = {name: t[start:start + self.max_rows].cpu().numpy()
+                     for name, t in zip(INPUT_NAMES, (x, lengths, pos))}
+            out.append(torch.from_numpy(self.session.run(None, feeds)[0]))
+        return torch.cat(out)
+
+
+def load_runtime(path, runtime, device="cpu", max_len=80):
+    """Return a callable (x, lengths, pos) -> logits [B, V] for infer_structure.
+
+    eager: path is a state-dict checkpoint; torchscript / onnx: an exported artifact.
+    """
+    if runtime == "eager":
+        return load_checkpoint(path, max_len).to(device)
+    if runtime == "torchscript":
+        return torch.jit.load(path, map_location=device).eval()
+    if runtime == "onnx":
+        return OnnxLOOHead(path)
+    raise ValueError(f"Unknown runtime: {runtime}")
+
+
+def runtime_for(path):
+    ext = os.path.splitext(path)[1]
+    return {".onnx": "onnx", ".ts": "torchscript"}.get(ext, "eager")
+
+
+# -----------------------------
+# Validation
+# -----------------------------
+class _Lines:
+    # Collects ByteF lines from infer_metric_batched
+    def __init__(self):
+        self.lines = []
+
+    def info(self, msg):
+        if msg.startswith("ByteF"):
+            self.lines.append(msg)
+
+
+def _run_lines(head, dataset, num_samples, batch_rows):
+    from infer_structure import infer_metric_batched
+
+    log = _Lines()
+    t0 = time.perf_counter()
+    infer_metric_batched(head, dataset, "cpu", log, num_samples=num_samples, th_final=1.0,
+                         batch_rows=batch_rows)
+    return log.lines, time.perf_counter() - t0
+
+
+def validate(model_path, artifacts, hex_file, num_samples=200, max_len=80, batch_rows=1024):
+    """Run infer_structure's batched engine with the eager model, then with each artifact.
+
+    Yields (artifact, mismatched ByteF lines, packets compared, max |logit diff| on one
+    batch, eager seconds, artifact seconds).
+    """
+    dataset = FullPacketDataset(hex_file, max_len=max_len)
+    eager = load_runtime(model_path, "eager", max_len=max_len)
+    ref, t_ref = _run_lines(eager, dataset, num_samples, batch_rows)
+    x, lengths, pos = example_inputs(max_len, batch=16)
+    with torch.no_grad():
+        ref_logits = eager(x, lengths, pos)
+
+    for path in artifacts:
+        other = load_runtime(path, runtime_for(path), max_len=max_len)
+        out, t_out = _run_lines(other, dataset, num_samples, batch_rows)
+        with torch.no_grad():
+            diff = (ref_logits - other(x, lengths, pos)).abs().max().item()
+        mismatched = sum(a != b for a, b in zip(ref, out)) + abs(len(ref) - len(out))
+        yield path, mismatched, len(ref), diff, t_ref, t_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / validate a ByteBERT inference artifact")
+    parser.add_argument("--model_path", type=str, required=True, help="State-dict checkpoint from pretrain_bytebert.py")
+    parser.add_argument("--max_len", type=int, default=80)
+    parser.add_argument("--format", choices=["torchscript", "onnx", "both"], default="onnx")
+    parser.add_argument("--int8", action="store_true", help="Also write an int8 dynamic-quantized variant")
+    parser.add_argument("--out", type=str, default=None,
+                        help="Output path without extension (default: checkpoint path without extension)")
+    parser.add_argument("--validate", type=str, nargs="*", default=None,
+                        help="Compare these artifacts against the checkpoint instead of exporting")
+    parser.add_argument("--hex_file", type=str, default=None, help="Packets for --validate (and post-export validation)")
+    parser.add_argument("--num_examples", type=int, default=200)
+    parser.add_argument("--batch_rows", type=int, default=1024)
+    args = parser.parse_args()
+
+    if args.validate is not None:
+        artifacts = args.validate
+    else:
+        stem = args.out or os.path.splitext(args.model_path)[0]
+        artifacts = []
+        for fmt in (["torchscript", "onnx"] if args.format == "both" else [args.format]):
+            for int8 in ([False, True] if args.int8 else [False]):
+                head = load_checkpoint(args.model_path, args.max_len, int8=int8 and fmt == "torchscript")
+                suffix = "_int8" if int8 else ""
+                if fmt == "torchscript":
+                    path = export_torchscript(head, f"{stem}{suffix}.ts", args.max_len)
+                elif int8:
+                    path = quantize_onnx(f"{stem}.onnx", f"{stem}{suffix}.onnx")
+                else:
+                    path = export_onnx(head, f"{stem}.onnx", args.max_len)
+                artifacts.append(path)
+                print(f"Saved {fmt}{' int8' if int8 else ''} artifact to: {path}")
+
+    if args.hex_file:
+        for path, mismatched, n, diff, t_ref, t_out in validate(args.model_path, artifacts, args.hex_file,
+                                                                 args.num_examples, args.max_len, args.batch_rows):
+            status = "OK" if mismatched == 0 else "DIFFERS"
+            print(f"{path}: {status} {mismatched}/{n} ByteF lines differ, max |logit diff| {diff:.3e}, "
+                  f"eager {t_ref:.2f}s vs {runtime_for(path)} {t_out:.2f}s")
+    elif args.validate is not None:
+        parser.error("--validate needs --hex_file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# bytebert_server.py
+#
+# Long-running boundary inference service: one warm ByteBERT shared by many
+# clients (e.g. the per-participant jobs of process_session.py).
+#
+#   python bytebert_server.py --model_path model.pt --listen unix:/tmp/bytebert.sock
+#   python bytebert_server.py --model_path model.onnx --runtime onnx --listen 127.0.0.1:8765
+#   python infer_structure.py --hex_file x.hex --server unix:/tmp/bytebert.sock ...
+#
+# API (JSON over HTTP, on TCP or a Unix socket):
+#   POST /infer   {"packets": ["0503 87 ...", ...], "output": "boundaries" | "scores",
+#                  "th_final": 1.0, "use_peak": true, "display_start": 0, "display_end": null}
+#              -> {"results": ["0503|87...", ...]}      (null where the display range is empty)
+#              or {"results": [[final score per byte], ...]}
+#   GET  /metrics  throughput, batch size, latency and queue depth
+#   GET  /health
+import argparse, http.client, json, os, socket, socketserver, threading, time, torch
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from bytebert_utils import PAD_IDX
+from bytebert_runtime import RUNTIMES, load_runtime
+from infer_structure import (
+    iter_loo_stats, prepare_model, boundary_scores, boundary_flags, format_byte_lines
+)
+
+OUTPUTS = ("boundaries", "scores")
+
+
+# -----------------------------
+# Request coalescing
+# -----------------------------
+class _Job:
+    def __init__(self, tokens, lengths, params):
+        self.tokens = tokens        # [N, max_len] long
+        self.lengths = lengths      # [N] long
+        self.params = params
+        self.rows = int(lengths.sum())
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BoundaryBatcher:
+    """Single model thread fed by a queue of requests.
+
+    Requests that arrive within max_wait_ms of the first queued one (or until
+    batch_rows LOO rows are queued) are packed into the same forward passes.
+    """
+    def __init__(self, model, device, max_len, batch_rows=1024, max_wait_ms=20.0, precision="fp32"):
+        self.model = prepare_model(model, precision)
+        self.device = device
+        self.max_len = max_len
+        self.batch_rows = batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self.precision = precision
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stats = dict.fromkeys(("requests", "packets", "rows", "batches", "errors"), 0)
+        self.stats.update(busy_s=0.0, latency_sum_s=0.0, latency_max_s=0.0, max_queue_depth=0)
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def encode(self, packets):
+        # Hex strings -> PAD-filled token rows, as FullPacketDataset builds them
+        tokens = torch.full((len(packets), self.max_len), PAD_IDX, dtype=torch.long)
+        lengths = torch.zeros(len(packets), dtype=torch.long)
+        for k, text in enumerate(packets):
+            row = bytes.fromhex(text)[:self.max_len]
+            tokens[k, :len(row)] = torch.tensor(list(row), dtype=torch.long)
+            lengths[k] = len(row)
+        return tokens, lengths
+
+    def submit(self, packets, **params):
+        tokens, lengths = self.encode(packets)
+        job = _Job(tokens, lengths, params)
+        with self.cond:
+            self.queue.append(job)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self.queue))
+            self.cond.notify()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _take(self):
+        # Block for one job, then keep collecting until the window closes or the batch is full
+        with self.cond:
+            while not self.queue:
+                self.cond.wait()
+            jobs = [self.queue.popleft()]
+            rows = jobs[0].rows
+            deadline = jobs[0].enqueued + self.max_wait
+            while rows < self.batch_rows:
+                if not self.queue:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or not self.cond.wait(remaining):
+                        break
+                    continue
+                jobs.append(self.queue.popleft())
+                rows += jobs[-1].rows
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._take()
+            t0 = time.perf_counter()
+            try:
+                self._infer(jobs)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+                with self.lock:
+                    self.stats["errors"] += len(jobs)
+            t1 = time.perf_counter()
+            with self.lock:
+                s = self.stats
+                s["requests"] += len(jobs)
+                s["packets"] += sum(len(job.lengths) for job in jobs)
+                s["rows"] += sum(job.rows for job in jobs)
+                s["batches"] += -(-sum(job.rows for job in jobs) // self.batch_rows)
+                s["busy_s"] += t1 - t0
+                for job in jobs:
+                    latency = t1 - job.enqueued
+                    s["latency_sum_s"] += latency
+                    s["latency_max_s"] = max(s["latency_max_s"], latency)
+            for job in jobs:
+                job.done.set()
+
+    def _infer(self, jobs):
+        tokens = torch.cat([job.tokens for job in jobs])
+        lengths = torch.cat([job.lengths for job in jobs])
+        packets = ((i, tokens[i], lengths[i]) for i in range(len(lengths)) if lengths[i] > 0)
+        H = np.zeros((len(lengths), self.max_len), dtype=np.float32)
+        margin = np.zeros_like(H)
+        with torch.inference_mode():
+            for i, _, L, h, m in iter_loo_stats(self.model, packets, self.device, self.max_len,
+                                                batch_rows=self.batch_rows, precision=self.precision):
+                H[i, :L] = h
+                margin[i, :L] = m
+        final = boundary_scores(H, margin, lengths)[-1].numpy()
+
+        off = 0
+        for job in jobs:
+            n = len(job.lengths)
+            job_final = final[off:off + n]
+            job.result = self._format(job, job_final)
+            off += n
+
+    def _format(self, job, final):
+        p = job.params
+        if p.get("output", "boundaries") == "scores":
+            return [final[k, :L].tolist() for k, L in enumerate(job.lengths.tolist())]
+        flags = boundary_flags(final, job.lengths, p.get("display_start", 0), p.get("display_end"),
+                               th_final=p.get("th_final", 1.0), use_peak=p.get("use_peak", True))
+        return format_byte_lines(job.tokens.numpy(), flags, job.lengths,
+                                 p.get("display_start", 0), p.get("display_end"))
+
+    def metrics(self):
+        with self.lock:
+            s = dict(self.stats)
+        with self.cond:
+            s["queue_depth"] = len(self.queue)
+            s["queued_packets"] = sum(len(job.lengths) for job in self.queue)
+        uptime = time.time() - self.started
+        s["uptime_s"] = uptime
+        s["packets_per_s"] = s["packets"] / uptime if uptime else 0.0
+        s["packets_per_busy_s"] = s["packets"] / s["busy_s"] if s["busy_s"] else 0.0
+        s["rows_per_batch"] = s["rows"] / s["batches"] if s["batches"] else 0.0
+        s["latency_avg_s"] = s["latency_sum_s"] / s["requests"] if s["requests"] else 0.0
+        s["batch_rows"] = self.batch_rows
+        s["max_wait_ms"] = self.max_wait * 1000.0
+        return s
+
+
+# -----------------------------
+# HTTP front end
+# -----------------------------
+class _Handler(BaseHTTPRequestHandler):
+    batcher = None
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send(200, self.batcher.metrics())
+        elif self.path == "/health":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/infer":
+            self._send(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            packets = req["packets"]
+            if req.get("output", "boundaries") not in OUTPUTS:
+                raise ValueError(f"output must be one of {OUTPUTS}")
+            params = {k: req[k] for k in ("output", "th_final", "use_peak", "display_start", "display_end") if k in req}
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        try:
+            results = self.batcher.submit(packets, **params) if packets else []
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": repr(e)})
+            return
+        self._send(200, {"results": results})
+
+    def log_message(self, fmt, *args):
+        # Per-request access logs would dominate the output; /metrics has the counters
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects (host, port)-style client addresses
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def make_server(listen, batcher):
+    handler = type("Handler", (_Handler,), {"batcher": batcher})
+    if listen.startswith("unix:"):
+        path = listen[len("unix:"):]
+        if os.path.exists(path):
+            os.unlink(path)
+        return _UnixHTTPServer(path, handler)
+    host, _, port = listen.rpartition(":")
+    return ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+
+
+# -----------------------------
+# Client
+# -----------------------------
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def _connect(address, timeout=None):
+    # "unix:/path/to.sock" or "host:port"
+    if address.startswith("unix:"):
+        return _UnixHTTPConnection(address[len("unix:"):], timeout=timeout)
+    host, _, port = address.rpartition(":")
+    return http.client.HTTPConnection(host or "127.0.0.1", int(port), timeout=timeout)
+
+
+def call_server(address, method, path, body=None, timeout=None):
+    conn = _connect(address, timeout)
+    try:
+        data = json.dumps(body).encode() if body is not None else None
+        conn.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+        resp = conn.getresponse()
+        payload = json.loads(resp.read())
+    finally:
+        conn.close()
+    if resp.status != 200:
+        raise RuntimeError(f"{address}{path}: HTTP {resp.status}: {payload.get('error')}")
+    return payload
+
+
+def infer_remote(address, packets, output="boundaries", timeout=None, **params):
+    # packets: hex strings (spaces allowed); returns one boundary string / score list per packet
+    body = dict(params, packets=list(packets), output=output)
+    return call_server(address, "POST", "/infer", body, timeout)["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ByteBERT boundary inference to local clients")
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--runtime", choices=RUNTIMES, default="eager")
+    parser.add_argument("--precision", choices=["fp32", "bf16", "int8"], default="fp32",
+                        help="Eager runtime only")
+    parser.add_argument("--max_len", type=int, default=80)
+    parser.add_argument("--listen", type=str, default="127.0.0.1:8765",
+                        help="host:port, or unix:/path/to.sock")
+    parser.add_argument("--batch_rows", type=int, default=1024, help="LOO rows per forward pass")
+    parser.add_argument("--max_wait_ms", type=float, default=20.0,
+                        help="How long the first queued request waits for others to share its batch")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.runtime != "eager" and args.precision != "fp32":
+        parser.error("--precision applies to the eager model; export an int8 artifact instead")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = "cuda" if torch.cuda.is_available() and args.runtime != "onnx" else "cpu"
+    model = load_runtime(args.model_path, args.runtime, device, args.max_len)
+    if args.runtime == "eager":
+        model = model.model    # the ByteBERT inside LOOHead, so prepare_model can quantize it
+
+    batcher = BoundaryBatcher(model, device, args.max_len, batch_rows=args.batch_rows,
+                              max_wait_ms=args.max_wait_ms, precision=args.precision)
+    server = make_server(args.listen, batcher)
+    print(f"Serving {args.model_path} ({args.runtime}, {args.precision}) on {args.listen}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.listen.startswith("unix:") and os.path.exists(args.listen[len("unix:"):]):
+            os.unlink(args.listen[len("unix:"):])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 # bytebert_utils.py
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset
-import logging, sys
+import torch.nn.functional as F
+from torch.utils.data import Dataset, Sampler, Subset
+import numpy as np
+import copy, logging, os, sys
+
+from payload_store import is_store, load_store, ensure_store
 
 # -----------------------------
 # Special tokens and vocab
@@ -32,9 +36,13 @@ def setup_logger(logfile="debug.log"):
 # Dataset
 # -----------------------------
 class FullPacketDataset(Dataset):
-    # Each line in the hex file corresponds to one packet
+    # Each line in the hex file (or row in a .pkt payload store) corresponds to one packet
     def __init__(self, path, max_len=80):
         self.samples, self.lengths = [], []
+        self.max_len, self.store_path, self.payload = max_len, None, None
+        if is_store(path):
+            self._load_store(path)
+            return
         with open(path, "r") as f:
             for line in f:
                 hex_bytes = line.strip().split()
@@ -46,14 +54,163 @@ class FullPacketDataset(Dataset):
                 self.samples.append(vals)
                 self.lengths.append(L)
 
+    def _load_store(self, path):
+        # Rows stay in the memory-mapped store and are PAD-filled one at a time in __getitem__
+        self.store_path = path
+        self._open()
+        length = np.asarray(load_store(path).length)
+        self.samples = np.flatnonzero(length)  # empty payloads are skipped, as empty hex lines are
+        self.lengths = np.minimum(length[self.samples], self.max_len).astype(np.int64)
+
+    def _open(self):
+        self.payload = load_store(self.store_path).payload
+
+    def __getstate__(self):
+        # Re-map in DataLoader workers instead of pickling the payload
+        state = self.__dict__.copy()
+        state["payload"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.store_path is not None:
+            self._open()
+
     def __len__(self):
         return len(self.samples)
 
     def __getitem__(self, idx):
-        x = torch.tensor(self.samples[idx], dtype=torch.long)
         L = torch.tensor(self.lengths[idx], dtype=torch.long)
+        if self.payload is None:
+            return torch.tensor(self.samples[idx], dtype=torch.long), L
+        x = torch.full((self.max_len,), PAD_IDX, dtype=torch.long)
+        n = int(self.lengths[idx])
+        x[:n] = torch.from_numpy(self.payload[self.samples[idx], :n].astype(np.int64))
         return x, L
 
+class MappedPacketDataset(Dataset):
+    """Packets read straight from a memory-mapped .pkt store (see payload_store.py).
+
+    A .hex or .pcap path is converted to <stem>.pkt once and reused afterwards.
+    Items are (uint8 row view, length); tokens are widened and PAD-filled per batch
+    by collate_packets, so the dataset itself holds no per-sample Python objects.
+    """
+    def __init__(self, path, max_len=80):
+        self.path = ensure_store(path, max_len=max_len)
+        self.max_len = max_len
+        self._open()
+        lengths = np.load(os.path.join(self.path, "length.npy"), mmap_mode="r")
+        self.lengths = np.minimum(lengths, max_len).astype(np.uint8 if max_len < 256 else np.uint16)
+        self.indices = np.flatnonzero(self.lengths)   # empty payloads are skipped, as in FullPacketDataset
+
+    def _open(self):
+        # copy-on-write map: pages are shared between DataLoader workers and tensors can view them
+        payload = np.load(os.path.join(self.path, "payload.npy"), mmap_mode="c")
+        self.payload = payload[:, :self.max_len]
+
+    def __getstate__(self):
+        # Re-map in spawned workers instead of pickling the payload
+        state = self.__dict__.copy()
+        del state["payload"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        row = self.indices[idx]
+        return torch.from_numpy(self.payload[row]), int(self.lengths[row])
+
+    def shard(self, num_shards, shard_id):
+        # Strided subset for one worker / rank; shares the same mapping
+        part = copy.copy(self)
+        part.indices = self.indices[shard_id::num_shards]
+        return part
+
+
+def collate_packets(batch, pad_idx=PAD_IDX, trim=False):
+    # [(row, length)] -> (LongTensor [B, T] with PAD after each length, lengths [B])
+    # trim=True cuts T down to the longest packet in the batch
+    rows = torch.stack([row for row, _ in batch])
+    lengths = torch.tensor([int(L) for _, L in batch], dtype=torch.long)
+    if trim:
+        rows = rows[:, :max(1, int(lengths.max()))]
+    x = rows.long()
+    x[torch.arange(x.size(1)).unsqueeze(0) >= lengths.unsqueeze(1)] = pad_idx
+    return x, lengths
+
+
+def collate_trimmed(batch, pad_idx=PAD_IDX):
+    return collate_packets(batch, pad_idx=pad_idx, trim=True)
+
+
+def dataset_lengths(dataset):
+    # Packet lengths of a Full/MappedPacketDataset, or of a Subset of one, as a numpy array
+    if isinstance(dataset, Subset):
+        return dataset_lengths(dataset.dataset)[np.asarray(dataset.indices)]
+    if isinstance(dataset, MappedPacketDataset):
+        return dataset.lengths[dataset.indices].astype(np.int64)
+    return np.asarray(dataset.lengths, dtype=np.int64)
+
+# -----------------------------
+# Length-bucketed batching
+# -----------------------------
+class TokenBudgetBatchSampler(Sampler):
+    """Batch sampler that groups packets of similar length under a padded-token budget.
+
+    Packets are bucketed by length // bucket_width. Each bucket is cut into batches
+    of max_tokens // (longest length the bucket can hold) packets, so a batch trimmed
+    by collate_trimmed has at most max_tokens positions. Packet order within
+    buckets and batch order are reshuffled every epoch. With num_replicas > 1 each
+    rank takes every num_replicas-th batch (the list is padded by wrapping around so
+    all ranks run the same number of steps).
+    """
+    def __init__(self, lengths, max_tokens=8192, bucket_width=8, shuffle=True, seed=42,
+                 num_replicas=1, rank=0):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        buckets = self.lengths // bucket_width
+        self.bucket_ids = np.unique(buckets)
+        self.members = [np.flatnonzero(buckets == b) for b in self.bucket_ids]
+        longest = (self.bucket_ids + 1) * bucket_width - 1
+        self.caps = np.maximum(1, max_tokens // np.maximum(longest, 1))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _num_batches(self):
+        return int(sum(-(-len(m) // c) for m, c in zip(self.members, self.caps)))
+
+    def __len__(self):
+        return -(-self._num_batches() // self.num_replicas)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        batches = []
+        for members, cap in zip(self.members, self.caps):
+            if self.shuffle:
+                members = rng.permutation(members)
+            batches.extend(np.array_split(members, np.arange(cap, len(members), cap)))
+        if self.shuffle:
+            batches = [batches[k] for k in rng.permutation(len(batches))]
+        if self.num_replicas > 1 and batches:
+            total = len(self) * self.num_replicas
+            batches = (batches * (-(-total // len(batches))))[:total][self.rank::self.num_replicas]
+        for batch in batches:
+            yield batch.tolist()
+
 # -----------------------------
 # Transformer Model
 # -----------------------------
@@ -68,14 +225,34 @@ class CustomTransformerLayer(nn.Module):
         self.norm1 = nn.LayerNorm(d_model)
         self.norm2 = nn.LayerNorm(d_model)
         self.dropout = nn.Dropout(0.1)
+        # False = always go through nn.MultiheadAttention (the pre-SDPA path), e.g. for comparisons
+        self.fast_attn = True
 
-    def forward(self, x, key_padding_mask=None):
-        attn_out, attn_w = self.self_attn(
-            x, x, x,
-            need_weights=True,
-            average_attn_weights=False,
-            key_padding_mask=key_padding_mask
-        )
+    def _sdpa(self, x, key_padding_mask=None):
+        # Same projections as self.self_attn, but through the fused SDPA kernel (no [B,H,T,T] weights)
+        attn = self.self_attn
+        B, T, D = x.shape
+        H = attn.num_heads
+        q, k, v = F.linear(x, attn.in_proj_weight, attn.in_proj_bias).view(B, T, 3, H, D // H).permute(2, 0, 3, 1, 4).unbind(0)
+        mask = None
+        if key_padding_mask is not None:
+            # MHA: True = padding; SDPA: True = attend
+            mask = ~key_padding_mask[:, None, None, :] if key_padding_mask.dtype == torch.bool \
+                else key_padding_mask[:, None, None, :].to(q.dtype)
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask,
+                                             dropout_p=attn.dropout if self.training else 0.0)
+        return attn.out_proj(out.transpose(1, 2).reshape(B, T, D))
+
+    def forward(self, x, key_padding_mask=None, need_weights=True):
+        if need_weights or not self.fast_attn:
+            attn_out, attn_w = self.self_attn(
+                x, x, x,
+                need_weights=True,
+                average_attn_weights=False,
+                key_padding_mask=key_padding_mask
+            )
+        else:
+            attn_out, attn_w = self._sdpa(x, key_padding_mask), None
         x = self.norm1(x + self.dropout(attn_out))
         x = self.norm2(x + self.dropout(self.linear2(torch.relu(self.linear1(x)))))
         return x, attn_w
@@ -111,8 +288,10 @@ class ByteBERT(nn.Module):
         all_attn = []
         hidden_per_layer = []  # store token embeddings after each layer
 
+        # Per-head weights are only materialised when the caller asks for them
+        need_weights = return_attn or return_hidden_all
         for layer in self.layers:
-            h, attn = layer(h, key_padding_mask=key_padding_mask)
+            h, attn = layer(h, key_padding_mask=key_padding_mask, need_weights=need_weights)
             if return_hidden_all or return_hidden_last:
                 hidden_per_layer.append(h)
             if return_attn or return_hidden_all:  # compute only if needed
@@ -145,6 +324,22 @@ class ByteBERT(nn.Module):
             out["pre_encoded"] = pre_encoded                # [B,T,D]
         return out
 
+class LOOHead(nn.Module):
+    """Encoder + output layer for leave-one-out rows: logits at one position per row.
+
+    forward(x [B, T], lengths [B], pos [B]) -> [B, VOCAB_SIZE], with the padding mask
+    built inside, so the module can be traced / exported with dynamic B and T.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x, lengths, pos):
+        key_pad = torch.arange(x.size(1), device=x.device).unsqueeze(0) >= lengths.unsqueeze(1)
+        h = self.model(x, key_padding_mask=key_pad, return_logits=False, return_hidden_last=True)["last_hidden"]
+        ar = torch.arange(x.size(0), device=x.device)
+        return self.model.fc(h[ar, pos])
+
 # -----------------------------
 # Masking
 # -----------------------------
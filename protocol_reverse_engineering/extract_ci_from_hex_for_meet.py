@@ -1,6 +1,10 @@
 import argparse
 import os
 import json
+import re
+import sys
+
+import numpy as np
 
 # Loaded from usermap file
 USER_MAP = {}
@@ -8,6 +12,9 @@ USER_MAP = {}
 # SSRC to media type mapping based on RTP packets
 SSRC_MEDIA = {}
 
+# RTP/RTCP common header
+MIN_TOKENS = 8
+
 
 def get_usermap_path_from_hex(hex_path: str) -> str:
     hex_dir = os.path.dirname(os.path.abspath(hex_path))
@@ -47,6 +54,14 @@ def parse_line(tokens, args):
     except ValueError:
         return ""
 
+    return parse_payload(b, args)
+
+
+def parse_payload(b, args):
+    """Parse one UDP payload given as bytes or a list of ints."""
+    if len(b) < 8:
+        return ""
+
     # RTP common header fields
     b0 = b[0]
     version = (b0 >> 6) & 0x03
@@ -184,27 +199,298 @@ def parse_line(tokens, args):
     return ""
 
 
+# -----------------------------
+# Batch engine (NumPy)
+# -----------------------------
+# Decoded RTP/RTCP common header, one record per packet
+HEADER_DTYPE = np.dtype([
+    ("valid", "?"),      # >= 8 bytes and RTP version 2
+    ("rtcp", "?"),       # PT byte in 200..210
+    ("pt", "u1"),        # RTP PT, marker bit removed
+    ("cc", "u1"),        # CSRC count
+    ("x", "?"),          # extension flag
+    ("ext_count", "u2"), # header-extension words (0 if absent or truncated)
+    ("ssrc", "u4"),      # bytes 8..11 for RTP, 4..7 for RTCP
+    ("csrc", "u4"),      # first CSRC
+    ("has_csrc", "?"),
+])
+
+# Per-packet flow tuple; users are indices into the names list returned alongside
+FLOW_DTYPE = np.dtype([
+    ("sender", "i4"),
+    ("recipient", "i4"),
+    ("subject", "i4"),
+    ("typ", "i1"),
+    ("value", "i1"),
+])
+
+NO_USER = -1
+TYPES = (None, "audio", "video")
+TYP_AUDIO, TYP_VIDEO = 1, 2
+VALUES = (None, "low", "high", "on", "unmute")
+VAL_LOW, VAL_HIGH, VAL_ON, VAL_UNMUTE = 1, 2, 3, 4
+MEDIA_CODES = {"audio": TYP_AUDIO, "video": TYP_VIDEO}
+
+# Widest header byte read: extension length at 12 + 15 * 4 + 3
+HEADER_WIDTH = 76
+
+
+def _be32(payloads, idx):
+    return ((payloads[:, idx].astype(np.uint32) << 24) |
+            (payloads[:, idx + 1].astype(np.uint32) << 16) |
+            (payloads[:, idx + 2].astype(np.uint32) << 8) |
+            payloads[:, idx + 3].astype(np.uint32))
+
+
+def decode_headers(payloads, lengths):
+    """Decode the RTP/RTCP header fields of a [N, W] uint8 payload matrix."""
+    payloads = np.asarray(payloads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if payloads.shape[1] < HEADER_WIDTH:
+        payloads = np.pad(payloads, ((0, 0), (0, HEADER_WIDTH - payloads.shape[1])))
+
+    hdr = np.zeros(len(lengths), dtype=HEADER_DTYPE)
+    b0 = payloads[:, 0]
+    b1 = payloads[:, 1]
+    hdr["valid"] = (lengths >= 8) & ((b0 >> 6) == 2)
+    hdr["rtcp"] = (b1 >= 200) & (b1 <= 210)
+    hdr["pt"] = b1 & 0x7F
+    cc = (b0 & 0x0F).astype(np.int64)
+    hdr["cc"] = cc
+    hdr["x"] = (b0 & 0x10) != 0
+
+    # Extension words sit right after the CSRC list
+    ext_pos = 12 + cc * 4
+    rows = np.arange(len(lengths))
+    words = ((payloads[rows, ext_pos + 2].astype(np.int64) << 8) |
+             payloads[rows, ext_pos + 3].astype(np.int64))
+    ext_ok = hdr["x"] & (lengths >= ext_pos + 4) & (ext_pos + 4 + words * 4 <= lengths)
+    hdr["ext_count"] = np.where(ext_ok, words, 0)
+
+    hdr["ssrc"] = np.where(hdr["rtcp"], _be32(payloads, 4), _be32(payloads, 8))
+    hdr["csrc"] = _be32(payloads, 12)
+    hdr["has_csrc"] = (cc > 0) & (lengths >= 16)
+    return hdr
+
+
+class UserIndex:
+    # Sorted uint32 SSRC keys for np.searchsorted; only exact 8-digit uppercase keys can match
+    def __init__(self, usermap, client):
+        items = sorted((int(k, 16), v) for k, v in usermap.items() if re.fullmatch(r"[0-9A-F]{8}", k))
+        self.names = sorted({v for _, v in items} | {client}, key=str)
+        ids = {name: i for i, name in enumerate(self.names)}
+        self.keys = np.array([k for k, _ in items], dtype=np.uint32)
+        self.ids = np.array([ids[v] for _, v in items], dtype=np.int32)
+        self.client_id = ids[client]
+
+    def lookup(self, keys):
+        out = np.full(len(keys), NO_USER, dtype=np.int32)
+        if len(self.keys):
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            hit = self.keys[pos] == keys
+            out[hit] = self.ids[pos[hit]]
+        return out
+
+
+def resolve_media(hdr, update, media, ssrc_media):
+    """Media type seen by each row, i.e. SSRC_MEDIA[ssrc] just before that row.
+
+    Rows with update=True assign media[row] to their SSRC, in capture order.
+    ssrc_media (uint32 SSRC -> code) is the table carried in from earlier chunks
+    and is updated in place with this chunk's last assignment per SSRC.
+    """
+    n = len(hdr)
+    ssrc = hdr["ssrc"]
+    # Group rows by SSRC, capture order within a group
+    order = np.lexsort((np.arange(n), ssrc))
+    upd_sorted = update[order]
+    ssrc_sorted = ssrc[order]
+    # Forward-fill the position of the latest update, strictly before each row
+    pos = np.where(upd_sorted, np.arange(n), -1)
+    last = np.maximum.accumulate(pos)
+    prev = np.concatenate(([-1], last[:-1]))
+    same = prev >= 0
+    same[same] = ssrc_sorted[prev[same]] == ssrc_sorted[same]
+
+    seen = np.zeros(n, dtype=np.int8)
+    seen[order[same]] = media[order[prev[same]]]
+
+    # No update earlier in this chunk: fall back to the carried-in table
+    carried = ~same
+    if ssrc_media and carried.any():
+        idx = order[carried]
+        seen[idx] = [ssrc_media.get(k, 0) for k in ssrc[idx].tolist()]
+
+    # Last assignment per SSRC wins
+    last_rows = np.nonzero(update)[0]
+    ssrc_media.update(zip(ssrc[last_rows].tolist(), media[last_rows].tolist()))
+    return seen
+
+
+def flows_matrix(payloads, lengths, client, usermap, ssrc_media=None):
+    """Batch equivalent of parse_payload over a [N, W] uint8 payload matrix.
+
+    Returns (flows, names): a FLOW_DTYPE array with user indices into names.
+    Pass the same ssrc_media dict across consecutive chunks of one capture to
+    keep the RTCP-after-RTP lookup identical to a single sequential pass.
+    """
+    if ssrc_media is None:
+        ssrc_media = {}
+    hdr = decode_headers(payloads, lengths)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    users = UserIndex(usermap, client)
+
+    flows = np.zeros(len(hdr), dtype=FLOW_DTYPE)
+    flows["sender"] = flows["recipient"] = flows["subject"] = NO_USER
+
+    # RTP rows that reach the SSRC_MEDIA assignment
+    rtp = hdr["valid"] & ~hdr["rtcp"] & (lengths >= 12)
+    video = rtp & (hdr["pt"] == 120) & (hdr["ext_count"] >= 1)
+    audio = rtp & (hdr["pt"] == 109)
+    update = video | audio
+    media = np.where(video, TYP_VIDEO, np.where(audio, TYP_AUDIO, 0)).astype(np.int8)
+
+    rtcp = hdr["valid"] & hdr["rtcp"]
+    seen = resolve_media(hdr, update, media, ssrc_media)
+
+    # CSRC first, then SSRC
+    ssrc_user = users.lookup(hdr["ssrc"])
+    csrc_user = np.where(hdr["has_csrc"], users.lookup(hdr["csrc"]), NO_USER)
+    rtp_user = np.where(csrc_user != NO_USER, csrc_user, ssrc_user)
+
+    rtp_rows = update & (rtp_user != NO_USER)
+    rtcp_rows = rtcp & (seen != 0) & (ssrc_user != NO_USER)
+    user = np.where(rtp_rows, rtp_user, np.where(rtcp_rows, ssrc_user, NO_USER))
+    emit = rtp_rows | rtcp_rows
+    is_client = user == users.client_id
+
+    flows["typ"] = np.where(rtp_rows, media, np.where(rtcp_rows, seen, 0))
+    value = np.zeros(len(hdr), dtype=np.int8)
+    value[rtp_rows & audio] = VAL_UNMUTE
+    value[rtp_rows & video] = np.where(hdr["ext_count"][rtp_rows & video] == 1, VAL_LOW, VAL_HIGH)
+    value[rtp_rows & video & is_client] = VAL_ON
+    value[rtcp_rows] = np.where(seen[rtcp_rows] == TYP_VIDEO, VAL_ON, VAL_UNMUTE)
+    flows["value"] = value
+
+    flows["sender"][emit] = user[emit]
+    flows["subject"][emit] = user[emit]
+    flows["recipient"][emit] = np.where(is_client[emit], user[emit], users.client_id)
+    return flows, users.names
+
+
+def format_flows(flows, names):
+    # FLOW_DTYPE rows -> .net lines, same truthiness rules as parse_payload
+    out = []
+    for snd, rcp, subj, typ, val in flows.tolist():
+        if typ == 0:
+            out.append("")
+            continue
+        snd, rcp, subj = names[snd], names[rcp], names[subj]
+        typ, val = TYPES[typ], VALUES[val]
+        if snd and rcp and subj and val:
+            out.append(f"{snd}_{rcp}_{subj}_{typ}_{val}")
+        elif snd and rcp and subj:
+            out.append(f"{snd}_{rcp}_{subj}_{typ}")
+        else:
+            out.append("")
+    return out
+
+
+def parse_matrix(payloads, lengths, client, usermap, ssrc_media=None):
+    flows, names = flows_matrix(payloads, lengths, client, usermap, ssrc_media)
+    return format_flows(flows, names)
+
+
+def iter_matrix_chunks(args, chunk_rows=1 << 20):
+    # Bounded-memory (payload, length) slices: a store stays memory-mapped and a .hex file
+    # is read chunk_rows lines at a time. Rows are cut to the header bytes the batch engine
+    # reads, except under --verify, which re-parses whole rows
+    width = None if args.verify else HEADER_WIDTH
+    if args.hex:
+        from payload_store import iter_hex_matrix
+        yield from iter_hex_matrix(args.hex, chunk_rows, max_len=width)
+        return
+    from payload_store import load_store
+    store = load_store(args.store)
+    for start in range(0, len(store), chunk_rows):
+        yield (np.asarray(store.payload[start:start + chunk_rows, :width]),
+               np.asarray(store.length[start:start + chunk_rows]))
+
+
+def verify_chunk(payloads, lengths, lines, args, offset=0):
+    # Differential check of the batch engine against parse_payload; SSRC_MEDIA must
+    # carry over between chunks exactly as in one sequential pass
+    mismatches = 0
+    for i, line in enumerate(lines):
+        payload = payloads[i, :lengths[i]].tobytes()
+        expected = "" if len(payload) < MIN_TOKENS else parse_payload(payload, args)
+        if expected != line:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"row {offset + i}: per-packet={expected!r} batch={line!r}", file=sys.stderr)
+    return mismatches
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--hex', type=str, required=True)
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument('--hex', type=str)
+    src.add_argument('--store', type=str,
+                     help='Binary payload store (.pkt) written by payload_store.py')
     parser.add_argument('--client', type=str, required=True)
     parser.add_argument('--usermap', type=str, required=False,
                         help='Optional path to usermap JSON file')
+    parser.add_argument('--ssrc_index', type=str, required=False,
+                        help='Frozen SSRC index (.npz) from ssrc_index.py, used instead of the usermap')
+    parser.add_argument('--batch', action='store_true',
+                        help='Classify packets in chunks over a NumPy payload matrix')
+    parser.add_argument('--verify', action='store_true',
+                        help='Run the batch engine and check it against the per-packet parser')
+    parser.add_argument('--chunk_rows', type=int, default=1 << 20,
+                        help='Packets per batch chunk (default: 1048576)')
     args = parser.parse_args()
 
     # Determine usermap path
     if args.usermap:
         usermap_path = args.usermap
     else:
-        usermap_path = get_usermap_path_from_hex(args.hex)
+        usermap_path = get_usermap_path_from_hex(args.hex or args.store)
 
     global USER_MAP
-    USER_MAP = load_usermap(usermap_path)
+    if args.ssrc_index:
+        from ssrc_index import load_index
+        USER_MAP = load_index(args.ssrc_index).to_usermap()
+    else:
+        USER_MAP = load_usermap(usermap_path)
+
+    if args.batch or args.verify:
+        ssrc_media = {}
+        total = mismatches = 0
+        for payloads, lengths in iter_matrix_chunks(args, args.chunk_rows):
+            lines = parse_matrix(payloads, lengths, args.client, USER_MAP, ssrc_media)
+            if args.verify:
+                mismatches += verify_chunk(payloads, lengths, lines, args, offset=total)
+            else:
+                print("\n".join(lines))
+            total += len(lines)
+        if args.verify:
+            print(f"Verified {total} packets, {mismatches} mismatches", file=sys.stderr)
+            sys.exit(0 if mismatches == 0 else 1)
+        return
+
+    if args.store:
+        from payload_store import load_store
+        for payload in load_store(args.store).iter_payloads():
+            if len(payload) < MIN_TOKENS:
+                print("")
+                continue
+            print(parse_payload(payload, args))
+        return
 
     with open(args.hex, 'r') as f:
         for line in f:
             tokens = line.strip().split()
-            if len(tokens) < 8:
+            if len(tokens) < MIN_TOKENS:
                 print("")
                 continue
             print(parse_line(tokens, args))
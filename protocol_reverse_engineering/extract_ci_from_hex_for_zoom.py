@@ -1,17 +1,25 @@
 import argparse
 import os
+import re
+import sys
 import json
+from collections import namedtuple
+
+import numpy as np
 
 USER_MAP = {}
 
+# Shorter payloads cannot carry any of the parsed opcodes
+MIN_TOKENS = 30
+
 VALUE_MAP = {
-    '0': 'low',
-    '1': 'medium',
-    '2': 'high'
+    0x0: 'low',
+    0x1: 'medium',
+    0x2: 'high'
 }
 
-def get_value_from_nibble(byte_str):
-    return VALUE_MAP.get(byte_str[1], None)
+def get_value_from_nibble(byte_val):
+    return VALUE_MAP.get(byte_val & 0x0F, None)
 
 
 def get_usermap_path_from_hex(hex_path: str) -> str:
@@ -38,45 +46,51 @@ def load_usermap(path: str) -> dict:
     return {}
 
 
-def get_user(tokens, start_idx):
-    if start_idx >= len(tokens):
+def get_user(payload, start_idx):
+    if start_idx >= len(payload):
         return ""
-    end_idx = start_idx + 4
-    if end_idx > len(tokens):
-        key = ''.join(tokens[start_idx:]).upper()
-    else:
-        key = ''.join(tokens[start_idx:end_idx]).upper()
+    key = payload[start_idx:start_idx + 4].hex().upper()
     return USER_MAP.get(key, key)
 
 
 def parse_line(tokens, args):
-    if tokens[0] != '05':
+    # Malformed hex gives an empty line, as in the Meet parser
+    try:
+        payload = bytes.fromhex(''.join(tokens))
+    except ValueError:
+        return ""
+    return parse_payload(payload, args)
+
+
+def parse_payload(payload, args):
+    # payload: raw UDP payload bytes (already truncated to the hex width)
+    if payload[0] != 0x05:
         return ""
 
     results = []
-    byte8 = tokens[7]
-    byte9 = tokens[8]
-    byte16 = tokens[15] if len(tokens) > 15 else None
+    byte8 = payload[7]
+    byte9 = payload[8]
+    byte16 = payload[15] if len(payload) > 15 else None
 
     sender = recipient = subject = typ = value = None
 
-    if byte8 in ['00', '01']:
+    if byte8 in (0x00, 0x01):
         sender = args.client
-    if byte8 in ['04', '05']:
+    if byte8 in (0x04, 0x05):
         recipient = args.client
 
     def process_case(subject_idx, value_idx=None, type_str=None,
                      fixed_value=None, is_sender=False, is_recipient=False):
         nonlocal sender, recipient, subject, value, typ
         try:
-            subject = get_user(tokens, subject_idx)
+            subject = get_user(payload, subject_idx)
         except Exception:
             return None
         typ = type_str
         if fixed_value:
             value = fixed_value
         elif value_idx is not None:
-            value = get_value_from_nibble(tokens[value_idx])
+            value = get_value_from_nibble(payload[value_idx])
         if is_sender:
             sender = subject
         if is_recipient:
@@ -87,83 +101,287 @@ def parse_line(tokens, args):
             return f"{sender}_{recipient}_{subject}_{typ}"
         return None
 
-    if byte8 == '00':
-        if byte9 == '10':
+    if byte8 == 0x00:
+        if byte9 == 0x10:
             results.append(process_case(40, 54, 'video', is_recipient=True))
-        elif byte9 == '0F':
+        elif byte9 == 0x0F:
             results.append(process_case(35, None, 'audio', fixed_value='unmute', is_recipient=True))
-        elif byte9 == '21':
+        elif byte9 == 0x21:
             results.append(process_case(28, None, 'video', fixed_value='on', is_recipient=True))
-        elif byte9 == '22':
+        elif byte9 == 0x22:
             results.append(process_case(28, None, 'audio', fixed_value='unmute', is_recipient=True))
-        elif byte9 == '20':
-            sender = get_user(tokens, 14)
+        elif byte9 == 0x20:
+            sender = get_user(payload, 14)
             results.append(process_case(21, 27, 'video', is_recipient=True))
 
-    elif byte8 == '01':
-        if byte16 == '10':
+    elif byte8 == 0x01:
+        if byte16 == 0x10:
             results.append(process_case(47, 61, 'video', is_recipient=True))
-        elif byte16 == '0F':
+        elif byte16 == 0x0F:
             results.append(process_case(42, None, 'audio', fixed_value='unmute', is_recipient=True))
-        elif byte16 == '21':
+        elif byte16 == 0x21:
             results.append(process_case(35, None, 'video', fixed_value='on', is_recipient=True))
-        elif byte16 == '22':
+        elif byte16 == 0x22:
             results.append(process_case(35, None, 'audio', fixed_value='unmute', is_recipient=True))
-        elif byte16 == '20':
+        elif byte16 == 0x20:
             results.append(process_case(28, 34, 'video', is_recipient=True))
 
-    elif byte8 == '04':
-        if byte9 == '10':
-            if tokens[23] in ['06', '0F']:
+    elif byte8 == 0x04:
+        if byte9 == 0x10:
+            if payload[23] in (0x06, 0x0F):
                 results.append(process_case(42, 65, 'video', is_sender=True))
             else:
                 results.append(process_case(40, 54, 'video', is_sender=True))
-        elif byte9 == '0F':
+        elif byte9 == 0x0F:
             results.append(process_case(35, None, 'audio', fixed_value='unmute', is_sender=True))
-        elif byte9 == '21':
+        elif byte9 == 0x21:
             results.append(process_case(28, None, 'video', fixed_value='on', is_sender=True))
-        elif byte9 == '22':
+        elif byte9 == 0x22:
             results.append(process_case(28, None, 'audio', fixed_value='unmute', is_sender=True))
-        elif byte9 == '20':
-            sender = get_user(tokens, 14)
+        elif byte9 == 0x20:
+            sender = get_user(payload, 14)
             results.append(process_case(21, 27, 'video', is_sender=False))
 
-    elif byte8 == '05':
-        if byte16 == '10':
+    elif byte8 == 0x05:
+        if byte16 == 0x10:
             results.append(process_case(47, 61, 'video', is_sender=True))
-        elif byte16 == '0F':
+        elif byte16 == 0x0F:
             results.append(process_case(42, None, 'audio', fixed_value='unmute', is_sender=True))
-        elif byte16 == '21':
+        elif byte16 == 0x21:
             results.append(process_case(35, None, 'video', fixed_value='on', is_sender=True))
-        elif byte16 == '22':
+        elif byte16 == 0x22:
             results.append(process_case(35, None, 'audio', fixed_value='unmute', is_sender=True))
-        elif byte16 == '20':
-            sender = get_user(tokens, 21)
+        elif byte16 == 0x20:
+            sender = get_user(payload, 21)
             results.append(process_case(28, 34, 'video', is_sender=False))
 
     return ', '.join(filter(None, results)) if results else ""
 
 
+# -----------------------------
+# Batch engine over a payload matrix
+# -----------------------------
+# One entry per branch of parse_payload, keyed by byte[7] and the opcode byte
+# (byte[8] for modes 00/04, byte[15] for modes 01/05).
+#   alt23:      for 04/0x10 only, whether byte[23] is 0x06/0x0F
+#   role:       'recipient' -> recipient = subject, 'sender' -> sender = subject
+#   sender_idx: sender is overridden by the user at this offset (0x20 packets)
+ZoomCase = namedtuple("ZoomCase", "byte8 op_idx opcode alt23 subject_idx value_idx typ fixed_value role sender_idx")
+
+ZOOM_CASES = [
+    ZoomCase(0x00, 8, 0x10, None, 40, 54, 'video', None, 'recipient', None),
+    ZoomCase(0x00, 8, 0x0F, None, 35, None, 'audio', 'unmute', 'recipient', None),
+    ZoomCase(0x00, 8, 0x21, None, 28, None, 'video', 'on', 'recipient', None),
+    ZoomCase(0x00, 8, 0x22, None, 28, None, 'audio', 'unmute', 'recipient', None),
+    ZoomCase(0x00, 8, 0x20, None, 21, 27, 'video', None, 'recipient', 14),
+    ZoomCase(0x01, 15, 0x10, None, 47, 61, 'video', None, 'recipient', None),
+    ZoomCase(0x01, 15, 0x0F, None, 42, None, 'audio', 'unmute', 'recipient', None),
+    ZoomCase(0x01, 15, 0x21, None, 35, None, 'video', 'on', 'recipient', None),
+    ZoomCase(0x01, 15, 0x22, None, 35, None, 'audio', 'unmute', 'recipient', None),
+    ZoomCase(0x01, 15, 0x20, None, 28, 34, 'video', None, 'recipient', None),
+    ZoomCase(0x04, 8, 0x10, True, 42, 65, 'video', None, 'sender', None),
+    ZoomCase(0x04, 8, 0x10, False, 40, 54, 'video', None, 'sender', None),
+    ZoomCase(0x04, 8, 0x0F, None, 35, None, 'audio', 'unmute', 'sender', None),
+    ZoomCase(0x04, 8, 0x21, None, 28, None, 'video', 'on', 'sender', None),
+    ZoomCase(0x04, 8, 0x22, None, 28, None, 'audio', 'unmute', 'sender', None),
+    ZoomCase(0x04, 8, 0x20, None, 21, 27, 'video', None, None, 14),
+    ZoomCase(0x05, 15, 0x10, None, 47, 61, 'video', None, 'sender', None),
+    ZoomCase(0x05, 15, 0x0F, None, 42, None, 'audio', 'unmute', 'sender', None),
+    ZoomCase(0x05, 15, 0x21, None, 35, None, 'video', 'on', 'sender', None),
+    ZoomCase(0x05, 15, 0x22, None, 35, None, 'audio', 'unmute', 'sender', None),
+    ZoomCase(0x05, 15, 0x20, None, 28, 34, 'video', None, None, 21),
+]
+
+# Widest byte read: the value byte at 65 (user keys end by byte 50)
+HEADER_WIDTH = max(c.value_idx or 0 for c in ZOOM_CASES) + 1
+
+# Low nibble -> quality value (None for anything outside VALUE_MAP)
+NIBBLE_VALUES = np.array([VALUE_MAP.get(n) for n in range(16)], dtype=object)
+
+
+class UserIndex:
+    # Sorted uint32 SSRC keys for np.searchsorted; only exact 8-digit uppercase keys can match
+    def __init__(self, usermap):
+        self.usermap = usermap
+        items = sorted((int(k, 16), v) for k, v in usermap.items() if re.fullmatch(r"[0-9A-F]{8}", k))
+        self.keys = np.array([k for k, _ in items], dtype=np.uint32)
+        self.names = np.array([v for _, v in items], dtype=object)
+
+    def lookup(self, payloads, lengths, rows, idx):
+        # Vectorized get_user(payload, idx) for the given rows
+        out = np.empty(len(rows), dtype=object)
+        avail = lengths[rows].astype(np.int64) - idx
+        out[avail <= 0] = ""
+
+        full = avail >= 4
+        if full.any():
+            r = rows[full]
+            keys = ((payloads[r, idx].astype(np.uint32) << 24) |
+                    (payloads[r, idx + 1].astype(np.uint32) << 16) |
+                    (payloads[r, idx + 2].astype(np.uint32) << 8) |
+                    payloads[r, idx + 3].astype(np.uint32))
+            names = np.empty(len(keys), dtype=object)
+            hit = np.zeros(len(keys), dtype=bool)
+            if len(self.keys):
+                pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+                hit = self.keys[pos] == keys
+                names[hit] = self.names[pos[hit]]
+            if not hit.all():
+                # Unmapped SSRCs fall back to their hex string, as get_user does
+                miss_hex = keys[~hit].astype(">u4").tobytes().hex().upper()
+                names[~hit] = np.frombuffer(miss_hex.encode(), dtype="S8").astype(str)
+            out[full] = names
+
+        # Fewer than 4 bytes left: rare, handled like the per-packet path
+        for i in np.nonzero((avail > 0) & ~full)[0]:
+            r = rows[i]
+            key = payloads[r, idx:lengths[r]].tobytes().hex().upper()
+            out[i] = self.usermap.get(key, key)
+        return out
+
+
+def parse_matrix(payloads, lengths, client, usermap):
+    """Batch equivalent of parse_payload over a [N, W] uint8 payload matrix.
+
+    Returns one output line per row, identical to what main() prints per hex line.
+    """
+    payloads = np.asarray(payloads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    n = len(lengths)
+    if payloads.shape[1] < HEADER_WIDTH:
+        payloads = np.pad(payloads, ((0, 0), (0, HEADER_WIDTH - payloads.shape[1])))
+
+    out = [""] * n
+    users = UserIndex(usermap)
+    candidate = (lengths >= MIN_TOKENS) & (payloads[:, 0] == 0x05)
+    byte8 = payloads[:, 7]
+    alt23 = np.isin(payloads[:, 23], (0x06, 0x0F))
+
+    for case in ZOOM_CASES:
+        mask = candidate & (byte8 == case.byte8) & (payloads[:, case.op_idx] == case.opcode)
+        if case.alt23 is not None:
+            mask &= alt23 if case.alt23 else ~alt23
+        rows = np.nonzero(mask)[0]
+        if not len(rows):
+            continue
+
+        subject = users.lookup(payloads, lengths, rows, case.subject_idx)
+        if case.fixed_value:
+            value = np.full(len(rows), case.fixed_value, dtype=object)
+        elif case.value_idx is not None:
+            short = lengths[rows] <= case.value_idx
+            if short.any():
+                raise IndexError(f"payload row {rows[short][0]} too short for value byte {case.value_idx}")
+            value = NIBBLE_VALUES[payloads[rows, case.value_idx] & 0x0F]
+        else:
+            value = np.full(len(rows), None, dtype=object)
+
+        if case.sender_idx is not None:
+            sender = users.lookup(payloads, lengths, rows, case.sender_idx)
+        else:
+            sender = np.full(len(rows), client if case.byte8 in (0x00, 0x01) else None, dtype=object)
+        recipient = np.full(len(rows), client if case.byte8 in (0x04, 0x05) else None, dtype=object)
+        if case.role == 'recipient':
+            recipient = subject
+        elif case.role == 'sender':
+            sender = subject
+
+        typ = case.typ
+        for r, snd, rcp, subj, val in zip(rows.tolist(), sender, recipient, subject, value):
+            if snd and rcp and subj and val:
+                out[r] = f"{snd}_{rcp}_{subj}_{typ}_{val}"
+            elif snd and rcp and subj:
+                out[r] = f"{snd}_{rcp}_{subj}_{typ}"
+    return out
+
+
+def iter_matrix_chunks(args, chunk_rows=1 << 20):
+    # Bounded-memory (payload, length) slices: a store stays memory-mapped and a .hex file
+    # is read chunk_rows lines at a time. Rows are cut to the header bytes the batch engine
+    # reads, except under --verify, which re-parses whole rows
+    width = None if args.verify else HEADER_WIDTH
+    if args.hex:
+        from payload_store import iter_hex_matrix
+        yield from iter_hex_matrix(args.hex, chunk_rows, max_len=width)
+        return
+    from payload_store import load_store
+    store = load_store(args.store)
+    for start in range(0, len(store), chunk_rows):
+        yield (np.asarray(store.payload[start:start + chunk_rows, :width]),
+               np.asarray(store.length[start:start + chunk_rows]))
+
+
+def verify_chunk(payloads, lengths, lines, args, offset=0):
+    # Differential check of the batch engine against parse_payload, row by row
+    mismatches = 0
+    for i, line in enumerate(lines):
+        payload = payloads[i, :lengths[i]].tobytes()
+        expected = "" if len(payload) < MIN_TOKENS else parse_payload(payload, args)
+        if expected != line:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"row {offset + i}: per-packet={expected!r} batch={line!r}", file=sys.stderr)
+    return mismatches
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--hex', type=str, required=True)
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument('--hex', type=str)
+    src.add_argument('--store', type=str,
+                     help='Binary payload store (.pkt) written by payload_store.py')
     parser.add_argument('--client', type=str, required=True)
     parser.add_argument('--usermap', type=str, required=False,
                         help='Optional path to usermap file')
+    parser.add_argument('--ssrc_index', type=str, required=False,
+                        help='Frozen SSRC index (.npz) from ssrc_index.py, used instead of the usermap')
+    parser.add_argument('--batch', action='store_true',
+                        help='Classify packets in chunks over a NumPy payload matrix')
+    parser.add_argument('--verify', action='store_true',
+                        help='Run the batch engine and check it against the per-packet parser')
+    parser.add_argument('--chunk_rows', type=int, default=1 << 20,
+                        help='Packets per batch chunk (default: 1048576)')
     args = parser.parse_args()
 
     if args.usermap:
         usermap_path = args.usermap
     else:
-        usermap_path = get_usermap_path_from_hex(args.hex)
+        usermap_path = get_usermap_path_from_hex(args.hex or args.store)
 
     global USER_MAP
-    USER_MAP = load_usermap(usermap_path)
+    if args.ssrc_index:
+        from ssrc_index import load_index
+        USER_MAP = load_index(args.ssrc_index).to_usermap()
+    else:
+        USER_MAP = load_usermap(usermap_path)
+
+    if args.batch or args.verify:
+        total = mismatches = 0
+        for payloads, lengths in iter_matrix_chunks(args, args.chunk_rows):
+            lines = parse_matrix(payloads, lengths, args.client, USER_MAP)
+            if args.verify:
+                mismatches += verify_chunk(payloads, lengths, lines, args, offset=total)
+            else:
+                print("\n".join(lines))
+            total += len(lines)
+        if args.verify:
+            print(f"Verified {total} packets, {mismatches} mismatches", file=sys.stderr)
+            sys.exit(0 if mismatches == 0 else 1)
+        return
+
+    if args.store:
+        from payload_store import load_store
+        for payload in load_store(args.store).iter_payloads():
+            if len(payload) < MIN_TOKENS:
+                print("")
+                continue
+            print(parse_payload(payload, args))
+        return
 
     with open(args.hex, 'r') as f:
         for line in f:
             tokens = line.strip().split()
-            if len(tokens) < 30:
+            if len(tokens) < MIN_TOKENS:
                 print("")
                 continue
             print(parse_line(tokens, args))
@@ -22,9 +22,17 @@ def save_hex_output(hex_lines, output_path):
 def main():
     parser = argparse.ArgumentParser(description="Extract UDP payloads in hex format from pcap")
     parser.add_argument("--pcap", required=True, help="Path to the pcap file")
+    parser.add_argument("--store", action="store_true",
+                        help="Write a binary payload store (<pcap stem>.pkt) instead of a .hex file")
     args = parser.parse_args()
 
     pcap_path = args.pcap
+    if args.store:
+        from payload_store import pcap_to_store
+        store_path, n = pcap_to_store(pcap_path)
+        print(f"Payload store ({n} packets) saved to {store_path}")
+        return
+
     hex_lines = extract_udp_payloads(pcap_path)
 
     hex_path = os.path.splitext(pcap_path)[0] + '.hex'
@@ -0,0 +1,136 @@
+import argparse
+import os
+
+import preprocess_pcap_for_zoom
+import preprocess_pcap_for_meet
+import extract_ci_from_hex_for_zoom
+import extract_ci_from_hex_for_meet
+from pcap_utils import PcapReader, PcapWriter, parse_udp
+
+# vca -> (preprocess module, CI extractor module)
+PIPELINES = {
+    "zoom": (preprocess_pcap_for_zoom, extract_ci_from_hex_for_zoom),
+    "meet": (preprocess_pcap_for_meet, extract_ci_from_hex_for_meet),
+}
+
+DEFAULT_SKIP = {"zoom": 200, "meet": 105}
+
+
+def collect_payloads(input_pcap, pre, skip_seconds, max_bytes=80, sink=None,
+                     tee_pcap=None, tee_hex=None, chunk_size=1 << 20, ssrc_stats=None):
+    # One pass over the raw capture: skip window, port filter, SSRC discovery, truncation
+    # Each filtered payload is handed to sink(payload) as it is read, so nothing accumulates;
+    # ssrc_stats, if given, collects {ssrc_hex: [first_ts, last_ts, count]} as in ssrc_index.py
+    filename = os.path.basename(input_pcap)
+    cutoff = pre.extract_timestamp_from_filename(filename).timestamp() + skip_seconds
+    port = pre.SERVER_PORT
+
+    count = 0
+    client_ssrcs = set()
+
+    reader = PcapReader(input_pcap, chunk_size=chunk_size)
+    pcap_out = PcapWriter(tee_pcap, reader.header, chunk_size=chunk_size) if tee_pcap else None
+    hex_out = open(tee_hex, "w") if tee_hex else None
+    try:
+        for ts, hdr, data in reader:
+            if ts <= cutoff:
+                continue
+            udp = parse_udp(data, reader.linktype)
+            if udp is None:
+                continue
+            sport, dport, payload = udp
+            if sport != port and dport != port:
+                continue
+
+            if dport == port:
+                ssrc_hex = pre.extract_ssrc_from_udp_payload(payload)
+                if ssrc_hex is not None:
+                    client_ssrcs.add(ssrc_hex)
+                    if ssrc_stats is not None:
+                        entry = ssrc_stats.setdefault(ssrc_hex, [ts, ts, 0])
+                        entry[1] = ts
+                        entry[2] += 1
+
+            payload = payload[:max_bytes]
+            count += 1
+            if sink is not None:
+                sink(payload)
+            if pcap_out is not None:
+                pcap_out.write(hdr, data)
+            if hex_out is not None:
+                hex_out.write(payload.hex(" ").upper() + "\n")
+    finally:
+        reader.close()
+        if pcap_out is not None:
+            pcap_out.close()
+        if hex_out is not None:
+            hex_out.close()
+
+    return count, client_ssrcs
+
+
+def run_pipeline(args):
+    pre, ci = PIPELINES[args.vca]
+
+    base_name = os.path.basename(args.pcap)
+    base_path = os.path.dirname(args.pcap)
+    stem = os.path.splitext(f"preprocessed_{base_name}")[0]
+    tee_pcap = os.path.join(base_path, f"preprocessed_{base_name}") if args.tee_pcap else None
+    tee_hex = os.path.join(base_path, f"{stem}.hex") if args.tee_hex else None
+
+    skip = DEFAULT_SKIP[args.vca] if args.skip is None else args.skip
+
+    if args.ssrc_index:
+        # Frozen session index: nothing is written back
+        from ssrc_index import load_index
+        ci.USER_MAP = load_index(args.ssrc_index).to_usermap()
+    else:
+        # The usermap must be complete before CI parsing, so the client's SSRCs come from a
+        # pre-scan pass (nothing kept but the SSRC set). Same usermap resolution as the
+        # staged scripts (preprocessed files sit next to the capture)
+        _, client_ssrcs = collect_payloads(args.pcap, pre, skip, max_bytes=args.max_bytes)
+        usermap_path = args.usermap or pre.get_usermap_path(args.pcap)
+        pre.update_usermap(usermap_path, args.client, client_ssrcs)
+        ci.USER_MAP = ci.load_usermap(usermap_path)
+
+    if args.out:
+        out_path = args.out
+    else:
+        ts = pre.extract_timestamp_from_filename(base_name).strftime("%Y%m%d_%H%M%S")
+        out_path = os.path.join(base_path, f"{ts}.net")
+
+    def write_flow(payload):
+        f.write("\n" if len(payload) < ci.MIN_TOKENS else ci.parse_payload(payload, args) + "\n")
+
+    with open(out_path, "w") as f:
+        count, _ = collect_payloads(
+            args.pcap, pre, skip, max_bytes=args.max_bytes, sink=write_flow,
+            tee_pcap=tee_pcap, tee_hex=tee_hex
+        )
+
+    print(f"Network-level flows for {count} filtered packets saved to {out_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Raw pcap -> .net in one pass (preprocess + hex extraction + CI extraction)"
+    )
+    parser.add_argument("--vca", choices=sorted(PIPELINES), required=True)
+    parser.add_argument("--pcap", required=True, help="Path to the raw tcpdump_<date>_<time>.pcap")
+    parser.add_argument("--client", required=True, help="Client name to associate with SSRCs")
+    parser.add_argument("--skip", type=int, default=None,
+                        help="Seconds to skip after file start time (default: 200 for zoom, 105 for meet)")
+    parser.add_argument("--usermap", type=str, default=None, help="Optional path to usermap JSON file")
+    parser.add_argument("--ssrc_index", type=str, default=None,
+                        help="Frozen SSRC index from ssrc_index.py; used instead of the usermap")
+    parser.add_argument("--max_bytes", type=int, default=80, help="Payload truncation, as in extract_hex_from_pcap.py")
+    parser.add_argument("--out", type=str, default=None, help="Output .net path (default: <date>_<time>.net next to the pcap)")
+    parser.add_argument("--tee_pcap", action="store_true", help="Also write preprocessed_<pcap>")
+    parser.add_argument("--tee_hex", action="store_true", help="Also write preprocessed_<pcap>.hex")
+    args = parser.parse_args()
+
+    run_pipeline(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import argparse
 import re
 
+import numpy as np
+
 def extract_values(path):
     pattern = re.compile(r"ByteF\s+\d+:\s*(.*)")
     results = []
@@ -14,12 +16,40 @@ def extract_values(path):
     return results
 
 
+def extract_bitmap(path, hex_path, max_len=80):
+    # infer_structure.py --output ... --format bitmap -> space-separated field lines (evaluate_result.py format)
+    row_bytes = -(-max_len // 8)
+    packed = np.fromfile(path, dtype=np.uint8)
+    flags = np.unpackbits(packed[:len(packed) // row_bytes * row_bytes].reshape(-1, row_bytes),
+                          axis=1, count=max_len).astype(bool)
+
+    results = []
+    with open(hex_path, "r") as f:
+        # Empty lines are skipped, as FullPacketDataset / MappedPacketDataset do
+        packets = (line.split()[:max_len] for line in f if line.split())
+        for hex_bytes, row in zip(packets, flags):
+            fields = [hex_bytes[0].upper()]
+            for tok, flag in zip(hex_bytes[1:], row[1:]):
+                if flag:
+                    fields.append(tok.upper())
+                else:
+                    fields[-1] += tok.upper()
+            results.append(" ".join(fields))
+
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--target", required=True)
+    parser.add_argument("--target", required=True, help="infer_structure log, or a bitmap with --hex_file")
+    parser.add_argument("--hex_file", default=None, help="Packets of a --format bitmap target")
+    parser.add_argument("--max_len", type=int, default=80)
     args = parser.parse_args()
 
-    extracted = extract_values(args.target)
+    if args.hex_file:
+        extracted = extract_bitmap(args.target, args.hex_file, args.max_len)
+    else:
+        extracted = extract_values(args.target)
 
     for item in extracted:
         print(item)
@@ -0,0 +1,319 @@
+# finetune_bytebert.py
+#
+# Incremental ByteBERT training: start from an existing checkpoint and stream
+# only the corpus shards (.hex / .pcap / .pkt) that have not been consumed yet.
+# Each batch mixes new packets with packets replayed from a fixed-size reservoir
+# of older traffic, so the model adapts to a client update without forgetting
+# earlier formats. Consumed shards are recorded in a JSON manifest.
+#
+#   # once: seed the reservoir from the corpus the checkpoint was trained on
+#   python finetune_bytebert.py --init_model model.pt --seed_reservoir old_corpus.hex --shards
+#   # after every client update, starting from the previous run's --out
+#   python finetune_bytebert.py --init_model model.pt --shards captures/2026-10/ --out model_2026-10.pt
+#   python finetune_bytebert.py --init_model model_2026-10.pt --shards captures/2026-11/ --out model_2026-11.pt
+#   # an interrupted run is continued by repeating it: finished shards are skipped and
+#   # training resumes from the partially written --out
+import argparse, glob, json, os, tempfile, time, torch
+import numpy as np
+import torch.nn as nn
+from datetime import datetime
+
+from boundary_cache import checkpoint_hash
+from bytebert_utils import (
+    MappedPacketDataset, ByteBERT, collate_packets,
+    setup_logger, mask_inputs, make_key_padding_mask, VOCAB_SIZE
+)
+from payload_store import is_store
+from pretrain_bytebert import build_scheduler, eval_loss
+
+
+# -----------------------------
+# Replay reservoir
+# -----------------------------
+class PacketReservoir:
+    """Uniform sample (reservoir sampling) of every packet added so far.
+
+    Rows are stored as in a .pkt store: uint8 payload [capacity, max_len] and lengths.
+    """
+    def __init__(self, capacity, max_len=80, seed=42):
+        self.capacity = capacity
+        self.max_len = max_len
+        self.payload = np.zeros((capacity, max_len), dtype=np.uint8)
+        self.length = np.zeros(capacity, dtype=np.uint16)
+        self.size = 0
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, payload, length):
+        # Algorithm R, vectorised: item k (0-based, overall) replaces slot j ~ U[0, k] when j < capacity
+        n = len(length)
+        fill = min(n, self.capacity - self.size)
+        if fill:
+            self.payload[self.size:self.size + fill] = payload[:fill]
+            self.length[self.size:self.size + fill] = length[:fill]
+            self.size += fill
+        if n > fill:
+            k = self.seen + np.arange(fill, n)
+            slots = (self.rng.random(n - fill) * (k + 1)).astype(np.int64)
+            keep = slots < self.capacity
+            # Later items overwrite earlier ones in the same slot, as the sequential algorithm would
+            self.payload[slots[keep]] = payload[fill:][keep]
+            self.length[slots[keep]] = length[fill:][keep]
+        self.seen += n
+
+    def sample(self, n):
+        idx = self.rng.integers(0, self.size, size=n)
+        return self.payload[idx], self.length[idx]
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, payload=self.payload[:self.size], length=self.length[:self.size],
+                     seen=np.array(self.seen), capacity=np.array(self.capacity))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, capacity, max_len=80, seed=42):
+        res = cls(capacity, max_len, seed)
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as data:
+                payload, length = data["payload"][:, :max_len], data["length"]
+                res.seen = int(data["seen"]) - len(length)
+                res.add(payload, np.minimum(length, max_len))
+                res.seen = int(data["seen"])
+        return res
+
+
+# -----------------------------
+# Shards and manifest
+# -----------------------------
+def expand_shards(specs):
+    # Files, .pkt stores, globs, or directories (their *.hex / *.pcap files), in sorted order
+    out = []
+    for spec in specs:
+        if is_store(spec) or os.path.isfile(spec):
+            out.append(spec)
+        elif os.path.isdir(spec):
+            out.extend(sorted(glob.glob(os.path.join(spec, "*.hex")) + glob.glob(os.path.join(spec, "*.pcap"))))
+        else:
+            out.extend(sorted(glob.glob(spec)))
+    return list(dict.fromkeys(os.path.abspath(p) for p in out))
+
+
+def shard_id(path):
+    # Content hash, so a renamed or moved shard is still recognised
+    return checkpoint_hash(os.path.join(path, "payload.npy") if is_store(path) else path)
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"shards": {}}
+
+
+def latest_model(manifest):
+    # Checkpoint written by the most recent training run the manifest records
+    trained = [s for s in manifest["shards"].values() if s["role"] == "train"]
+    return max(trained, key=lambda s: s["consumed"])["model"] if trained else None
+
+
+def save_manifest(path, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".manifest_", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# -----------------------------
+# Training
+# -----------------------------
+def load_init_model(path, max_len):
+    model = ByteBERT(seq_len=max_len)
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    # Plain state dict, or a resumable checkpoint from pretrain_bytebert.py --checkpoint
+    model.load_state_dict(state["model"] if "model" in state and isinstance(state["model"], dict) else state)
+    return model
+
+
+def make_batch(parts):
+    # parts: [(payload uint8 [n, max_len], lengths [n])] -> (x, lengths) as collate_packets builds them
+    items = [(torch.from_numpy(np.ascontiguousarray(row)), int(L))
+             for payload, length in parts for row, L in zip(payload, length)]
+    return collate_packets(items)
+
+
+def eval_batches(payload, length, batch_size):
+    return [make_batch([(payload[s:s + batch_size], length[s:s + batch_size])])
+            for s in range(0, len(length), batch_size)]
+
+
+def fixed_eval(model, batches, device, loss_fn):
+    # Same masks every call, so before/after losses are comparable
+    if not batches:
+        return float("nan")
+    with torch.random.fork_rng():
+        torch.manual_seed(0)
+        return eval_loss(model, batches, device, loss_fn)
+
+
+def train_shard(model, optimizer, scheduler, ds, train_idx, reservoir, args, device, loss_fn, rng):
+    # One or more passes over the shard's new packets, topped up with replayed ones
+    replay = int(round(args.batch_size * args.replay_ratio)) if len(reservoir) else 0
+    new_per_batch = max(1, args.batch_size - replay)
+    payload, lengths = ds.payload, ds.lengths
+    total, steps = 0.0, 0
+    model.train()
+    for _ in range(args.passes):
+        order = rng.permutation(train_idx)
+        for s in range(0, len(order), new_per_batch):
+            rows = np.sort(order[s:s + new_per_batch])      # sorted reads from the mapped store
+            parts = [(payload[rows], lengths[rows])]
+            if replay:
+                parts.append(reservoir.sample(replay))
+            x, L = make_batch(parts)
+            x = x.to(device); L = L.to(device)
+            key_pad = make_key_padding_mask(L, x.size(1))
+            masked, labels = mask_inputs(x, mask_prob=args.mask_prob)
+            logits = model(masked, key_padding_mask=key_pad)
+            loss = loss_fn(logits.view(-1, VOCAB_SIZE), labels.view(-1))
+
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            total += loss.item()
+            steps += 1
+    return total / max(1, steps), steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune ByteBERT on new corpus shards with replay")
+    parser.add_argument("--init_model", type=str, required=True, help="Checkpoint to start from")
+    parser.add_argument("--shards", type=str, nargs="*", default=[],
+                        help=".hex / .pcap files, .pkt stores, globs or directories of new captures")
+    parser.add_argument("--seed_reservoir", type=str, nargs="*", default=[],
+                        help="Older corpora to sample into the reservoir without training on them")
+    parser.add_argument("--manifest", type=str, default="finetune_manifest.json")
+    parser.add_argument("--reservoir", type=str, default="finetune_reservoir.npz")
+    parser.add_argument("--reservoir_size", type=int, default=200000)
+    parser.add_argument("--replay_ratio", type=float, default=0.3, help="Share of each batch drawn from the reservoir")
+    parser.add_argument("--passes", type=int, default=1, help="Passes over each new shard")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--warmup_ratio", type=float, default=0.05)
+    parser.add_argument("--mask_prob", type=float, default=0.15)
+    parser.add_argument("--max_len", type=int, default=80)
+    parser.add_argument("--val_ratio", type=float, default=0.02, help="Held-out share of each new shard")
+    parser.add_argument("--val_replay", type=int, default=2048, help="Reservoir packets used to measure forgetting")
+    parser.add_argument("--out", type=str, default=None, help="Output checkpoint (default: finetuned_<time>.pt)")
+    parser.add_argument("--force", action="store_true",
+                        help="Train on shards even if the manifest lists them, or from an --init_model "
+                             "other than the newest model in the manifest")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    now = datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger = setup_logger(f"finetune_{now}.log")
+    out_path = args.out or f"finetuned_{now}.pt"
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+
+    manifest = load_manifest(args.manifest)
+    # Shards in the manifest are only learned by the models trained on them: continue from the
+    # newest one, which is --out itself when an interrupted run is repeated
+    last_model = latest_model(manifest)
+    init_model = args.init_model
+    if last_model is not None and last_model == os.path.abspath(out_path) and os.path.exists(out_path):
+        init_model = out_path
+    elif last_model is not None and last_model != os.path.abspath(args.init_model) and not args.force:
+        parser.error(f"the manifest's newest model is {last_model}; pass it as --init_model "
+                     f"(or --force to start from {args.init_model})")
+    reservoir = PacketReservoir.load(args.reservoir, args.reservoir_size, args.max_len, args.seed)
+    logger.info(f"Reservoir: {len(reservoir)} packets (of {reservoir.seen} seen), manifest: {len(manifest['shards'])} shards")
+
+    # 1) Old corpora go straight into the reservoir
+    for path in expand_shards(args.seed_reservoir):
+        sid = shard_id(path)
+        if sid in manifest["shards"] and not args.force:
+            logger.info(f"[Skip] {path} already consumed ({manifest['shards'][sid]['role']})")
+            continue
+        ds = MappedPacketDataset(path, max_len=args.max_len)
+        for s in range(0, len(ds.indices), 1 << 16):
+            rows = ds.indices[s:s + (1 << 16)]
+            reservoir.add(ds.payload[rows], ds.lengths[rows])
+        reservoir.save(args.reservoir)
+        manifest["shards"][sid] = {"path": path, "role": "reservoir", "packets": len(ds),
+                                   "consumed": datetime.now().isoformat(timespec="seconds")}
+        save_manifest(args.manifest, manifest)
+        logger.info(f"[Reservoir] {path}: {len(ds)} packets → {len(reservoir)} kept of {reservoir.seen} seen")
+
+    # 2) New shards are trained on, then join the reservoir
+    pending = []
+    for path in expand_shards(args.shards):
+        sid = shard_id(path)
+        if sid in manifest["shards"] and not args.force:
+            logger.info(f"[Skip] {path} already consumed ({manifest['shards'][sid]['role']})")
+            continue
+        ds = MappedPacketDataset(path, max_len=args.max_len)
+        if len(ds):
+            pending.append((path, sid, ds))
+    if not pending:
+        logger.info("No new shards to train on.")
+        return
+
+    model = load_init_model(init_model, args.max_len).to(device)
+    logger.info(f"Starting from {init_model}")
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=0.01)
+    loss_fn = nn.CrossEntropyLoss(ignore_index=-100)
+
+    splits = []
+    for path, sid, ds in pending:
+        idx = rng.permutation(len(ds.indices))
+        n_val = int(len(idx) * args.val_ratio) if len(idx) > 1 else 0
+        splits.append((np.sort(ds.indices[idx[:n_val]]), ds.indices[idx[n_val:]]))
+    replay = int(round(args.batch_size * args.replay_ratio)) if len(reservoir) else 0
+    new_per_batch = max(1, args.batch_size - replay)
+    total_steps = sum(args.passes * -(-len(train) // new_per_batch) for _, train in splits)
+    scheduler = build_scheduler(optimizer, total_steps, args.warmup_ratio)
+    logger.info(f"{len(pending)} new shards, {sum(len(t) for _, t in splits)} packets, {total_steps} steps "
+                f"(batch {new_per_batch} new + {replay} replayed)")
+
+    # Fixed replay sample to measure forgetting on older traffic
+    replay_val = eval_batches(*reservoir.sample(min(args.val_replay, len(reservoir))), args.batch_size) \
+        if len(reservoir) else []
+
+    t0 = time.perf_counter()
+    for (path, sid, ds), (val_idx, train_idx) in zip(pending, splits):
+        new_val = eval_batches(ds.payload[val_idx], ds.lengths[val_idx], args.batch_size)
+        before = (fixed_eval(model, new_val, device, loss_fn), fixed_eval(model, replay_val, device, loss_fn))
+        train_loss, steps = train_shard(model, optimizer, scheduler, ds, train_idx, reservoir,
+                                        args, device, loss_fn, rng)
+        after = (fixed_eval(model, new_val, device, loss_fn), fixed_eval(model, replay_val, device, loss_fn))
+        logger.info(f"[Shard] {path}: {len(train_idx)} packets, {steps} steps | Train: {train_loss:.4f} | "
+                    f"New val: {before[0]:.4f} → {after[0]:.4f} | Replay val: {before[1]:.4f} → {after[1]:.4f}")
+
+        # Model first, then reservoir and manifest: an interrupted run re-trains this shard next time.
+        # Like them, the model is written aside and renamed, so a resumed run never loads a truncated --out
+        torch.save(model.state_dict(), out_path + ".tmp")
+        os.replace(out_path + ".tmp", out_path)
+        for s in range(0, len(ds.indices), 1 << 16):
+            rows = ds.indices[s:s + (1 << 16)]
+            reservoir.add(ds.payload[rows], ds.lengths[rows])
+        reservoir.save(args.reservoir)
+        manifest["shards"][sid] = {"path": path, "role": "train", "packets": len(ds), "steps": steps,
+                                   "model": os.path.abspath(out_path), "init_model": os.path.abspath(init_model),
+                                   "new_val": after[0], "replay_val": after[1],
+                                   "consumed": datetime.now().isoformat(timespec="seconds")}
+        save_manifest(args.manifest, manifest)
+
+    logger.info(f"[Model Saved] → {out_path} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# format_clusters.py
+#
+# Boundary inference amortised over message formats. Packets are grouped by a few
+# cheap header bytes plus length; ByteBERT's LOO analysis runs only on a sample of
+# each group, whose boundaries are merged into a consensus template and projected
+# onto the remaining members. A few more members per group are inferred as well to
+# check the projection. Output is the same as infer_structure.py --output.
+#
+#   python format_clusters.py --hex_file capture.hex --model_path model.pt --vca zoom --output capture.txt
+import argparse, time, torch
+import numpy as np
+from datetime import datetime
+
+from bytebert_runtime import RUNTIMES, load_runtime
+from bytebert_utils import MappedPacketDataset, collate_packets, setup_logger
+from infer_structure import (
+    OUTPUT_FORMATS, BoundaryWriter, iter_loo_stats, prepare_model,
+    boundary_scores, boundary_flags, format_byte_lines
+)
+
+HEADER_WIDTH = 16    # bytes read per packet for clustering
+
+
+def _byte(payload, lengths, off):
+    # Column off of the header matrix, -1 where the packet is shorter
+    return np.where(lengths > off, payload[:, off].astype(np.int32), -1)
+
+
+def zoom_key(payload, lengths):
+    # byte 0 = message type; for 0x05 media packets byte 7 = mode and the media type
+    # (0x10 / 0x0F / 0x21 / 0x22 / 0x20 ...) sits at byte 8 (modes 00/04) or byte 15 (01/05),
+    # as in extract_ci_from_hex_for_zoom.py
+    typ = _byte(payload, lengths, 0)
+    mode = np.where(typ == 0x05, _byte(payload, lengths, 7), -1)
+    media = np.where(np.isin(mode, (0x00, 0x04)), _byte(payload, lengths, 8),
+                     np.where(np.isin(mode, (0x01, 0x05)), _byte(payload, lengths, 15), -1))
+    return [typ, mode, media]
+
+
+def meet_key(payload, lengths):
+    # byte 0 = RTP/RTCP version, padding, extension and CSRC count; byte 1 = PT
+    # (marker bit removed for RTP, RTCP PTs 200-210 kept whole)
+    b0, b1 = _byte(payload, lengths, 0), _byte(payload, lengths, 1)
+    return [b0, np.where((b1 >= 200) & (b1 <= 210), b1, b1 & 0x7F)]
+
+
+def generic_key(payload, lengths):
+    return [_byte(payload, lengths, off) for off in range(4)]
+
+
+KEY_FUNCS = {"zoom": zoom_key, "meet": meet_key, "generic": generic_key}
+
+
+# -----------------------------
+# Clustering
+# -----------------------------
+def cluster_keys(payload, lengths, vca="generic", length_bucket=1):
+    """Cluster id per packet from the KEY_FUNCS[vca] header fields and length // length_bucket.
+
+    payload: [N, >= HEADER_WIDTH] header bytes. Returns (cluster [N], keys [K, F + 1],
+    counts [K]); fields that do not apply (or lie past the packet's end) are -1.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    cols = KEY_FUNCS[vca](payload, lengths) + [lengths // length_bucket]
+    keys, cluster, counts = np.unique(np.stack(cols, axis=1), axis=0, return_inverse=True, return_counts=True)
+    return cluster.reshape(-1), keys, counts
+
+
+def pick_members(cluster, n_clusters, samples, verify, rng):
+    """Random representatives and verification members per cluster.
+
+    Clusters with at most samples + verify members are inferred in full (all reps).
+    Returns (reps, checks): lists of row arrays, one per cluster.
+    """
+    order = rng.permutation(len(cluster))
+    order = order[np.argsort(cluster[order], kind="stable")]
+    bounds = np.searchsorted(cluster[order], np.arange(n_clusters + 1))
+    reps, checks = [], []
+    for c in range(n_clusters):
+        rows = order[bounds[c]:bounds[c + 1]]
+        if len(rows) <= samples + verify:
+            reps.append(np.sort(rows))
+            checks.append(rows[:0])
+        else:
+            reps.append(np.sort(rows[:samples]))
+            checks.append(np.sort(rows[samples:samples + verify]))
+    return reps, checks
+
+
+# -----------------------------
+# LOO on selected rows
+# -----------------------------
+def infer_rows(model, dataset, rows, device, batch_rows, precision, th_final, use_peak, chunk=256):
+    # Boundary flags [len(rows), max_len] for the given store rows, through the batched LOO engine
+    payload, lengths = dataset.payload, dataset.lengths
+    max_len = dataset.max_len
+    if not len(rows):
+        return np.zeros((0, max_len), dtype=bool)
+
+    def packets():
+        for s in range(0, len(rows), chunk):
+            part = rows[s:s + chunk]
+            x, L = collate_packets([(torch.from_numpy(np.ascontiguousarray(payload[r])), int(lengths[r])) for r in part])
+            for k, r in enumerate(part):
+                yield s + k, x[k], L[k]
+
+    H = np.zeros((len(rows), max_len), dtype=np.float32)
+    margin = np.zeros_like(H)
+    with torch.inference_mode():
+        for k, _, L, h, m in iter_loo_stats(model, packets(), device, max_len,
+                                            batch_rows=batch_rows, precision=precision):
+            H[k, :L] = h
+            margin[k, :L] = m
+    row_len = torch.as_tensor(lengths[rows].astype(np.int64))
+    final = boundary_scores(H, margin, row_len)[-1]
+    return boundary_flags(final, row_len, th_final=th_final, use_peak=use_peak).numpy()
+
+
+def boundary_f1(own, projected):
+    # Boundary-level F1 of a projected template against the packet's own flags (1.0 if both are empty)
+    tp = int((own & projected).sum())
+    err = int((own ^ projected).sum())
+    return 1.0 if tp + err == 0 else 2 * tp / (2 * tp + err)
+
+
+def consensus(flags, agree=0.5):
+    # Per-position majority over the representatives' flags
+    return flags.mean(axis=0) >= agree if len(flags) else np.zeros(flags.shape[1], dtype=bool)
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def cluster_infer(model, path, output, device, logger, fmt="txt", max_len=80, vca="generic",
+                  length_bucket=1, samples=8, verify=2, agree=0.5, min_f1=0.8, verify_bytes=None, fallback=False,
+                  th_final=1.0, use_peak=True, batch_rows=1024, precision="fp32", seed=42, report=None):
+    t0 = time.perf_counter()
+    verify_bytes = max_len if verify_bytes is None else verify_bytes
+    dataset = MappedPacketDataset(path, max_len=max_len)
+    rows_all = dataset.indices
+    lengths = dataset.lengths[rows_all].astype(np.int64)
+    N = len(rows_all)
+    # Only the header columns are read for clustering
+    cluster, keys, counts = cluster_keys(dataset.payload[:, :HEADER_WIDTH][rows_all], lengths, vca, length_bucket)
+    K = len(keys)
+    reps, checks = pick_members(cluster, K, samples, verify, np.random.default_rng(seed))
+    logger.info(f"{N} packets in {K} clusters ({vca} keys, length bucket {length_bucket})")
+
+    # 1) LOO on representatives and verification members (dataset positions -> store rows)
+    run = np.concatenate(reps + checks) if K else np.zeros(0, dtype=np.int64)
+    run_flags = infer_rows(model, dataset, rows_all[run], device, batch_rows, precision, th_final, use_peak)
+    own = dict(zip(run.tolist(), run_flags))
+    n_loo = len(run)
+
+    # 2) Templates, projection check
+    templates = np.zeros((K, max_len), dtype=bool)
+    f1 = np.full(K, np.nan)
+    for c in range(K):
+        templates[c] = consensus(np.stack([own[r] for r in reps[c].tolist()]), agree)
+        if len(checks[c]):
+            limit = np.arange(max_len) < verify_bytes
+            f1[c] = np.mean([boundary_f1(own[r] & limit, templates[c] & limit & (np.arange(max_len) < lengths[r]))
+                                    for r in checks[c].tolist()])
+
+    failed = np.flatnonzero(f1 < min_f1)
+    if fallback and len(failed):
+        # Clusters whose template does not hold get every member inferred
+        extra = np.setdiff1d(np.flatnonzero(np.isin(cluster, failed)), run)
+        logger.info(f"{len(failed)} clusters below F1 {min_f1}: inferring {len(extra)} more packets")
+        for r, f in zip(extra.tolist(), infer_rows(model, dataset, rows_all[extra], device, batch_rows,
+                                                   precision, th_final, use_peak)):
+            own[r] = f
+        n_loo += len(extra)
+
+    # 3) Projection, except for packets that were inferred themselves; written in packet order
+    own_rows = np.array(sorted(own), dtype=np.int64)
+    own_flags = np.stack([own[r] for r in own_rows.tolist()]) if len(own_rows) else np.zeros((0, max_len), dtype=bool)
+    writer = BoundaryWriter(output, fmt, max_len)
+    pos = np.arange(max_len)
+    for s in range(0, N, 1 << 16):
+        idx = np.arange(s, min(N, s + (1 << 16)))
+        flags = templates[cluster[idx]] & (pos[None, :] < lengths[idx, None])
+        lo, hi = np.searchsorted(own_rows, [idx[0], idx[-1] + 1])
+        flags[own_rows[lo:hi] - s] = own_flags[lo:hi]
+        tokens = dataset.payload[rows_all[idx]]
+        writer.write(flags, format_byte_lines(tokens, flags, torch.as_tensor(lengths[idx])))
+    writer.close()
+
+    if report:
+        with open(report, "w") as f:
+            f.write("cluster\tkey\tlength\tcount\tsamples\tverified\tf1\ttemplate\n")
+            for c in range(K):
+                key = " ".join("--" if v < 0 else f"{v:02X}" for v in keys[c][:-1])
+                first = int(np.flatnonzero(cluster == c)[0])
+                line = format_byte_lines(dataset.payload[rows_all[[first]]], templates[c:c + 1],
+                                         torch.as_tensor(lengths[[first]]))[0]
+                f.write(f"{c}\t{key}\t{keys[c][-1] * length_bucket}\t{counts[c]}\t{len(reps[c])}\t{len(checks[c])}\t"
+                        f"{'' if np.isnan(f1[c]) else f'{f1[c]:.3f}'}\t{line}\n")
+
+    checked = ~np.isnan(f1)
+    overall = np.average(f1[checked], weights=counts[checked]) if checked.any() else float("nan")
+    logger.info(f"LOO inference on {n_loo} of {N} packets ({N / max(1, n_loo):.1f}x fewer), "
+                f"verified template F1 {overall:.3f} (packet-weighted), "
+                f"{len(failed)} clusters below {min_f1}")
+    logger.info(f"Boundaries for {N} packets saved to: {output} ({fmt}) in {time.perf_counter() - t0:.1f}s")
+    return n_loo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster packets by header keys and infer one boundary template per cluster")
+    parser.add_argument("--hex_file", type=str, required=True, help="Capture (.hex / .pcap / .pkt)")
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--runtime", choices=RUNTIMES, default="eager")
+    parser.add_argument("--precision", choices=["fp32", "bf16", "int8"], default="fp32")
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="txt")
+    parser.add_argument("--report", type=str, default=None, help="Per-cluster TSV (default: <output>.clusters.tsv)")
+    parser.add_argument("--vca", choices=sorted(KEY_FUNCS), default="generic", help="Which header bytes form the key")
+    parser.add_argument("--length_bucket", type=int, default=1, help="Packets whose length // bucket match share a cluster")
+    parser.add_argument("--samples", type=int, default=8, help="Representatives per cluster")
+    parser.add_argument("--verify", type=int, default=2, help="Extra members per cluster inferred to check the template")
+    parser.add_argument("--agree", type=float, default=0.5, help="Share of representatives that must flag a boundary")
+    parser.add_argument("--min_f1", type=float, default=0.8,
+                        help="Boundary F1 between a verified member's own flags and the template")
+    parser.add_argument("--verify_bytes", type=int, default=None,
+                        help="Compare only the first N bytes when verifying (e.g. the plaintext header)")
+    parser.add_argument("--fallback", action="store_true",
+                        help="Infer every member of clusters whose verified F1 is below --min_f1")
+    parser.add_argument("--max_len", type=int, default=80)
+    parser.add_argument("--batch_rows", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.runtime != "eager" and args.precision != "fp32":
+        parser.error("--precision applies to the eager model; export an int8 artifact instead")
+    now = datetime.now().strftime("%Y%m%d_%H%M%S")
+    logger = setup_logger(f"format_clusters_{now}.log")
+    device = "cuda" if torch.cuda.is_available() and args.runtime != "onnx" else "cpu"
+    model = load_runtime(args.model_path, args.runtime, device, args.max_len)
+    if args.runtime == "eager":
+        model = prepare_model(model.model, args.precision)
+
+    cluster_infer(model, args.hex_file, args.output, device, logger, fmt=args.format, max_len=args.max_len,
+                  vca=args.vca, length_bucket=args.length_bucket, samples=args.samples, verify=args.verify,
+                  agree=args.agree, min_f1=args.min_f1, verify_bytes=args.verify_bytes,
+                  fallback=args.fallback,
+                  batch_rows=args.batch_rows, precision=args.precision, seed=args.seed,
+                  report=args.report or args.output + ".clusters.tsv")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 # infer_structure.py
-import argparse, torch
+import argparse, contextlib, itertools, os, time, torch
+from collections import deque
+import torch.nn as nn
 from datetime import datetime
+from boundary_cache import BoundaryCache, checkpoint_hash
+from bytebert_runtime import RUNTIMES, load_runtime
 from bytebert_utils import (
-    FullPacketDataset, ByteBERT,
+    FullPacketDataset, MappedPacketDataset, ByteBERT, LOOHead, collate_packets,
     setup_logger, make_key_padding_mask, MASK_IDX
 )
+from torch.utils.data import DataLoader, Subset
 import numpy as np
 
 
@@ -21,9 +26,451 @@ def _loo_logits_probs(model, x_1T, L_int, device, mask_token=MASK_IDX):
     probs  = torch.softmax(logits, dim=-1)                 # [L, T, V]
     return logits, probs
 
+# -----------------------------
+# Boundary scoring ([B, T], vectorized)
+# -----------------------------
+#W_DH, W_CURH, W_DM, W_CURM = 0.1, 0.1, 0.5, 0.3
+W_DH, W_CURH, W_DM, W_CURM = 0.1, 0.1, 0.3, 0.5
+
+HEX_TOKENS = np.array([f"{v:02X}" for v in range(256)], dtype=object)
+
+
+def _rows(values, dtype):
+    # [T] or [B, T] array/tensor -> [B, T] CPU tensor
+    t = torch.as_tensor(values, dtype=dtype).cpu()
+    return t.unsqueeze(0) if t.dim() == 1 else t
+
+
+def boundary_scores(H, margin, lengths):
+    """First/second differences of the LOO entropy and margin curves, and their weighted sum.
+
+    H, margin: [B, T] (positions >= length are ignored); lengths: [B].
+    Returns float64 tensors (dH, curH, dM, curM, final), each [B, T]. dH/dM are
+    defined on 1..L-1, curH/curM and final on 1..L-2, and zero elsewhere.
+    """
+    H, margin = _rows(H, torch.float32), _rows(margin, torch.float32)
+    B, T = H.shape
+    lengths = torch.as_tensor(lengths, dtype=torch.long).reshape(B, 1)
+    pos = torch.arange(T).unsqueeze(0)
+    d_ok = (pos >= 1) & (pos < lengths)
+    c_ok = (pos >= 1) & (pos < lengths - 1)
+
+    def diffs(v):
+        d = torch.zeros((B, T), dtype=torch.float64)
+        c = torch.zeros((B, T), dtype=torch.float64)
+        if T >= 2:
+            d[:, 1:] = (v[:, 1:] - v[:, :-1]).double()
+        if T >= 3:
+            c[:, 1:-1] = (v[:, 2:] - 2.0 * v[:, 1:-1] + v[:, :-2]).double()
+        return d.masked_fill(~d_ok, 0.0), c.masked_fill(~c_ok, 0.0)
+
+    dH, curH = diffs(H)
+    dM, curM = diffs(margin)
+    final = (W_DH * dH.abs() + W_CURH * curH.abs() + W_DM * dM.abs() + W_CURM * curM.abs())
+    final = final.masked_fill(~c_ok, 0.0)
+    return dH, curH, dM, curM, final
+
+
+def _display_range(lengths, display_start=0, display_end=None):
+    lengths = torch.as_tensor(lengths, dtype=torch.long)
+    start = torch.full_like(lengths, max(0, display_start))
+    end = lengths if display_end is None else lengths.clamp(max=display_end)
+    return start, end
+
+
+def boundary_flags(final, lengths, display_start=0, display_end=None, th_final=5.0, use_peak=True):
+    """Boolean [B, T] matrix, True where a new field starts at that byte.
+
+    A byte is a boundary if |final| >= th_final and, with use_peak, final has a
+    local maximum there (>= left neighbour, > right neighbour) inside the display range.
+    """
+    final = _rows(final, torch.float64)
+    B, T = final.shape
+    lengths = torch.as_tensor(lengths, dtype=torch.long).reshape(B)
+    cond = final.abs() >= th_final
+    if use_peak:
+        start, end = _display_range(lengths, display_start, display_end)
+        pos = torch.arange(T).unsqueeze(0)
+        lo = start.clamp(min=1).unsqueeze(1)
+        hi = torch.minimum(end - 1, lengths - 1).unsqueeze(1)
+        peak = torch.zeros((B, T), dtype=torch.bool)
+        if T >= 3:
+            peak[:, 1:-1] = (final[:, 1:-1] >= final[:, :-2]) & (final[:, 1:-1] > final[:, 2:])
+        cond &= peak & (pos >= lo) & (pos < hi)
+    return cond
+
+
+def format_byte_lines(tokens, flags, lengths, display_start=0, display_end=None):
+    # Optional text step: hex string per packet with "|" before each boundary; None if the range is empty
+    start, end = _display_range(lengths, display_start, display_end)
+    lines = []
+    for row, cond, s, e in zip(np.asarray(tokens).tolist(), np.asarray(flags).tolist(),
+                               start.tolist(), end.tolist()):
+        if s >= e:
+            lines.append(None)
+            continue
+        hex_tokens = HEX_TOKENS[row[s:e]]
+        line = [hex_tokens[0]]
+        for tok, flag in zip(hex_tokens[1:], cond[s + 1:e]):
+            line.append("|" + tok if flag else tok)
+        lines.append("".join(line))
+    return lines
+
+
+def _pad_rows(rows, T, fill=0.0, dtype=np.float64):
+    out = np.full((len(rows), T), fill, dtype=dtype)
+    for k, r in enumerate(rows):
+        out[k, :len(r)] = r
+    return out
+
+
+# -----------------------------
+# Batched LOO engine
+# -----------------------------
+def prepare_model(model, precision="fp32"):
+    # int8: dynamic quantization of the Linear layers (CPU only); exported runtimes pass through
+    if isinstance(model, nn.Module):
+        model.eval()
+    if precision == "int8" and isinstance(model, ByteBERT):
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def _autocast(device, precision):
+    if precision == "bf16":
+        return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def iter_loo_stats(model, packets, device, max_len, batch_rows=1024,
+                   precision="fp32", mask_token=MASK_IDX):
+    """Yield (i, tokens, L, H, margin) per packet of packets = iterable of (i, x, L), in order.
+
+    The L masked copies of each packet are packed back to back into batches of
+    batch_rows rows, so one forward pass covers many packets (a packet may span
+    two batches). Only the hidden state at each masked position goes through the
+    output layer. model is a ByteBERT or any (x, lengths, pos) -> logits callable
+    (LOOHead, or a runtime from bytebert_runtime.load_runtime).
+    """
+    head = LOOHead(model) if isinstance(model, ByteBERT) else model
+    rows_x = torch.empty((batch_rows, max_len), dtype=torch.long)
+    rows_len = torch.empty(batch_rows, dtype=torch.long)
+    rows_pos = torch.empty(batch_rows, dtype=torch.long)
+    rows_true = torch.empty(batch_rows, dtype=torch.long)
+    pending = deque()    # [i, tokens, L, H, margin, filled]; packets complete in order
+
+    def flush(used, owners):
+        lengths = rows_len[:used].to(device)
+        pos = rows_pos[:used].to(device)
+        true_toks = rows_true[:used].to(device)
+        # Columns past the longest row are PAD for every row, so they can be dropped
+        Tb = int(rows_len[:used].max())
+        x = rows_x[:used, :Tb].to(device)
+        ar = torch.arange(used, device=device)
+        with _autocast(device, precision):
+            logits = head(x, lengths, pos).float()                  # [B, V]
+        probs = torch.softmax(logits, dim=-1)
+        H = (-torch.log2(probs[ar, true_toks].clamp_min(1e-9))).cpu().numpy()
+        top2 = torch.topk(logits, k=2, dim=-1).values
+        margin = (top2[:, 0] - top2[:, 1]).cpu().numpy()
+
+        pos = rows_pos[:used].numpy()
+        off = 0
+        for entry, k in owners:
+            p = pos[off:off + k]
+            entry[3][p] = H[off:off + k]
+            entry[4][p] = margin[off:off + k]
+            entry[5] += k
+            off += k
+
+    used, owners = 0, []
+    for i, x, L in packets:
+        L_int = int(L)
+        entry = [i, x.tolist(), L_int, np.zeros(L_int, dtype=np.float32),
+                 np.zeros(L_int, dtype=np.float32), 0]
+        pending.append(entry)
+        p0 = 0
+        while p0 < L_int:
+            k = min(L_int - p0, batch_rows - used)
+            ar = torch.arange(k)
+            rows_x[used:used + k] = x
+            rows_x[used + ar, p0 + ar] = mask_token
+            rows_len[used:used + k] = L_int
+            rows_pos[used:used + k] = p0 + ar
+            rows_true[used:used + k] = x[p0:p0 + k]
+            owners.append((entry, k))
+            used += k
+            p0 += k
+            if used == batch_rows:
+                flush(used, owners)
+                used, owners = 0, []
+                while pending and pending[0][5] == pending[0][2]:
+                    e = pending.popleft()
+                    yield e[0], e[1], e[2], e[3], e[4]
+    if used:
+        flush(used, owners)
+    while pending:
+        e = pending.popleft()
+        yield e[0], e[1], e[2], e[3], e[4]
+
+
+def _iter_packets(dataset, num_samples):
+    for i in range(min(len(dataset), num_samples)):
+        x, L = dataset[i]
+        yield i, x, L
+
+
+def _iter_loader(dataset, start=0, stop=None, batch_size=256, num_workers=0, prefetch=4):
+    # Streaming source for the full-capture mode: a MappedPacketDataset read through a DataLoader
+    stop = len(dataset) if stop is None else min(stop, len(dataset))
+    loader = DataLoader(Subset(dataset, range(start, stop)), batch_size=batch_size, shuffle=False,
+                        collate_fn=collate_packets, num_workers=num_workers,
+                        prefetch_factor=prefetch if num_workers > 0 else None)
+    i = start
+    for x, lengths in loader:
+        for row, L in zip(x, lengths.tolist()):
+            yield i, row, L
+            i += 1
+
+
+def _iter_cached(packets, cache, order, holders, drain, block=256):
+    """Feed only cache misses to the model, queueing every packet on order.
+
+    Each order entry is [i, tokens, L, holder]; holder["final"] comes from the
+    cache, or is filled in once the model run for the first copy of that payload
+    (holders[i]) finishes. drain(block) is called as hits queue up, so a warm
+    cache streams its results instead of holding every packet until the end.
+    """
+    inflight = {}
+    for i, x, L in packets:
+        L_int = int(L)
+        tokens = x.tolist()
+        key = bytes(tokens[:L_int])
+        holder = inflight.get(key)
+        if holder is None:
+            final = cache.get(key) if L_int else None
+            holder = {"final": final, "key": key}
+            if final is None and L_int:
+                inflight[key] = holders[i] = holder
+                order.append([i, tokens, L_int, holder])
+                yield i, x, L
+                continue
+        else:
+            cache.count_duplicate()
+        order.append([i, tokens, L_int, holder])
+        if len(order) >= block:
+            drain(block)
+
+
+def infer_metric_batched(model, dataset, device, logger,
+                         num_samples=5, display_start=0, display_end=None,
+                         th_final=5.0, use_peak=True,
+                         batch_rows=1024, precision="fp32", report_every=1000, cache=None,
+                         score_block=256, packets=None, writer=None, total=None):
+    """Same ByteF lines as infer_metric_all, streamed as packets complete.
+
+    packets: optional (i, x, L) source (default: the first num_samples of dataset).
+    writer: optional BoundaryWriter; results then go to it instead of ByteF log lines.
+    """
+    model = prepare_model(model, precision)
+    max_len = dataset[0][0].numel() if len(dataset) else 0
+    t0 = time.perf_counter()
+    done = 0
+
+    def emit(entries):
+        # entries: [(i, tokens, L, final)], scored and formatted as one [B, T] block
+        nonlocal done
+        lengths = torch.tensor([e[2] for e in entries], dtype=torch.long)
+        finals = _pad_rows([e[3] if e[2] else () for e in entries], max_len)
+        flags = boundary_flags(finals, lengths, display_start, display_end, th_final=th_final, use_peak=use_peak)
+        lines = format_byte_lines([e[1] for e in entries], flags, lengths, display_start, display_end)
+        if writer is not None:
+            writer.write(flags, lines)
+        for (i, _, _, _), byte_line in zip(entries, lines):
+            if writer is None:
+                if byte_line is None:
+                    logger.info(f"ByteF {i+1:>2}: [empty display range]")
+                else:
+                    logger.info(f"ByteF {i+1:>2}: {byte_line}")
+            done += 1
+            if report_every and done % report_every == 0:
+                elapsed = time.perf_counter() - t0
+                eta = f", ETA {(total - done) / (done / elapsed):.0f}s" if total else ""
+                logger.info(f"Progress: {done}{f'/{total}' if total else ''} packets, "
+                            f"{done / elapsed:.1f} packets/s{eta}")
+
+    order, holders = deque(), {}
+
+    def drain(min_ready=1):
+        # Emit resolved entries from the head of order, score_block at a time; a ready
+        # run shorter than min_ready is left for later
+        while order:
+            n = 0
+            for e in itertools.islice(order, score_block):
+                if e[3]["final"] is None and e[2]:
+                    break
+                n += 1
+            if n == 0 or n < min_ready:
+                return
+            ready = [order.popleft() for _ in range(n)]
+            emit([(e[0], e[1], e[2], e[3]["final"]) for e in ready])
+
+    if packets is None:
+        packets = _iter_packets(dataset, num_samples)
+    if cache is not None:
+        packets = _iter_cached(packets, cache, order, holders, drain, score_block)
+
+    def process(block):
+        if not block:
+            return
+        lengths = torch.tensor([b[2] for b in block], dtype=torch.long)
+        H = _pad_rows([b[3] for b in block], max_len, dtype=np.float32)
+        margin = _pad_rows([b[4] for b in block], max_len, dtype=np.float32)
+        final = boundary_scores(H, margin, lengths)[-1].numpy()
+        if cache is None:
+            emit([(b[0], b[1], b[2], final[k, :b[2]]) for k, b in enumerate(block)])
+            return
+        for k, b in enumerate(block):
+            holder = holders.pop(b[0])
+            holder["final"] = final[k, :b[2]]
+            cache.put(holder["key"], holder["final"])
+        drain()
+
+    with torch.inference_mode():
+        block = []
+        for item in iter_loo_stats(model, packets, device, max_len, batch_rows=batch_rows, precision=precision):
+            block.append(item)
+            if len(block) >= score_block:
+                process(block)
+                block = []
+        process(block)
+    # Trailing cache hits
+    drain()
+
+    elapsed = time.perf_counter() - t0
+    logger.info(f"Throughput: {done} packets in {elapsed:.2f}s ({done / max(elapsed, 1e-9):.1f} packets/s, "
+                f"batch_rows={batch_rows}, precision={precision})")
+    if cache is not None:
+        cache.flush()
+        logger.info(cache.summary())
+    return done
+
+
+# -----------------------------
+# Structured output (full-capture mode)
+# -----------------------------
+OUTPUT_FORMATS = ("txt", "bitmap")
+
+
+class BoundaryWriter:
+    """Per-packet boundary results, appended in packet order.
+
+    txt:    one line per packet, fields separated by spaces (the evaluate_result.py
+            format); an empty line where the display range is empty.
+    bitmap: ceil(max_len / 8) bytes per packet, np.packbits of the [max_len] boundary
+            flags (bit t set = a field starts at byte t); see read_bitmap.
+    Only whole records are kept, so the record count is the offset to resume from.
+    """
+    def __init__(self, path, fmt="txt", max_len=80, resume=False):
+        self.path = path
+        self.fmt = fmt
+        self.row_bytes = -(-max_len // 8)
+        self.offset = self._recover() if resume and os.path.exists(path) else 0
+        self.f = open(path, "ab" if resume else "wb")
+
+    def _recover(self):
+        # Drop a partially written trailing record and count the complete ones
+        if self.fmt == "bitmap":
+            n = os.path.getsize(self.path) // self.row_bytes
+            keep = n * self.row_bytes
+        else:
+            n, keep, pos = 0, 0, 0
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    last = chunk.rfind(b"\n")
+                    if last >= 0:
+                        n += chunk.count(b"\n")
+                        keep = pos + last + 1
+                    pos += len(chunk)
+        os.truncate(self.path, keep)
+        return n
+
+    def write(self, flags, lines):
+        if self.fmt == "bitmap":
+            self.f.write(np.packbits(np.asarray(flags, dtype=bool), axis=1).tobytes())
+        else:
+            text = "\n".join(line.replace("|", " ") if line is not None else "" for line in lines)
+            self.f.write((text + "\n").encode())
+        self.f.flush()
+        self.offset += len(lines)
+
+    def close(self):
+        self.f.close()
+
+
+def read_bitmap(path, max_len=80):
+    # Bitmap output -> bool [N, max_len]
+    row_bytes = -(-max_len // 8)
+    packed = np.fromfile(path, dtype=np.uint8)
+    packed = packed[:len(packed) // row_bytes * row_bytes].reshape(-1, row_bytes)
+    return np.unpackbits(packed, axis=1, count=max_len).astype(bool)
+
+
+def infer_capture(model, path, output, device, logger, fmt="txt", max_len=80,
+                  display_start=0, display_end=None, th_final=1.0, use_peak=True,
+                  batch_rows=1024, precision="fp32", cache=None, resume=False,
+                  num_workers=0, prefetch=4, report_every=10000, limit=None):
+    """Boundaries for every packet of a capture (.hex / .pcap / .pkt), written to output.
+
+    Packets are streamed from a memory-mapped .pkt store through a DataLoader; with
+    resume, an existing output is continued from its last complete record.
+    """
+    dataset = MappedPacketDataset(path, max_len=max_len)
+    stop = len(dataset) if limit is None else min(limit, len(dataset))
+    writer = BoundaryWriter(output, fmt, max_len, resume=resume)
+    start = writer.offset
+    if start:
+        logger.info(f"Resuming {output} at packet {start}/{stop}")
+    try:
+        if start < stop:
+            packets = _iter_loader(dataset, start, stop, num_workers=num_workers, prefetch=prefetch)
+            infer_metric_batched(model, dataset, device, logger, display_start=display_start,
+                                 display_end=display_end, th_final=th_final, use_peak=use_peak,
+                                 batch_rows=batch_rows, precision=precision, report_every=report_every,
+                                 cache=cache, packets=packets, writer=writer, total=stop - start)
+    finally:
+        writer.close()
+    logger.info(f"Boundaries for {writer.offset} packets saved to: {output} ({fmt})")
+    return writer.offset
+
+
+def infer_metric_remote(address, dataset, logger, num_samples=5, display_start=0, display_end=None,
+                        th_final=5.0, use_peak=True, chunk=256):
+    # Same ByteF lines, scored by a running bytebert_server.py instead of a local model
+    from bytebert_server import infer_remote
+
+    t0 = time.perf_counter()
+    n = min(len(dataset), num_samples)
+    for start in range(0, n, chunk):
+        packets = []
+        for i in range(start, min(n, start + chunk)):
+            x, L = dataset[i]
+            packets.append(bytes(x[:int(L)].tolist()).hex())
+        lines = infer_remote(address, packets, th_final=th_final, use_peak=use_peak,
+                             display_start=display_start, display_end=display_end)
+        for i, byte_line in enumerate(lines, start):
+            if byte_line is None:
+                logger.info(f"ByteF {i+1:>2}: [empty display range]")
+            else:
+                logger.info(f"ByteF {i+1:>2}: {byte_line}")
+    elapsed = time.perf_counter() - t0
+    logger.info(f"Throughput: {n} packets in {elapsed:.2f}s ({n / max(elapsed, 1e-9):.1f} packets/s, server={address})")
+    return n
+
+
 def infer_metric_all(model, dataset, device, logger,
                     num_samples=5, display_start=0, display_end=None,
-                    th_final=5.0, use_peak=True):
+                    th_final=5.0, use_peak=True, cache=None):
     model.eval()
     with torch.no_grad():
         for i in range(min(len(dataset), num_samples)):
@@ -34,70 +481,38 @@ def infer_metric_all(model, dataset, device, logger,
                 logger.info(f"ByteF {i+1:>2}: [empty display range]")
                 continue
 
-            # LOO logits & probs
-            logits_loo, probs_loo = _loo_logits_probs(model, x, L_int, device, mask_token=MASK_IDX)
-            if logits_loo is None:
-                logger.info(f"ByteF {i+1:>2}: [empty display range]")
-                continue
-
-            ar = torch.arange(L_int, device=device)
-            true_toks = x[0, :L_int]
-
-            # Prob/Entropy/Margin
-            p_loo  = probs_loo[ar, ar, true_toks].clamp_min(1e-9)
-            H      = (-torch.log2(p_loo)).cpu().numpy()
-            top2   = torch.topk(logits_loo[ar, ar, :], k=2, dim=-1)
-            margin = (top2.values[:, 0] - top2.values[:, 1]).cpu().numpy()
-
-            # Derivatives
-            dH   = np.zeros(L_int, dtype=np.float64)
-            curH = np.zeros(L_int, dtype=np.float64)
-            dM   = np.zeros(L_int, dtype=np.float64)
-            curM = np.zeros(L_int, dtype=np.float64)
-            for j in range(1, L_int):
-                dH[j] = H[j] - H[j-1]
-                dM[j] = margin[j] - margin[j-1]
-            for j in range(1, L_int-1):
-                curH[j] = H[j+1] - 2.0*H[j] + H[j-1]
-                curM[j] = margin[j+1] - 2.0*margin[j] + margin[j-1]
-
-            #w_dH, w_curH, w_dM, w_curM = 0.1, 0.1, 0.5, 0.3
-            w_dH, w_curH, w_dM, w_curM = 0.1, 0.1, 0.3, 0.5
-            final = np.zeros(L_int, dtype=np.float64)
-            for j in range(1, L_int-1):
-                final[j] = (w_dH  * abs(dH[j])   +
-                            w_curH* abs(curH[j]) +
-                            w_dM  * abs(dM[j])   +
-                            w_curM* abs(curM[j]))
-
-            # range
-            start = max(0, display_start)
-            end   = L_int if display_end is None else min(L_int, display_end)
-            if start >= end:
+            key = bytes(x[0, :L_int].tolist()) if cache is not None else None
+            final = cache.get(key) if cache is not None else None
+            if final is None:
+                # LOO logits & probs
+                logits_loo, probs_loo = _loo_logits_probs(model, x, L_int, device, mask_token=MASK_IDX)
+                if logits_loo is None:
+                    logger.info(f"ByteF {i+1:>2}: [empty display range]")
+                    continue
+
+                ar = torch.arange(L_int, device=device)
+                true_toks = x[0, :L_int]
+
+                # Prob/Entropy/Margin
+                p_loo  = probs_loo[ar, ar, true_toks].clamp_min(1e-9)
+                H      = -torch.log2(p_loo)
+                top2   = torch.topk(logits_loo[ar, ar, :], k=2, dim=-1)
+                margin = top2.values[:, 0] - top2.values[:, 1]
+
+                final = boundary_scores(H, margin, [L_int])[-1][0]
+                if cache is not None:
+                    cache.put(key, final.numpy())
+
+            lengths = torch.tensor([L_int])
+            cond = boundary_flags(final, lengths, display_start, display_end, th_final=th_final, use_peak=use_peak)
+            byte_line = format_byte_lines(x.cpu(), cond, lengths, display_start, display_end)[0]
+            if byte_line is None:
                 logger.info(f"ByteF {i+1:>2}: [empty display range]")
                 continue
-
-            # Boundary flags based on final (threshold + optional peak)
-            cond = np.zeros(L_int, dtype=bool)
-            cond |= (np.abs(final) >= th_final)
-
-            if use_peak:
-                peak = np.zeros(L_int, dtype=bool)
-                for j in range(max(start,1), min(end-1, L_int-1)):
-                    if final[j] >= final[j-1] and final[j] > final[j+1]:
-                        peak[j] = True
-                cond &= peak
-
-            hex_tokens = [f"{int(x[0, j].item()):02X}" for j in range(start, end)]
-            byte_line = hex_tokens[0]
-            for k in range(1, len(hex_tokens)):
-                j = start + k
-                if cond[j]:
-                    byte_line += "|" + hex_tokens[k] 
-                else:
-                    byte_line += hex_tokens[k] 
-
             logger.info(f"ByteF {i+1:>2}: {byte_line}")
+        if cache is not None:
+            cache.flush()
+            logger.info(cache.summary())
 
 
 def print_metric_all(model, dataset, device, logger,
@@ -133,26 +548,8 @@ def print_metric_all(model, dataset, device, logger,
             top2 = torch.topk(logits_loo[ar, ar, :], k=2, dim=-1)
             margin = (top2.values[:, 0] - top2.values[:, 1]).cpu().numpy()
 
-            # Derivatives for H
-            dH = [0.0] * L_int
-            for j in range(1, L_int):
-                dH[j] = H[j] - H[j-1]
-            curH = [0.0] * L_int
-            for j in range(1, L_int-1):
-                curH[j] = H[j+1] - 2.0*H[j] + H[j-1]
-
-            # Derivatives for Margin
-            dM = [0.0] * L_int
-            for j in range(1, L_int):
-                dM[j] = margin[j] - margin[j-1]
-            curM = [0.0] * L_int
-            for j in range(1, L_int-1):
-                curM[j] = margin[j+1] - 2.0*margin[j] + margin[j-1]
-
-            w_dH, w_curH, w_dM, w_curM = 0.1, 0.1, 0.3, 0.5
-            final = [0.0] * L_int
-            for j in range(1, L_int-1):
-                final[j] = w_dH * abs(dH[j]) + w_curH * abs(curH[j]) + w_dM * abs(dM[j]) + w_curM * abs(curM[j])
+            # Derivatives and weighted score, [1, T] -> [T]
+            dH, curH, dM, curM, final = (t[0].numpy() for t in boundary_scores(H, margin, [L_int]))
 
             # display range
             start = max(0, display_start)
@@ -163,7 +560,7 @@ def print_metric_all(model, dataset, device, logger,
 
             # Columns
             pos_cols = [f"{j+1:>5}" for j in range(start, end)]
-            hex_cols = [f"{int(x[0, j].item()):02X}".rjust(5) for j in range(start, end)]
+            hex_cols = [tok.rjust(5) for tok in HEX_TOKENS[x[0, start:end].cpu().numpy()]]
             prb_cols = [f"{prob_vals[j]:.2f}".rjust(5) for j in range(start, end)]
             H_cols   = [f"{H[j]:.1f}".rjust(5) for j in range(start, end)]
             m_cols   = [f"{margin[j]:.2f}".rjust(5) for j in range(start, end)]
@@ -226,12 +623,52 @@ def print_metric_all(model, dataset, device, logger,
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--hex_file", type=str, required=True)
-    parser.add_argument("--model_path", type=str, required=True)
-    parser.add_argument("--num_examples", type=int, default=5)
+    parser.add_argument("--model_path", type=str, default=None)
+    parser.add_argument("--num_examples", type=int, default=None,
+                        help="Packets to process (default: 5, or every packet with --output)")
     parser.add_argument("--max_len", type=int, default=80)
     parser.add_argument("--display_start", type=int, default=0)
     parser.add_argument("--display_end", type=int, default=None)
+    parser.add_argument("--batch_rows", type=int, default=0,
+                        help="Pack LOO rows of many packets into batches of this size (0 = one packet per batch)")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="SQLite boundary-score cache, keyed by checkpoint hash and packet bytes")
+    parser.add_argument("--precision", choices=["fp32", "bf16", "int8"], default="fp32",
+                        help="bf16 autocast or int8 dynamic quantization (runs the batched engine)")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="eager",
+                        help="Batched engine only: run an artifact from bytebert_runtime.py "
+                             "(--model_path is then the .ts / .onnx file)")
+    parser.add_argument("--server", type=str, default=None,
+                        help="Use a running bytebert_server.py (host:port or unix:/path) instead of loading a model")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Full-capture mode: write boundaries for every packet to this file instead of the log")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="txt",
+                        help="--output format: 'txt' = space-separated fields per line (evaluate_result.py), "
+                             "'bitmap' = packed boundary bits per packet")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted --output file")
+    parser.add_argument("--num_workers", type=int, default=0, help="--output: DataLoader workers")
+    parser.add_argument("--prefetch", type=int, default=4, help="--output: batches prefetched per worker")
+    parser.add_argument("--report_every", type=int, default=10000, help="--output: progress interval in packets")
     args = parser.parse_args()
+    if args.output:
+        if args.server:
+            parser.error("--output runs the model locally; it cannot be combined with --server")
+        # Full-capture mode always uses the batched engine
+        args.batch_rows = args.batch_rows if args.batch_rows > 0 else 1024
+    elif args.num_examples is None:
+        args.num_examples = 5
+    if not args.server and not args.model_path:
+        parser.error("--model_path is required unless --server is given")
+    if args.server and args.precision != "fp32":
+        parser.error("--precision is chosen when starting bytebert_server.py")
+    if args.runtime != "eager":
+        if args.precision != "fp32":
+            parser.error("--precision applies to the eager model; export an int8 artifact instead")
+        # The exported head only exists for the batched engine
+        args.batch_rows = args.batch_rows if args.batch_rows > 0 else 1024
+    elif args.precision != "fp32":
+        # So is bf16 / int8 inference
+        args.batch_rows = args.batch_rows if args.batch_rows > 0 else 1024
 
     now = datetime.now().strftime("%Y%m%d_%H%M%S")
     log_file = f"infer_structure_{now}.log"
@@ -239,13 +676,40 @@ def main():
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
-    dataset = FullPacketDataset(args.hex_file, max_len=args.max_len)
-    model = ByteBERT(seq_len=args.max_len)
-    state = torch.load(args.model_path, map_location=device)
-    model.load_state_dict(state)
-    model.to(device)
-
-    infer_metric_all(model, dataset, device, logger, num_samples=args.num_examples, display_start=args.display_start, display_end=args.display_end, th_final=1.0)
+    dataset = FullPacketDataset(args.hex_file, max_len=args.max_len) if not args.output else None
+    if args.server:
+        infer_metric_remote(args.server, dataset, logger, num_samples=args.num_examples,
+                            display_start=args.display_start, display_end=args.display_end, th_final=1.0)
+        return
+    if args.runtime == "eager":
+        model = ByteBERT(seq_len=args.max_len)
+        state = torch.load(args.model_path, map_location=device)
+        model.load_state_dict(state)
+        model.to(device)
+    else:
+        if args.runtime == "onnx":
+            device = "cpu"
+        model = load_runtime(args.model_path, args.runtime, device, args.max_len)
+
+    cache = None
+    if args.cache:
+        # bf16/int8 scores differ from fp32 ones, so they get their own cache namespace
+        tag = "" if args.batch_rows <= 0 or args.precision == "fp32" else f":{args.precision}"
+        cache = BoundaryCache(args.cache, checkpoint_hash(args.model_path) + tag)
+
+    if args.output:
+        infer_capture(model, args.hex_file, args.output, device, logger, fmt=args.format, max_len=args.max_len,
+                      display_start=args.display_start, display_end=args.display_end, th_final=1.0,
+                      batch_rows=args.batch_rows, precision=args.precision, cache=cache, resume=args.resume,
+                      num_workers=args.num_workers, prefetch=args.prefetch, report_every=args.report_every,
+                      limit=args.num_examples)
+    elif args.batch_rows > 0:
+        infer_metric_batched(model, dataset, device, logger, num_samples=args.num_examples, display_start=args.display_start, display_end=args.display_end, th_final=1.0,
+                             batch_rows=args.batch_rows, precision=args.precision, cache=cache)
+    else:
+        infer_metric_all(model, dataset, device, logger, num_samples=args.num_examples, display_start=args.display_start, display_end=args.display_end, th_final=1.0, cache=cache)
+    if cache is not None:
+        cache.close()
     # print_metric_all(model, dataset, device, logger, num_samples=args.num_examples, display_start=args.display_start, display_end=args.display_end,th_dH=1.0, th_curH=1.0, th_dM=1.0, th_curM=1.0)
 
 
@@ -0,0 +1,291 @@
+# payload_store.py
+import argparse
+import itertools
+import os
+import sys
+from array import array
+
+import numpy as np
+
+from pcap_utils import PcapReader, parse_udp_flow
+
+# -----------------------------
+# Layout
+# -----------------------------
+# A store is a directory of .npy columns, one row per UDP packet, in capture order:
+#   payload   uint8  [N, max_len]  payload bytes, zero padded (truncated to max_len)
+#   length    uint16 [N]           number of valid bytes in the payload row
+#   ts        float64[N]           capture timestamp (NaN when converted from .hex)
+#   direction int8   [N]           1 = client -> server, 0 = server -> client, -1 = unknown
+#   src_ip    uint8  [N, 16]       IPv6 or IPv4-mapped source address
+#   dst_ip    uint8  [N, 16]       IPv6 or IPv4-mapped destination address
+#   sport     uint16 [N]
+#   dport     uint16 [N]
+#   proto     uint8  [N]           always 17 (UDP)
+STORE_SUFFIX = ".pkt"
+COLUMNS = ("payload", "length", "ts", "direction", "src_ip", "dst_ip", "sport", "dport", "proto")
+
+DIR_SEND, DIR_RECV, DIR_UNKNOWN = 1, 0, -1
+# Zoom (8801) and Google Meet (3478) media servers
+SERVER_PORTS = (8801, 3478)
+
+NO_IP = bytes(16)
+
+
+def store_path_for(path):
+    # capture.pcap / capture.hex -> capture.pkt
+    return os.path.splitext(path)[0] + STORE_SUFFIX
+
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "payload.npy"))
+
+
+def packet_direction(sport, dport, server_ports=SERVER_PORTS):
+    if dport in server_ports:
+        return DIR_SEND
+    if sport in server_ports:
+        return DIR_RECV
+    return DIR_UNKNOWN
+
+
+# -----------------------------
+# Writer
+# -----------------------------
+# Reserved .npy header size: data is appended behind it and the header is rewritten with
+# the final row count on close (format version 1.0, see numpy.lib.format)
+NPY_HEADER_BYTES = 128
+
+# column -> (dtype, row width or None)
+COLUMN_TYPES = {
+    "payload": (np.uint8, "max_len"),
+    "length": (np.uint16, None),
+    "ts": (np.float64, None),
+    "direction": (np.int8, None),
+    "src_ip": (np.uint8, 16),
+    "dst_ip": (np.uint8, 16),
+    "sport": (np.uint16, None),
+    "dport": (np.uint16, None),
+    "proto": (np.uint8, None),
+}
+
+
+def _npy_header(dtype, shape):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), shape)
+    header = header.ljust(NPY_HEADER_BYTES - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class PayloadStoreWriter:
+    # Rows are gathered in compact typed buffers and appended to the column files every
+    # chunk_rows rows, so memory stays bounded by one chunk whatever the capture size.
+    # Columns are written as .<name>.npy.tmp and renamed on close; an aborted write
+    # leaves no store behind.
+    def __init__(self, path, max_len=80, chunk_rows=1 << 16):
+        self.path = path
+        self.max_len = max_len
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        os.makedirs(self.path, exist_ok=True)
+        self.files = {}
+        for name in COLUMNS:
+            f = open(self._tmp_path(name), "wb")
+            f.write(bytes(NPY_HEADER_BYTES))
+            self.files[name] = f
+        self._reset()
+
+    def _tmp_path(self, name):
+        return os.path.join(self.path, f".{name}.npy.tmp")
+
+    def _reset(self):
+        self.payload = bytearray()
+        self.length = array("H")
+        self.ts = array("d")
+        self.direction = array("b")
+        self.src_ip = bytearray()
+        self.dst_ip = bytearray()
+        self.sport = array("H")
+        self.dport = array("H")
+        self.proto = array("B")
+
+    def _flush(self):
+        for name in COLUMNS:
+            self.files[name].write(getattr(self, name))
+        self._reset()
+
+    def append(self, payload, ts=float("nan"), direction=DIR_UNKNOWN,
+               src_ip=NO_IP, dst_ip=NO_IP, sport=0, dport=0, proto=17):
+        row = bytes(payload[:self.max_len])
+        self.payload += row
+        self.payload += bytes(self.max_len - len(row))
+        self.length.append(len(row))
+        self.ts.append(ts)
+        self.direction.append(direction)
+        self.src_ip += src_ip
+        self.dst_ip += dst_ip
+        self.sport.append(sport)
+        self.dport.append(dport)
+        self.proto.append(proto)
+        self.rows += 1
+        if len(self.length) >= self.chunk_rows:
+            self._flush()
+
+    def __len__(self):
+        return self.rows
+
+    def close(self):
+        self._flush()
+        for name in COLUMNS:
+            dtype, width = COLUMN_TYPES[name]
+            shape = (self.rows,) if width is None else (self.rows, self.max_len if width == "max_len" else width)
+            f = self.files[name]
+            f.seek(0)
+            f.write(_npy_header(dtype, shape))
+            f.close()
+            os.replace(self._tmp_path(name), os.path.join(self.path, f"{name}.npy"))
+
+    def abort(self):
+        for name in COLUMNS:
+            self.files[name].close()
+            os.remove(self._tmp_path(name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# -----------------------------
+# Loader
+# -----------------------------
+class PayloadStore:
+    # Columns are memory-mapped by default, so opening a store costs no parsing
+    def __init__(self, path, mmap=True):
+        self.path = path
+        mode = "r" if mmap else None
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode))
+        self.max_len = self.payload.shape[1]
+
+    def __len__(self):
+        return len(self.length)
+
+    def payload_bytes(self, idx):
+        return self.payload[idx, :self.length[idx]].tobytes()
+
+    def iter_payloads(self):
+        for idx in range(len(self)):
+            yield self.payload_bytes(idx)
+
+    def hex_lines(self, sep=" "):
+        # Same text as extract_hex_from_pcap.py; sep="" gives BinaryInferno's .txt lines
+        for payload in self.iter_payloads():
+            yield payload.hex(sep).upper() if sep else payload.hex().upper()
+
+
+def load_store(path, mmap=True):
+    return PayloadStore(path, mmap=mmap)
+
+
+# -----------------------------
+# Converters
+# -----------------------------
+def pcap_to_store(pcap_path, store_path=None, max_len=80, server_ports=SERVER_PORTS):
+    # Every UDP packet in the capture, as extract_hex_from_pcap.py does
+    store_path = store_path or store_path_for(pcap_path)
+    with PcapReader(pcap_path) as reader, PayloadStoreWriter(store_path, max_len=max_len) as writer:
+        for ts, _, data in reader:
+            flow = parse_udp_flow(data, reader.linktype)
+            if flow is None:
+                continue
+            src_ip, dst_ip, sport, dport, payload = flow
+            writer.append(payload, ts=ts, direction=packet_direction(sport, dport, server_ports),
+                          src_ip=src_ip, dst_ip=dst_ip, sport=sport, dport=dport)
+    return store_path, len(writer)
+
+
+def hex_row(line):
+    # One .hex line as bytes; a malformed line becomes an empty row, which the
+    # parsers turn into an empty output line as they do for the per-line path
+    try:
+        return bytes.fromhex(line.strip())
+    except ValueError:
+        return b""
+
+
+def hex_to_store(hex_path, store_path=None, max_len=80):
+    # Payload columns only; flow columns are left at their "unknown" values
+    store_path = store_path or store_path_for(hex_path)
+    with open(hex_path, "r") as f, PayloadStoreWriter(store_path, max_len=max_len) as writer:
+        for line in f:
+            writer.append(hex_row(line))
+    return store_path, len(writer)
+
+
+def iter_hex_matrix(hex_path, chunk_rows=1 << 20, max_len=None):
+    # (payload, length) pairs over chunk_rows lines of a .hex file at a time, without
+    # writing a store. Only the first max_len bytes of each row are kept, but length is
+    # the whole packet's, so length checks give the same answer as on the full line
+    with open(hex_path, "r") as f:
+        while True:
+            rows = [hex_row(line) for line in itertools.islice(f, chunk_rows)]
+            if not rows:
+                return
+            width = max(len(r) for r in rows)
+            if max_len is not None:
+                width = min(width, max_len)
+            payload = np.zeros((len(rows), width), dtype=np.uint8)
+            length = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+            for i, row in enumerate(rows):
+                row = row[:width]
+                payload[i, :len(row)] = np.frombuffer(row, dtype=np.uint8)
+            yield payload, length
+
+
+def ensure_store(path, max_len=80):
+    # Reuse <stem>.pkt when it is newer than its .hex / .pcap source and wide enough, otherwise (re)build it
+    if is_store(path):
+        return path
+    store_path = store_path_for(path)
+    payload_npy = os.path.join(store_path, "payload.npy")
+    if is_store(store_path) and os.path.getmtime(payload_npy) >= os.path.getmtime(path) and \
+            np.load(payload_npy, mmap_mode="r").shape[1] >= max_len:
+        return store_path
+    if path.endswith((".pcap", ".cap")):
+        return pcap_to_store(path, store_path, max_len=max_len)[0]
+    return hex_to_store(path, store_path, max_len=max_len)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert captures to / dump a binary payload store")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--pcap", help="Build <pcap stem>.pkt from a pcap")
+    src.add_argument("--hex", help="Build <hex stem>.pkt from a .hex file")
+    src.add_argument("--store", help="Dump an existing store to stdout")
+    parser.add_argument("--max_len", type=int, default=80)
+    parser.add_argument("--dump", choices=["hex", "txt"], default="hex",
+                        help="With --store: 'hex' = .hex lines, 'txt' = BinaryInferno lines (no spaces)")
+    args = parser.parse_args()
+
+    if args.store:
+        store = load_store(args.store)
+        sep = " " if args.dump == "hex" else ""
+        out = sys.stdout
+        for line in store.hex_lines(sep=sep):
+            out.write(line + "\n")
+        return
+
+    if args.pcap:
+        store_path, n = pcap_to_store(args.pcap, max_len=args.max_len)
+    else:
+        store_path, n = hex_to_store(args.hex, max_len=args.max_len)
+    print(f"Saved {n} packets to store: {store_path}")
+
+
+if __name__ == "__main__":
+    main()
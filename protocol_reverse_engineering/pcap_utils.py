@@ -0,0 +1,211 @@
+# pcap_utils.py
+import struct
+
+# -----------------------------
+# Classic pcap constants
+# -----------------------------
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+
+MAGIC_USEC = 0xA1B2C3D4
+MAGIC_NSEC = 0xA1B23C4D
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_UDP = 17
+# IPv6 extension headers that can precede the UDP header
+IPV6_EXT_HEADERS = (0, 43, 60)
+IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+
+# -----------------------------
+# Reader / Writer
+# -----------------------------
+class PcapReader:
+    # Streams records one at a time; only the buffered chunk is held in memory
+    def __init__(self, path, chunk_size=1 << 20):
+        self.f = open(path, "rb", buffering=chunk_size)
+        header = self.f.read(PCAP_GLOBAL_HEADER_LEN)
+        if len(header) < PCAP_GLOBAL_HEADER_LEN:
+            self.f.close()
+            raise ValueError(f"Truncated pcap global header: {path}")
+
+        magic_le = struct.unpack("<I", header[:4])[0]
+        magic_be = struct.unpack(">I", header[:4])[0]
+        if magic_le in (MAGIC_USEC, MAGIC_NSEC):
+            self.endian, magic = "<", magic_le
+        elif magic_be in (MAGIC_USEC, MAGIC_NSEC):
+            self.endian, magic = ">", magic_be
+        else:
+            self.f.close()
+            raise ValueError(f"Not a classic pcap file (pcapng is not supported): {path}")
+
+        self.header = header
+        self.ts_scale = 1e-9 if magic == MAGIC_NSEC else 1e-6
+        _, _, _, _, self.snaplen, self.linktype = struct.unpack(self.endian + "HHiIII", header[4:])
+        self._rec = struct.Struct(self.endian + "IIII")
+
+    def __iter__(self):
+        # Yields (timestamp, record_header, frame_bytes)
+        read = self.f.read
+        unpack = self._rec.unpack
+        scale = self.ts_scale
+        while True:
+            hdr = read(PCAP_RECORD_HEADER_LEN)
+            if len(hdr) < PCAP_RECORD_HEADER_LEN:
+                return
+            ts_sec, ts_frac, caplen, _ = unpack(hdr)
+            data = read(caplen)
+            if len(data) < caplen:
+                return
+            yield ts_sec + ts_frac * scale, hdr, data
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PcapWriter:
+    # Appends raw records under the global header of the source capture
+    def __init__(self, path, header, chunk_size=1 << 20):
+        self.f = open(path, "wb", buffering=chunk_size)
+        self.f.write(header)
+        self.count = 0
+
+    def write(self, hdr, data):
+        self.f.write(hdr)
+        self.f.write(data)
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -----------------------------
+# Header parsing (no per-packet objects)
+# -----------------------------
+def _l3_offset(data, linktype):
+    # Returns (ethertype, offset of the network header) or (None, None)
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None, None
+        etype = (data[12] << 8) | data[13]
+        off = 14
+        while etype in ETHERTYPE_VLAN and len(data) >= off + 4:
+            etype = (data[off + 2] << 8) | data[off + 3]
+            off += 4
+        return etype, off
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None, None
+        return (data[14] << 8) | data[15], 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        if len(data) < 20:
+            return None, None
+        return (data[0] << 8) | data[1], 20
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        if len(data) < 4:
+            return None, None
+        return _ethertype_from_version(data, 4), 4
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return _ethertype_from_version(data, 0), 0
+    return None, None
+
+
+def _ethertype_from_version(data, off):
+    if len(data) <= off:
+        return None
+    version = data[off] >> 4
+    if version == 4:
+        return ETHERTYPE_IPV4
+    if version == 6:
+        return ETHERTYPE_IPV6
+    return None
+
+
+def _udp_offsets(data, linktype):
+    # Returns (ethertype, network header offset, UDP header offset) or None
+    etype, off = _l3_offset(data, linktype)
+    if etype == ETHERTYPE_IPV4:
+        if len(data) < off + 20:
+            return None
+        ihl = (data[off] & 0x0F) * 4
+        if data[off + 9] != IPPROTO_UDP:
+            return None
+        # Non-first fragments carry no UDP header
+        if ((data[off + 6] & 0x1F) << 8) | data[off + 7]:
+            return None
+        udp = off + ihl
+    elif etype == ETHERTYPE_IPV6:
+        if len(data) < off + 40:
+            return None
+        nxt = data[off + 6]
+        udp = off + 40
+        while nxt in IPV6_EXT_HEADERS and len(data) >= udp + 8:
+            nxt = data[udp]
+            udp += (data[udp + 1] + 1) * 8
+        if nxt != IPPROTO_UDP:
+            return None
+    else:
+        return None
+
+    if len(data) < udp + 8:
+        return None
+    return etype, off, udp
+
+
+def parse_udp(data, linktype):
+    """Return (sport, dport, payload) for a UDP frame, or None.
+
+    The payload runs to the end of the captured frame, link-layer padding
+    included, which matches what scapy returns for ``bytes(pkt[UDP].payload)``.
+    """
+    offsets = _udp_offsets(data, linktype)
+    if offsets is None:
+        return None
+    udp = offsets[2]
+    sport = (data[udp] << 8) | data[udp + 1]
+    dport = (data[udp + 2] << 8) | data[udp + 3]
+    return sport, dport, data[udp + 8:]
+
+
+def parse_udp_flow(data, linktype):
+    """Like parse_udp, but returns (src_ip, dst_ip, sport, dport, payload).
+
+    Addresses are 16-byte strings; IPv4 addresses are IPv4-mapped (::ffff:a.b.c.d).
+    """
+    offsets = _udp_offsets(data, linktype)
+    if offsets is None:
+        return None
+    etype, off, udp = offsets
+    if etype == ETHERTYPE_IPV4:
+        src = IPV4_MAPPED_PREFIX + data[off + 12:off + 16]
+        dst = IPV4_MAPPED_PREFIX + data[off + 16:off + 20]
+    else:
+        src = data[off + 8:off + 24]
+        dst = data[off + 24:off + 40]
+    sport = (data[udp] << 8) | data[udp + 1]
+    dport = (data[udp + 2] << 8) | data[udp + 3]
+    return src, dst, sport, dport, data[udp + 8:]
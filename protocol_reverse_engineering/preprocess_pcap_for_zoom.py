@@ -1,9 +1,11 @@
 import argparse
-from scapy.all import rdpcap, wrpcap, UDP
 import os
 import re
 import json
 from datetime import datetime, timezone
+from pcap_utils import PcapReader, PcapWriter, parse_udp
+
+SERVER_PORT = 8801
 
 
 def extract_timestamp_from_filename(filename):
@@ -82,7 +84,29 @@ def extract_ssrc_from_udp_payload(payload: bytes):
     return ssrc_bytes.hex().upper()
 
 
+def update_usermap(usermap_path, client_name, client_ssrcs):
+    # Update usermap
+    if client_name and client_ssrcs:
+        usermap = load_usermap(usermap_path)
+
+        new_count = 0
+        for ssrc_hex in client_ssrcs:
+            if ssrc_hex not in usermap:
+                usermap[ssrc_hex] = client_name
+                new_count += 1
+
+        if new_count > 0:
+            save_usermap(usermap_path, usermap)
+            print(f"Added {new_count} new SSRC entries for client '{client_name}' to {usermap_path}")
+        else:
+            print(f"No new SSRC entries to add for client '{client_name}'")
+    else:
+        print("No SSRC discovered or client name missing, usermap unchanged")
+
+
 def filter_pcap(input_pcap, skip_seconds, client_name):
+    from scapy.all import rdpcap, wrpcap, UDP
+
     packets = rdpcap(input_pcap)
     if not packets:
         print("No packets found in the input file.")
@@ -98,7 +122,7 @@ def filter_pcap(input_pcap, skip_seconds, client_name):
     client_ssrcs = set()
 
     for pkt in packets:
-        pkt_dt = datetime.fromtimestamp(pkt.time, tz=timezone.utc)
+        pkt_dt = datetime.fromtimestamp(float(pkt.time), tz=timezone.utc)
 
         if (pkt_dt - file_start_time).total_seconds() <= skip_seconds:
             continue
@@ -107,12 +131,12 @@ def filter_pcap(input_pcap, skip_seconds, client_name):
             sport = pkt[UDP].sport
             dport = pkt[UDP].dport
 
-            if sport == 8801 or dport == 8801:
+            if sport == SERVER_PORT or dport == SERVER_PORT:
                 all_filtered.append(pkt)
 
-                if sport == 8801:
+                if sport == SERVER_PORT:
                     recv_filtered.append(pkt)
-                if dport == 8801:
+                if dport == SERVER_PORT:
                     send_filtered.append(pkt)
                     payload = bytes(pkt[UDP].payload)
                     ssrc_hex = extract_ssrc_from_udp_payload(payload)
@@ -129,24 +153,40 @@ def filter_pcap(input_pcap, skip_seconds, client_name):
 
     print(f"Saved {len(all_filtered)} filtered packets to: {output_all}")
 
-    # Update usermap
-    if client_name and client_ssrcs:
-        usermap_path = get_usermap_path(input_pcap)
-        usermap = load_usermap(usermap_path)
+    update_usermap(get_usermap_path(input_pcap), client_name, client_ssrcs)
 
-        new_count = 0
-        for ssrc_hex in client_ssrcs:
-            if ssrc_hex not in usermap:
-                usermap[ssrc_hex] = client_name
-                new_count += 1
 
-        if new_count > 0:
-            save_usermap(usermap_path, usermap)
-            print(f"Added {new_count} new SSRC entries for client '{client_name}' to {usermap_path}")
-        else:
-            print(f"No new SSRC entries to add for client '{client_name}'")
-    else:
-        print("No SSRC discovered or client name missing, usermap unchanged")
+def filter_pcap_stream(input_pcap, skip_seconds, client_name, chunk_size=1 << 20):
+    # Single pass over raw records: no scapy dissection, output written as we go
+    filename = os.path.basename(input_pcap)
+    file_start_time = extract_timestamp_from_filename(filename)
+    cutoff = file_start_time.timestamp() + skip_seconds
+
+    base_path = os.path.dirname(input_pcap)
+    output_all = os.path.join(base_path, f"preprocessed_{filename}")
+
+    client_ssrcs = set()
+
+    with PcapReader(input_pcap, chunk_size=chunk_size) as reader, \
+            PcapWriter(output_all, reader.header, chunk_size=chunk_size) as writer:
+        for ts, hdr, data in reader:
+            if ts <= cutoff:
+                continue
+            udp = parse_udp(data, reader.linktype)
+            if udp is None:
+                continue
+            sport, dport, payload = udp
+            if sport != SERVER_PORT and dport != SERVER_PORT:
+                continue
+            writer.write(hdr, data)
+            if dport == SERVER_PORT:
+                ssrc_hex = extract_ssrc_from_udp_payload(payload)
+                if ssrc_hex:
+                    client_ssrcs.add(ssrc_hex)
+
+    print(f"Saved {writer.count} filtered packets to: {output_all}")
+
+    update_usermap(get_usermap_path(input_pcap), client_name, client_ssrcs)
 
 
 if __name__ == "__main__":
@@ -154,7 +194,12 @@ if __name__ == "__main__":
     parser.add_argument("--pcap", required=True, help="Path to the input PCAP file")
     parser.add_argument("--skip", type=int, default=200, help="Seconds to skip after file start time")
     parser.add_argument("--client", required=True, help="Client name to associate with SSRCs")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream raw pcap records instead of loading the capture with scapy")
     args = parser.parse_args()
 
-    filter_pcap(args.pcap, args.skip, args.client)
+    if args.stream:
+        filter_pcap_stream(args.pcap, args.skip, args.client)
+    else:
+        filter_pcap(args.pcap, args.skip, args.client)
 
@@ -1,15 +1,84 @@
 # pretrain_bytebert.py
-import argparse, math, torch, random
+#
+# Single process:  python pretrain_bytebert.py --hex_file <corpus> ...
+# Data parallel:   torchrun --nproc_per_node 4 pretrain_bytebert.py --hex_file <corpus> ...
+#                  (gloo backend on CPU; add --nnodes/--rdzv_endpoint for several machines)
+import argparse, contextlib, logging, math, os, torch, random
+import numpy as np
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.data import DataLoader, random_split
+from torch.utils.data.distributed import DistributedSampler
 import torch.nn as nn
 from datetime import datetime
 
 from bytebert_utils import (
-    FullPacketDataset, ByteBERT,
+    FullPacketDataset, MappedPacketDataset, collate_packets, collate_trimmed,
+    TokenBudgetBatchSampler, dataset_lengths, ByteBERT,
     setup_logger, mask_inputs, make_key_padding_mask,
     VOCAB_SIZE
 )
 
+# -----------------------------
+# Distributed / precision helpers
+# -----------------------------
+def init_distributed():
+    # torchrun sets WORLD_SIZE/RANK/LOCAL_RANK; a plain launch stays single-process
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return 0, 1, 0
+    rank = int(os.environ["RANK"])
+    local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+    backend = "nccl" if torch.cuda.is_available() else "gloo"
+    dist.init_process_group(backend=backend)
+    if not torch.cuda.is_available():
+        # Split the cores of one machine between its local ranks
+        local_world = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world))
+    return rank, world_size, local_rank
+
+
+def amp_settings(device, enabled):
+    # Returns (autocast dtype or None, GradScaler or None)
+    if not enabled:
+        return None, None
+    if device.startswith("cuda"):
+        if torch.cuda.is_bf16_supported():
+            return torch.bfloat16, None
+        return torch.float16, torch.amp.GradScaler("cuda")
+    return torch.bfloat16, None
+
+
+def _autocast(device, amp_dtype):
+    if amp_dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.split(":")[0], dtype=amp_dtype)
+
+
+def _all_reduce_sum(values, device, world_size):
+    if world_size <= 1:
+        return values
+    t = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
+
+
+def _rng_state():
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def _set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state.get("cuda") is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
 def build_scheduler(optimizer, num_train_steps, warmup_ratio=0.05):
     warmup_steps = max(1, int(num_train_steps * warmup_ratio))
     def lr_lambda(current_step):
@@ -19,7 +88,7 @@ def build_scheduler(optimizer, num_train_steps, warmup_ratio=0.05):
         return 0.5 * (1.0 + math.cos(math.pi * progress)) 
     return torch.optim.lr_scheduler.LambdaLR(optimizer, lr_lambda)
 
-def eval_loss(model, dataloader, device, loss_fn):
+def eval_loss(model, dataloader, device, loss_fn, amp_dtype=None, world_size=1):
     model.eval()
     total = 0.0
     count = 0
@@ -28,67 +97,157 @@ def eval_loss(model, dataloader, device, loss_fn):
             x = x.to(device); lengths = lengths.to(device)
             key_pad = make_key_padding_mask(lengths, x.size(1))
             masked, labels = mask_inputs(x) 
-            logits = model(masked, key_padding_mask=key_pad)
-            loss = loss_fn(logits.view(-1, VOCAB_SIZE), labels.view(-1))
+            with _autocast(device, amp_dtype):
+                logits = model(masked, key_padding_mask=key_pad)
+            loss = loss_fn(logits.float().view(-1, VOCAB_SIZE), labels.view(-1))
             total += loss.item()
             count += 1
+    # Mean over every rank's batches
+    total, count = _all_reduce_sum([total, count], device, world_size)
     return total / max(1, count)
 
+def save_checkpoint(path, model, optimizer, scheduler, scaler, epoch, global_step,
+                    best_val, best_epoch, no_improve, world_size=1):
+    # Every rank contributes its RNG state; rank 0 writes the file
+    rng = _rng_state()
+    if world_size > 1:
+        states = [None] * world_size
+        dist.all_gather_object(states, rng)
+    else:
+        states = [rng]
+    if not dist.is_initialized() or dist.get_rank() == 0:
+        raw = model.module if isinstance(model, DDP) else model
+        tmp_path = path + ".tmp"
+        torch.save({
+            "model": raw.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "scaler": scaler.state_dict() if scaler is not None else None,
+            "epoch": epoch,
+            "global_step": global_step,
+            "best_val": best_val,
+            "best_epoch": best_epoch,
+            "no_improve": no_improve,
+            "rng": states,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+def load_checkpoint(path, model, optimizer, scheduler, scaler, device, rank=0):
+    ckpt = torch.load(path, map_location=device, weights_only=False)
+    raw = model.module if isinstance(model, DDP) else model
+    raw.load_state_dict(ckpt["model"])
+    optimizer.load_state_dict(ckpt["optimizer"])
+    scheduler.load_state_dict(ckpt["scheduler"])
+    if scaler is not None and ckpt.get("scaler") is not None:
+        scaler.load_state_dict(ckpt["scaler"])
+    states = ckpt["rng"]
+    _set_rng_state(states[rank] if rank < len(states) else states[0])
+    return ckpt
+
 def train_loop(
     model, train_loader, val_loader, device, logger,
     epochs=100, mask_prob=0.15, lr=1e-4, model_best_path="model_best.pt",
-    model_last_path="model_last.pt", warmup_ratio=0.05, patience=10
+    model_last_path="model_last.pt", warmup_ratio=0.05, patience=10,
+    accum_steps=1, amp=False, checkpoint_path=None, resume=None,
+    rank=0, world_size=1
 ):
+    model.to(device)
+    if world_size > 1:
+        model = DDP(model, device_ids=[device] if device.startswith("cuda") else None)
+    raw = model.module if isinstance(model, DDP) else model
+
     optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=0.01)
     loss_fn = nn.CrossEntropyLoss(ignore_index=-100)
-    model.to(device)
+    amp_dtype, scaler = amp_settings(device, amp)
 
-    total_steps = epochs * len(train_loader)
+    # One optimizer step per accum_steps batches
+    steps_per_epoch = math.ceil(len(train_loader) / accum_steps)
+    total_steps = epochs * steps_per_epoch
     scheduler = build_scheduler(optimizer, total_steps, warmup_ratio)
 
     best_val = float("inf")
     best_epoch = -1
     no_improve = 0
     global_step = 0
+    start_epoch = 1
+
+    if resume:
+        ckpt = load_checkpoint(resume, model, optimizer, scheduler, scaler, device, rank)
+        start_epoch = ckpt["epoch"] + 1
+        global_step = ckpt["global_step"]
+        best_val, best_epoch, no_improve = ckpt["best_val"], ckpt["best_epoch"], ckpt["no_improve"]
+        logger.info(f"[Resumed] {resume} at epoch {ckpt['epoch']} (step {global_step}, best val {best_val:.4f})")
+
+    for epoch in range(start_epoch, epochs + 1):
+        for loader in (train_loader, val_loader):
+            sampler = loader.batch_sampler if loader.batch_sampler is not None else None
+            for s in (sampler, getattr(sampler, "sampler", None)):
+                if hasattr(s, "set_epoch"):
+                    s.set_epoch(epoch)
 
-    for epoch in range(1, epochs + 1):
         model.train()
         total_train = 0.0
+        optimizer.zero_grad()
 
-        for x, lengths in train_loader:
+        for b, (x, lengths) in enumerate(train_loader):
             x = x.to(device); lengths = lengths.to(device)
             key_pad = make_key_padding_mask(lengths, x.size(1))
             masked, labels = mask_inputs(x, mask_prob=mask_prob)
-            logits = model(masked, key_padding_mask=key_pad)
-            loss = loss_fn(logits.view(-1, VOCAB_SIZE), labels.view(-1))
 
-            optimizer.zero_grad()
-            loss.backward()
-            torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-            optimizer.step()
-            scheduler.step()
+            last_micro = (b + 1) % accum_steps == 0 or (b + 1) == len(train_loader)
+            # Gradients are only all-reduced on the micro-batch that steps the optimizer
+            sync = model.no_sync() if isinstance(model, DDP) and not last_micro else contextlib.nullcontext()
+            with sync:
+                with _autocast(device, amp_dtype):
+                    logits = model(masked, key_padding_mask=key_pad)
+                loss = loss_fn(logits.float().view(-1, VOCAB_SIZE), labels.view(-1))
+                scaled = loss / accum_steps
+                if scaler is not None:
+                    scaler.scale(scaled).backward()
+                else:
+                    scaled.backward()
+
+            if last_micro:
+                if scaler is not None:
+                    scaler.unscale_(optimizer)
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+                if scaler is not None:
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                scheduler.step()
+                optimizer.zero_grad()
+                global_step += 1
 
             total_train += loss.item()
-            global_step += 1
 
-        avg_train = total_train / max(1, len(train_loader))
-        val = eval_loss(model, val_loader, device, loss_fn)
+        total_train, n_batches = _all_reduce_sum([total_train, len(train_loader)], device, world_size)
+        avg_train = total_train / max(1, n_batches)
+        val = eval_loss(model, val_loader, device, loss_fn, amp_dtype=amp_dtype, world_size=world_size)
         logger.info(f"Epoch {epoch}/{epochs} | Train: {avg_train:.4f} | Val: {val:.4f}")
 
+        # val is identical on every rank, so all ranks take the same branch
         if val < best_val:
             best_val = val
             best_epoch = epoch
-            torch.save(model.state_dict(), model_best_path)
+            if rank == 0:
+                torch.save(raw.state_dict(), model_best_path)
             logger.info(f"[Best Model Saved] Val: {val:.4f} → {model_best_path}")
             no_improve = 0
         else:
             no_improve += 1
 
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, model, optimizer, scheduler, scaler, epoch, global_step,
+                            best_val, best_epoch, no_improve, world_size)
+
         if no_improve >= patience:
             logger.info(f"[Early Stopping] No improvement for {patience} epochs. Best epoch={best_epoch}.")
             break
 
-    torch.save(model.state_dict(), model_last_path)
+    if rank == 0:
+        torch.save(raw.state_dict(), model_last_path)
     logger.info(f"[Last Model Saved] → {model_last_path}")
     logger.info(f"[Training Completed] Best val: {best_val:.4f} at epoch {best_epoch}")
 
@@ -103,33 +262,98 @@ def main():
     parser.add_argument("--warmup_ratio", type=float, default=0.05)
     parser.add_argument("--patience", type=int, default=10)
     parser.add_argument("--val_ratio", type=float, default=0.10)
+    parser.add_argument("--mmap", action="store_true",
+                        help="Train from a memory-mapped .pkt store (built once from --hex_file, which may also be a .pcap or .pkt)")
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--max_tokens", type=int, default=0,
+                        help="Length-bucketed batches of up to this many padded tokens (0 = fixed --batch_size)")
+    parser.add_argument("--bucket_width", type=int, default=8)
+    parser.add_argument("--accum_steps", type=int, default=1, help="Batches per optimizer step")
+    parser.add_argument("--amp", action="store_true", help="Mixed precision (bf16 on CPU / bf16 or fp16 on GPU)")
+    parser.add_argument("--checkpoint", type=str, default=None,
+                        help="Resumable checkpoint written after every epoch (default: the --resume file, else none)")
+    parser.add_argument("--resume", type=str, default=None, help="Resume from a --checkpoint file")
     args = parser.parse_args()
 
+    rank, world_size, local_rank = init_distributed()
+
+    # Every rank must agree on the run name
     now = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if world_size > 1:
+        names = [now]
+        dist.broadcast_object_list(names, src=0)
+        now = names[0]
     log_file = f"pretrain_{now}.log"
     model_best_path = f"pretrained_model_best_{now}.pt"
     model_last_path = f"pretrained_model_last_{now}.pt"
+    # A resumed run keeps updating the checkpoint it started from
+    checkpoint_path = args.checkpoint or args.resume
 
-    logger = setup_logger(log_file)
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if rank == 0:
+        logger = setup_logger(log_file)
+    else:
+        logger = logging.getLogger(f"ByteBERT.rank{rank}")
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+    device = f"cuda:{local_rank}" if torch.cuda.is_available() else "cpu"
+    if world_size > 1:
+        logger.info(f"DistributedDataParallel: {world_size} ranks, backend={dist.get_backend()}")
 
-    full = FullPacketDataset(args.hex_file, max_len=args.max_len)
+    if args.mmap and world_size > 1:
+        # Build the .pkt store once, then let every rank map it
+        if rank == 0:
+            MappedPacketDataset(args.hex_file, max_len=args.max_len)
+        dist.barrier()
+
+    if args.mmap:
+        full = MappedPacketDataset(args.hex_file, max_len=args.max_len)
+        collate_fn = collate_packets
+    else:
+        full = FullPacketDataset(args.hex_file, max_len=args.max_len)
+        collate_fn = None
     val_len = max(1, int(len(full) * args.val_ratio))
     train_len = max(1, len(full) - val_len)
     generator = torch.Generator().manual_seed(42)
     train_set, val_set = random_split(full, [train_len, val_len], generator=generator)
 
-    train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True)
-    val_loader = DataLoader(val_set, batch_size=args.batch_size, shuffle=False)
+    if args.max_tokens > 0:
+        # Similar-length packets per batch, each batch trimmed to its own longest packet
+        train_sampler = TokenBudgetBatchSampler(dataset_lengths(train_set), args.max_tokens,
+                                                bucket_width=args.bucket_width, shuffle=True,
+                                                num_replicas=world_size, rank=rank)
+        val_sampler = TokenBudgetBatchSampler(dataset_lengths(val_set), args.max_tokens,
+                                              bucket_width=args.bucket_width, shuffle=False,
+                                              num_replicas=world_size, rank=rank)
+        train_loader = DataLoader(train_set, batch_sampler=train_sampler,
+                                  collate_fn=collate_trimmed, num_workers=args.num_workers)
+        val_loader = DataLoader(val_set, batch_sampler=val_sampler,
+                                collate_fn=collate_trimmed, num_workers=args.num_workers)
+    elif world_size > 1:
+        train_loader = DataLoader(train_set, batch_size=args.batch_size,
+                                  sampler=DistributedSampler(train_set, world_size, rank, shuffle=True, seed=42),
+                                  collate_fn=collate_fn, num_workers=args.num_workers)
+        val_loader = DataLoader(val_set, batch_size=args.batch_size,
+                                sampler=DistributedSampler(val_set, world_size, rank, shuffle=False),
+                                collate_fn=collate_fn, num_workers=args.num_workers)
+    else:
+        train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True,
+                                  collate_fn=collate_fn, num_workers=args.num_workers)
+        val_loader = DataLoader(val_set, batch_size=args.batch_size, shuffle=False,
+                                collate_fn=collate_fn, num_workers=args.num_workers)
 
     model = ByteBERT(seq_len=args.max_len)
     train_loop(
         model, train_loader, val_loader, device, logger,
         epochs=args.epochs, mask_prob=args.mask_prob, lr=args.lr,
         model_best_path=model_best_path, model_last_path=model_last_path,
-        warmup_ratio=args.warmup_ratio, patience=args.patience
+        warmup_ratio=args.warmup_ratio, patience=args.patience,
+        accum_steps=args.accum_steps, amp=args.amp, checkpoint_path=checkpoint_path,
+        resume=args.resume, rank=rank, world_size=world_size
     )
 
+    if world_size > 1:
+        dist.destroy_process_group()
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,253 @@
+import argparse
+import fcntl
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from extract_net_from_pcap import PIPELINES, DEFAULT_SKIP, collect_payloads
+from payload_store import PayloadStoreWriter, load_store
+from ssrc_index import SSRCIndex, build_index, save_index, index_path_for
+
+# recordings_tmv-<colour> -> client name (see README)
+COLOR_NAMES = {
+    "red": "Alice",
+    "green": "Bob",
+    "blue": "Charlie",
+    "cyan": "David",
+    "magenta": "Emily",
+    "yellow": "Fred",
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATS_EVAL = os.path.join(REPO_ROOT, "evaluation", "consistency_checker", "stats_eval_for_{vca}.py")
+
+SUMMARY_FIELDS = ("Observed", "Labeled", "Mismatched(Control)", "Mismatched(Data)")
+
+
+# -----------------------------
+# Discovery
+# -----------------------------
+def discover_captures(session_dir, timestamp=None):
+    """Return (timestamp, [(colour, client, pcap_path), ...]) for one session."""
+    found = {}
+    for pcap in glob.glob(os.path.join(session_dir, "recordings_tmv-*", "tcpdump_*.pcap")):
+        colour = os.path.basename(os.path.dirname(pcap))[len("recordings_tmv-"):]
+        match = re.search(r"tcpdump_(\d{8}_\d{6})\.pcap$", pcap)
+        if not match or colour not in COLOR_NAMES:
+            continue
+        found.setdefault(match.group(1), []).append((colour, COLOR_NAMES[colour], pcap))
+
+    if timestamp is None:
+        if len(found) != 1:
+            raise SystemExit(f"Pass --timestamp, captures found for: {sorted(found) or 'none'}")
+        timestamp = next(iter(found))
+    if timestamp not in found:
+        raise SystemExit(f"No tcpdump_{timestamp}.pcap under {session_dir}/recordings_tmv-*")
+
+    # Fixed participant order, so the usermap merge is deterministic
+    order = list(COLOR_NAMES)
+    return timestamp, sorted(found[timestamp], key=lambda c: order.index(c[0]))
+
+
+# -----------------------------
+# Usermap merge
+# -----------------------------
+def merge_usermap(usermap_path, discoveries):
+    """Merge {client: ssrcs} into the usermap once, under a lock, with an atomic replace.
+
+    As with update_usermap, an SSRC that is already mapped keeps its owner; clients
+    are applied in the order given.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(usermap_path)), exist_ok=True)
+    with open(usermap_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        usermap = {}
+        if os.path.exists(usermap_path):
+            with open(usermap_path, "r", encoding="utf-8") as f:
+                usermap = json.load(f)
+
+        added = {}
+        for client, ssrcs in discoveries.items():
+            for ssrc_hex in sorted(ssrcs):
+                if ssrc_hex not in usermap:
+                    usermap[ssrc_hex] = client
+                    added[client] = added.get(client, 0) + 1
+
+        if added:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(usermap_path)),
+                                            prefix=".usermap_", suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(usermap, f, indent=2, sort_keys=False)
+            os.replace(tmp_path, usermap_path)
+    return usermap, added
+
+
+# -----------------------------
+# Per-participant stages (run in worker processes)
+# -----------------------------
+def preprocess_capture(vca, client, pcap, skip, max_bytes, tee):
+    # Filter + SSRC scan; payloads are kept in a .pkt store for the CI stage
+    pre, _ = PIPELINES[vca]
+    base_path = os.path.dirname(pcap)
+    base_name = os.path.basename(pcap)
+    stem = os.path.splitext(f"preprocessed_{base_name}")[0]
+    ssrc_stats = {}
+    store_path = os.path.join(base_path, f"{stem}.pkt")
+    # Payloads stream straight into the store
+    with PayloadStoreWriter(store_path, max_len=max_bytes) as writer:
+        count, _ = collect_payloads(
+            pcap, pre, skip, max_bytes=max_bytes, sink=writer.append,
+            tee_pcap=os.path.join(base_path, f"preprocessed_{base_name}") if tee else None,
+            tee_hex=os.path.join(base_path, f"{stem}.hex") if tee else None,
+            ssrc_stats=ssrc_stats,
+        )
+    return client, store_path, ssrc_stats, count
+
+
+def extract_flows(vca, client, store_path, usermap, net_path):
+    _, ci = PIPELINES[vca]
+    store = load_store(store_path)
+    with open(net_path, "w") as f:
+        if not len(store):
+            return net_path, 0
+        if vca == "meet":
+            # Chunked so RTCP media state carries across chunks
+            ssrc_media = {}
+            for start in range(0, len(store), 1 << 20):
+                lines = ci.parse_matrix(np.asarray(store.payload[start:start + (1 << 20)]),
+                                        np.asarray(store.length[start:start + (1 << 20)]),
+                                        client, usermap, ssrc_media)
+                f.write("\n".join(lines) + "\n")
+        else:
+            lines = ci.parse_matrix(store.payload, store.length, client, usermap)
+            f.write("\n".join(lines) + "\n")
+    return net_path, len(store)
+
+
+def run_stats_eval(vca, client, net_path, user_path, result_path):
+    cmd = [sys.executable, STATS_EVAL.format(vca=vca),
+           "--net", net_path, "--user", user_path, "--client", client]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return client, None, proc.stderr.strip()
+    with open(result_path, "w") as f:
+        f.write(proc.stdout)
+    counts = {}
+    for line in proc.stdout.splitlines():
+        key, _, val = line.partition(":")
+        if key in SUMMARY_FIELDS:
+            counts[key] = int(val)
+    return client, counts, None
+
+
+# -----------------------------
+# Session driver
+# -----------------------------
+def process_session(args):
+    timestamp, captures = discover_captures(args.session_dir, args.timestamp)
+    print(f"Session {timestamp}: {', '.join(client for _, client, _ in captures)}")
+
+    skip = DEFAULT_SKIP[args.vca] if args.skip is None else args.skip
+    workers = args.workers or min(len(captures), os.cpu_count() or 1)
+    pre, _ = PIPELINES[args.vca]
+    usermap_path = args.usermap or pre.get_usermap_path(captures[0][2])
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 1) per-participant preprocessing, in parallel
+        futures = [pool.submit(preprocess_capture, args.vca, client, pcap, skip, args.max_bytes, args.tee)
+                   for _, client, pcap in captures]
+        stores = {}
+        per_client = {}
+        for fut in futures:
+            client, store_path, ssrc_stats, n = fut.result()
+            stores[client] = store_path
+            per_client[client] = ssrc_stats
+            print(f"[{client}] {n} filtered packets, {len(ssrc_stats)} SSRCs")
+
+        # 2) frozen SSRC index and a single usermap write once every participant is known
+        index, clients, conflicts = build_index(per_client)
+        index_path = index_path_for(args.session_dir, timestamp)
+        save_index(index_path, index, clients)
+        print(f"Saved {len(index)} SSRCs to: {index_path}"
+              + (f" ({conflicts} sent by more than one participant)" if conflicts else ""))
+        usermap, added = merge_usermap(usermap_path, SSRCIndex(index, clients).owned_by())
+        for client, count in added.items():
+            print(f"Added {count} new SSRC entries for client '{client}' to {usermap_path}")
+
+        # 3) CI extraction against the merged usermap, in parallel
+        net_paths = {client: os.path.join(os.path.dirname(pcap), f"{timestamp}.net")
+                     for _, client, pcap in captures}
+        futures = [pool.submit(extract_flows, args.vca, client, stores[client], usermap, net_paths[client])
+                   for _, client, _ in captures]
+        for fut in futures:
+            net_path, n = fut.result()
+            print(f"Network-level flows saved to {net_path} ({n} packets)")
+
+    # 4) consistency checks where a .user file is available
+    jobs = []
+    for _, client, pcap in captures:
+        user_path = os.path.join(os.path.dirname(pcap), f"{timestamp}.user")
+        if os.path.exists(user_path):
+            result_path = os.path.join(os.path.dirname(pcap), f"{timestamp}.result")
+            jobs.append((args.vca, client, net_paths[client], user_path, result_path))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for client, counts, err in pool.map(lambda job: run_stats_eval(*job), jobs):
+            results[client] = counts
+            if err:
+                print(f"[{client}] stats_eval failed: {err}", file=sys.stderr)
+
+    summary_path = args.summary or os.path.join(args.session_dir, f"session_{timestamp}.summary")
+    write_summary(summary_path, args.vca, timestamp, captures, results)
+    print(f"Session summary saved to {summary_path}")
+
+
+def write_summary(path, vca, timestamp, captures, results):
+    with open(path, "w") as f:
+        f.write(f"vca: {vca}\n")
+        f.write(f"session: {timestamp}\n")
+        f.write("client\t" + "\t".join(SUMMARY_FIELDS) + "\n")
+        totals = dict.fromkeys(SUMMARY_FIELDS, 0)
+        for _, client, _ in captures:
+            counts = results.get(client)
+            if counts is None:
+                status = "no .user file" if client not in results else "failed"
+                f.write(f"{client}\t{status}\n")
+                continue
+            f.write(client + "\t" + "\t".join(str(counts.get(k, 0)) for k in SUMMARY_FIELDS) + "\n")
+            for k in SUMMARY_FIELDS:
+                totals[k] += counts.get(k, 0)
+        f.write("total\t" + "\t".join(str(totals[k]) for k in SUMMARY_FIELDS) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the per-participant pcap -> .net -> consistency check pipeline for one session"
+    )
+    parser.add_argument("--vca", choices=sorted(PIPELINES), required=True)
+    parser.add_argument("--session_dir", required=True,
+                        help="Directory holding the recordings_tmv-* participant directories")
+    parser.add_argument("--timestamp", default=None,
+                        help="Session timestamp <date>_<time> (default: the only one found)")
+    parser.add_argument("--skip", type=int, default=None,
+                        help="Seconds to skip after file start time (default: 200 for zoom, 105 for meet)")
+    parser.add_argument("--usermap", default=None, help="Optional path to usermap JSON file")
+    parser.add_argument("--max_bytes", type=int, default=80)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per capture, up to CPU count)")
+    parser.add_argument("--tee", action="store_true", help="Also write preprocessed_<pcap> and .hex files")
+    parser.add_argument("--summary", default=None, help="Summary path (default: <session_dir>/session_<timestamp>.summary)")
+    args = parser.parse_args()
+
+    process_session(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# ssrc_index.py
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from extract_net_from_pcap import PIPELINES, DEFAULT_SKIP
+from pcap_utils import PcapReader, parse_udp
+
+# -----------------------------
+# Layout
+# -----------------------------
+# One .npz per session, no pickled objects:
+#   index    INDEX_DTYPE [K]  sorted by ssrc, so lookups are a np.searchsorted
+#   clients  str         [C]  participant names; index["client"] points here
+INDEX_DTYPE = np.dtype([
+    ("ssrc", "u4"),
+    ("client", "u1"),
+    ("first_ts", "f8"),
+    ("last_ts", "f8"),
+    ("count", "u4"),
+])
+
+
+def index_path_for(session_dir, timestamp):
+    return os.path.join(session_dir, f"ssrc_index_{timestamp}.npz")
+
+
+# -----------------------------
+# Scan
+# -----------------------------
+def scan_capture(vca, pcap, skip_seconds, chunk_size=1 << 20):
+    """One pass over the send-direction packets of one capture.
+
+    Returns {ssrc_hex: [first_ts, last_ts, count]}, using the same skip window and
+    SSRC rules as preprocess_pcap_for_<vca>.py.
+    """
+    pre, _ = PIPELINES[vca]
+    port = pre.SERVER_PORT
+    cutoff = pre.extract_timestamp_from_filename(os.path.basename(pcap)).timestamp() + skip_seconds
+
+    stats = {}
+    with PcapReader(pcap, chunk_size=chunk_size) as reader:
+        for ts, _, data in reader:
+            if ts <= cutoff:
+                continue
+            udp = parse_udp(data, reader.linktype)
+            if udp is None or udp[1] != port:
+                continue
+            ssrc_hex = pre.extract_ssrc_from_udp_payload(udp[2])
+            if not ssrc_hex:
+                continue
+            entry = stats.get(ssrc_hex)
+            if entry is None:
+                stats[ssrc_hex] = [ts, ts, 1]
+            else:
+                entry[1] = ts
+                entry[2] += 1
+    return stats
+
+
+def build_index(per_client):
+    """Combine {client: {ssrc_hex: [first_ts, last_ts, count]}} into an index.
+
+    An SSRC sent by more than one participant goes to the one that sent it most
+    often (earliest first-seen on ties). Returns (index, clients, conflicts).
+    """
+    clients = sorted(per_client)
+    best = {}
+    conflicts = 0
+    for cid, client in enumerate(clients):
+        for ssrc_hex, (first, last, count) in per_client[client].items():
+            row = (count, -first, cid, first, last)
+            prev = best.get(ssrc_hex)
+            if prev is not None:
+                conflicts += 1
+                if prev[:2] >= row[:2]:
+                    continue
+            best[ssrc_hex] = row
+
+    index = np.zeros(len(best), dtype=INDEX_DTYPE)
+    for i, (ssrc_hex, (count, _, cid, first, last)) in enumerate(best.items()):
+        index[i] = (int(ssrc_hex, 16), cid, first, last, count)
+    index.sort(order="ssrc")
+    return index, clients, conflicts
+
+
+def save_index(path, index, clients):
+    with open(path, "wb") as f:
+        np.savez(f, index=index, clients=np.array(clients, dtype=str))
+
+
+# -----------------------------
+# Frozen index
+# -----------------------------
+class SSRCIndex:
+    def __init__(self, index, clients):
+        self.index = index
+        self.clients = list(clients)
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, ssrcs):
+        # uint32 SSRCs -> client id, -1 where unknown
+        ssrcs = np.asarray(ssrcs, dtype=np.uint32)
+        out = np.full(len(ssrcs), -1, dtype=np.int32)
+        if len(self.index):
+            keys = self.index["ssrc"]
+            pos = np.minimum(np.searchsorted(keys, ssrcs), len(keys) - 1)
+            hit = keys[pos] == ssrcs
+            out[hit] = self.index["client"][pos[hit]]
+        return out
+
+    def to_usermap(self):
+        # Same {SSRC hex: name} shape the CI extractors load from usermap_*.json
+        return {f"{int(row['ssrc']):08X}": self.clients[row["client"]] for row in self.index}
+
+    def owned_by(self):
+        out = {client: [] for client in self.clients}
+        for row in self.index:
+            out[self.clients[row["client"]]].append(f"{int(row['ssrc']):08X}")
+        return out
+
+
+def load_index(path):
+    with np.load(path, allow_pickle=False) as data:
+        return SSRCIndex(data["index"], data["clients"].tolist())
+
+
+def build_session_index(vca, captures, skip_seconds, workers=None):
+    # captures: [(client, pcap_path), ...]; one scan per capture, in parallel
+    with ProcessPoolExecutor(max_workers=workers or min(len(captures), os.cpu_count() or 1)) as pool:
+        futures = {client: pool.submit(scan_capture, vca, pcap, skip_seconds) for client, pcap in captures}
+        per_client = {client: fut.result() for client, fut in futures.items()}
+    return build_index(per_client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the SSRC -> participant index for one session")
+    parser.add_argument("--vca", choices=sorted(PIPELINES))
+    parser.add_argument("--session_dir", help="Directory holding the recordings_tmv-* participant directories")
+    parser.add_argument("--timestamp", default=None,
+                        help="Session timestamp <date>_<time> (default: the only one found)")
+    parser.add_argument("--skip", type=int, default=None,
+                        help="Seconds to skip after file start time (default: 200 for zoom, 105 for meet)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default=None, help="Output path (default: <session_dir>/ssrc_index_<timestamp>.npz)")
+    parser.add_argument("--show", default=None, help="Print an existing index instead of building one")
+    args = parser.parse_args()
+
+    if args.show:
+        idx = load_index(args.show)
+        for row in idx.index:
+            print(f"{int(row['ssrc']):08X}\t{idx.clients[row['client']]}\t"
+                  f"{row['first_ts']:.6f}\t{row['last_ts']:.6f}\t{row['count']}")
+        return
+
+    if not args.vca or not args.session_dir:
+        parser.error("--vca and --session_dir are required unless --show is given")
+
+    from process_session import discover_captures
+    timestamp, captures = discover_captures(args.session_dir, args.timestamp)
+    skip = DEFAULT_SKIP[args.vca] if args.skip is None else args.skip
+
+    index, clients, conflicts = build_session_index(
+        args.vca, [(client, pcap) for _, client, pcap in captures], skip, args.workers)
+    out_path = args.out or index_path_for(args.session_dir, timestamp)
+    save_index(out_path, index, clients)
+    if conflicts:
+        print(f"{conflicts} SSRCs were sent by more than one participant")
+    print(f"Saved {len(index)} SSRCs for {len(clients)} participants to: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,56 @@
 import argparse
-import subprocess
-import json
+import asyncio
 from pathlib import Path
 
-def run_extract(image_path: Path):
-    cmd = ["python", "extract_ctx_from_png_for_zoom.py", "--image", str(image_path)]
-    subprocess.run(cmd, check=True)
-    print(f"Processed {image_path}")
-
-def json_equal(file1: Path, file2: Path):
-    if not file1.exists() or not file2.exists():
-        return False
-    with open(file1, 'r', encoding='utf-8') as f1, open(file2, 'r', encoding='utf-8') as f2:
-        try:
-            data1 = json.load(f1)
-            data2 = json.load(f2)
-        except json.JSONDecodeError:
-            return False
-    return data1 == data2
+from extract_ctx_from_png_for_zoom import API_KEY, PROMPT
+from frame_diff import add_diff_args, segment_frames
+from frame_source import add_video_args, extract_video, open_video
+from vlm_cache import add_cache_args, open_cache
+from vlm_engine import add_engine_args, build_engine, extract_dir, extract_segments, frame_index
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--target", required=True, help="Target directory containing frame PNG files")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--target", help="Target directory containing frame PNG files")
+    source.add_argument("--video", help="Recording (.mp4) decoded in-process; only frames sent are saved")
     parser.add_argument("--all", action="store_true", help="Process all PNG files in order without skipping")
+    parser.add_argument("--stride", type=int, default=10, help="Initial probe stride when --all is not given")
+    parser.add_argument("--max_stride", type=int, default=40,
+                        help="Largest probe stride while nothing changes (a change reverting within it is missed)")
+    parser.add_argument("--skip_static", action="store_true",
+                        help="Analyze one frame per visually unchanged segment and copy its JSON to the rest")
+    add_diff_args(parser)
+    add_video_args(parser)
+    add_engine_args(parser)
+    add_cache_args(parser)
     args = parser.parse_args()
 
-    target_dir = Path(args.target)
-    png_files = sorted(target_dir.glob("frame_*.png"), key=lambda x: int(x.stem.split("_")[1]))
-
-    if args.all:
-        for png_file in png_files:
-            run_extract(png_file)
-        return
-
-    prev_json = None
-    prev_frame_idx = None
-
-    for i in range(0, len(png_files), 10):
-        current_png = png_files[i]
-        current_idx = int(current_png.stem.split("_")[1])
-        current_json = current_png.with_suffix(".json")
-
-        run_extract(current_png)
-
-        if prev_json is not None:
-            same = json_equal(prev_json, current_json)
-            print(f"Comparison Result: {'SAME' if same else 'DIFFERENT'}")
-            if not same:
-                start = prev_frame_idx + 1
-                end = current_idx
-                intermediate_frames = [p for p in png_files if start <= int(p.stem.split("_")[1]) < end]
-                for frame_png in intermediate_frames:
-                    run_extract(frame_png)
-
-        prev_json = current_json
-        prev_frame_idx = current_idx
+    # Frames run in-process and concurrently (--concurrency) instead of one subprocess each
+    engine = build_engine(args, PROMPT, api_key=API_KEY, cache=open_cache(args))
+    try:
+        if args.video:
+            frames = open_video(args)
+            asyncio.run(extract_video(engine, frames, window=args.window, all_frames=args.all, stride=args.stride,
+                                      max_stride=args.max_stride, skip_static=args.skip_static,
+                                      threshold=args.diff_threshold, min_changed=args.min_changed))
+            print(f"{frames.decoded} frames decoded, {frames.saved} written to {frames.out_dir}")
+        else:
+            png_files = sorted(Path(args.target).glob("frame_*.png"), key=frame_index)
+            if args.skip_static:
+                segments = segment_frames(png_files, args.diff_threshold, args.min_changed)
+                print(f"{len(png_files)} frames in {len(segments)} unchanged segments")
+                asyncio.run(extract_segments(engine, segments))
+            else:
+                asyncio.run(extract_dir(engine, png_files, all_frames=args.all, stride=args.stride,
+                                        max_stride=args.max_stride))
+    finally:
+        # Commit the cache writes still pending, also when the run is interrupted
+        if engine.cache is not None:
+            engine.cache.flush()
+    print(f"VLM calls: {engine.stats['calls']} ({engine.stats['retries']} retries), "
+          f"failed frames: {engine.stats['failed']}")
+    if engine.cache is not None:
+        print(engine.cache.summary())
 
 if __name__ == "__main__":
     main()
-
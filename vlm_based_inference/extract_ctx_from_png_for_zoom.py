@@ -1,30 +1,15 @@
 import argparse
+import asyncio
 import os
 import sys
-import json
-import base64
-from openai import OpenAI
+from pathlib import Path
 
-API_KEY ""
+from vlm_cache import add_cache_args, open_cache
+from vlm_engine import add_engine_args, build_engine
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+API_KEY = ""
 
-def main():
-    parser = argparse.ArgumentParser(description="Analyze a Zoom screenshot and generate status JSON and CI rules.")
-    parser.add_argument("--image", required=True, help="Path to the Zoom screenshot image (e.g., zoom.png)")
-    args = parser.parse_args()
-
-    image_path = args.image
-
-    if not os.path.exists(image_path):
-        print(f"Image file not found: {image_path}")
-        sys.exit(1)
-
-    base64_image = encode_image(image_path)
- 
-    prompt = """
+PROMPT = """
 You see a Zoom meeting screenshot.
 Participants: Alice, Bob, Charlie, David, Emily, Fred.
 If a name is not visible, set audio="unknown" and video="unknown".
@@ -37,36 +22,26 @@ ONLY output a single JSON: {
 }
 """
 
-    client = OpenAI(api_key=API_KEY)
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a Zoom screenshot and generate status JSON and CI rules.")
+    parser.add_argument("--image", required=True, help="Path to the Zoom screenshot image (e.g., zoom.png)")
+    add_engine_args(parser)
+    add_cache_args(parser)
+    args = parser.parse_args()
 
-    resp = client.responses.create(
-        model="gpt-4o-mini", # $0.15
-        input=[{
-            "role": "user",
-            "content": [
-                {"type": "input_text", "text": prompt},
-                {"type": "input_image", "image_url": f"data:image/jpeg;base64,{base64_image}",},
-            ],
-        }],
-    )
+    image_path = args.image
 
-    raw_output = resp.output_text.strip()
-    
-    if raw_output.startswith("```"):
-        raw_output = raw_output.strip("`") 
-        if raw_output.startswith("json"):
-            raw_output = raw_output[len("json"):].strip()
-            
-    data = json.loads(raw_output)
-    
-    base, _ = os.path.splitext(image_path)
-    output_path = f"{base}.json"
+    if not os.path.exists(image_path):
+        print(f"Image file not found: {image_path}")
+        sys.exit(1)
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-        
-    print(f"Saved JSON to {output_path}")
+    engine = build_engine(args, PROMPT, api_key=API_KEY, cache=open_cache(args))
+    data = asyncio.run(engine.analyze(Path(image_path)))
+    if engine.cache is not None:
+        print(engine.cache.summary())
+        engine.cache.close()
+    if data is None:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 import argparse
 import base64
-import json
 import os
 import sys
-import urllib.request
 from pathlib import Path
 
+from vlm_cache import add_cache_args, open_cache
+from vlm_engine import ollama_generate, parse_json_output
+
 
 def read_prompt(prompt_arg: str) -> str:
     p = Path(prompt_arg)
@@ -17,36 +18,8 @@ def read_prompt(prompt_arg: str) -> str:
 
 def call_ollama_generate(host: str, model: str, prompt: str, image_path: Path, temperature: float = 0.0):
     img_b64 = base64.b64encode(image_path.read_bytes()).decode("ascii")
-
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "images": [img_b64],
-        "stream": False,
-        "options": {
-            "temperature": temperature,
-        },
-    }
-
-    url = host.rstrip("/") + "/api/generate"
-    data = json.dumps(payload).encode("utf-8")
-
-    req = urllib.request.Request(
-        url=url,
-        data=data,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-
-    try:
-        with urllib.request.urlopen(req, timeout=1200) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            return json.loads(body)
-    except urllib.error.HTTPError as e:
-        err_body = e.read().decode("utf-8", errors="replace") if e.fp else ""
-        raise RuntimeError(f"HTTPError {e.code}: {e.reason}\n{err_body}") from e
-    except Exception as e:
-        raise RuntimeError(f"Failed to call Ollama at {url}: {e}") from e
+    # Shared with vlm_engine.OllamaClient; rate limits / transient errors raise RetryableError
+    return ollama_generate(host, model, prompt, [img_b64], temperature=temperature)
 
 
 def main():
@@ -57,6 +30,7 @@ def main():
     parser.add_argument("--host", default=os.environ.get("OLLAMA_HOST", "http://localhost:11434"),
                         help="Ollama host URL (default: env OLLAMA_HOST or http://localhost:11434).")
     parser.add_argument("--temperature", type=float, default=0.0, help="Sampling temperature (default: 0.0).")
+    add_cache_args(parser)
     args = parser.parse_args()
 
     image_path = Path(args.input).expanduser().resolve()
@@ -70,13 +44,25 @@ def main():
 
     prompt = read_prompt(args.prompt)
 
-    resp = call_ollama_generate(
-        host=args.host,
-        model=args.model,
-        prompt=prompt,
-        image_path=image_path,
-        temperature=args.temperature,
-    )
+    cache = open_cache(args)
+    key = cache.key(image_path.read_bytes(), prompt, args.model, args.temperature) if cache else None
+    hit = cache.get(key) if cache else None
+    if hit is not None and hit[1] is not None:
+        resp = {"response": hit[0], "cached": True}
+    else:
+        resp = call_ollama_generate(
+            host=args.host,
+            model=args.model,
+            prompt=prompt,
+            image_path=image_path,
+            temperature=args.temperature,
+        )
+        if cache:
+            # Only parsable responses are kept, so a bad one is retried next run
+            try:
+                cache.put(key, args.model, resp.get("response", ""), parse_json_output(resp.get("response", "")))
+            except ValueError:
+                pass
 
     # Ollama /api/generate typically returns {"response": "...", ...}
     output = {
@@ -90,6 +76,9 @@ def main():
     out_path = image_path.with_suffix(".json")
     out_path.write_text(resp.get("response", ""))
     print(str(out_path))
+    if cache:
+        print(cache.summary(), file=sys.stderr)
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+# frame_diff.py
+#
+# Local change detection for screen-recording frames, so the VLM is not asked about a
+# frame that looks the same as one it has already seen. Each frame is reduced to a
+# small colour grid (GRID cells, ~16 px each at 1512 px width: fine enough that a
+# mute icon, a name label or a tile-layout change moves at least one cell). Consecutive
+# frames whose grid stays within the threshold of the segment's first frame form one
+# segment; extract_ctx_from_dir_for_*.py --skip_static analyzes one frame per segment.
+#
+#   python frame_diff.py --target frames_dir   (preview segments / tune thresholds)
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from vlm_engine import frame_index
+
+GRID = (96, 54)
+
+
+def grid_thumbnail(im, grid=GRID):
+    from PIL import Image
+
+    # BOX averages every source pixel into its cell; colour is kept because a red
+    # mute icon on a mid-gray tile barely changes luma
+    return np.asarray(im.convert("RGB").resize(grid, Image.BOX), dtype=np.float32)
+
+
+def thumbnail(image_path, grid=GRID):
+    # In-memory frames (frame_source.Frame) carry their thumbnail from decoding
+    if getattr(image_path, "thumb", None) is not None:
+        return image_path.thumb
+    try:
+        from PIL import Image
+    except ImportError:
+        raise SystemExit("Frame change detection needs Pillow (pip install pillow)")
+    with Image.open(image_path) as im:
+        return grid_thumbnail(im, grid)
+
+
+def thumbnails(paths, grid=GRID, workers=None):
+    # PNG decoding dominates and releases the GIL
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return list(pool.map(lambda p: thumbnail(p, grid), paths))
+
+
+def changed_fraction(a, b, threshold=8.0):
+    # Fraction of grid cells where some channel's mean moved by more than threshold
+    return float((np.abs(a - b).max(axis=-1) > threshold).mean())
+
+
+def segment_frames(png_files, threshold=8.0, min_changed=0.0, grid=GRID, workers=None):
+    """Split sorted frames into runs that look unchanged; returns a list of lists of paths.
+
+    A frame starts a new segment when more than min_changed of its cells differ from
+    the current segment's first frame by more than threshold levels in any channel. Comparing
+    against the segment start (not the previous frame) keeps slow drifts from chaining.
+    """
+    segments, anchor = [], None
+    for path, thumb in zip(png_files, thumbnails(png_files, grid, workers)):
+        if anchor is None or changed_fraction(anchor, thumb, threshold) > min_changed:
+            segments.append([])
+            anchor = thumb
+        segments[-1].append(path)
+    return segments
+
+
+def add_diff_args(parser):
+    group = parser.add_argument_group("frame change detection")
+    group.add_argument("--diff_threshold", type=float, default=8.0,
+                       help="Per-channel change (0-255) for a grid cell to count as changed")
+    group.add_argument("--min_changed", type=float, default=0.0,
+                       help="Fraction of changed cells tolerated within a segment (raise for live video tiles)")
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group frame_XXXXXX.png files into visually unchanged segments.")
+    parser.add_argument("--target", required=True, help="Target directory containing frame PNG files")
+    add_diff_args(parser)
+    args = parser.parse_args()
+
+    png_files = sorted(Path(args.target).glob("frame_*.png"), key=frame_index)
+    segments = segment_frames(png_files, args.diff_threshold, args.min_changed)
+    for seg in segments:
+        print(f"{seg[0].name} .. {seg[-1].name}: {len(seg)} frames")
+    print(f"{len(png_files)} frames in {len(segments)} segments "
+          f"({len(png_files) / max(len(segments), 1):.1f}x fewer VLM calls)")
+
+
+if __name__ == "__main__":
+    main()
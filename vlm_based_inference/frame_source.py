@@ -0,0 +1,194 @@
+# frame_source.py
+#
+# Decode a screen recording straight into memory instead of extract_png_from_mp4_for_*.sh
+# writing one full-size PNG per frame. Frames are sampled and scaled like the shell script
+# (fps, width, start time) by PyAV when installed, else by an ffmpeg PPM pipe, and each is
+# kept as a change-detection thumbnail plus a JPEG/WebP payload for the VLM. Only frames
+# actually sent are written to disk, as <video dir>/<video name>/frame_%06d.<ext> like the
+# script's PNGs, next to the per-frame JSONs that fill_gaps / extract_ui_from_ctx read.
+import asyncio
+import io
+import itertools
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+
+from frame_diff import GRID, grid_thumbnail, segment_frames
+from vlm_engine import extract_dir, extract_segments
+
+FORMATS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+
+
+class Frame:
+    # Path-like stand-in for frame_XXXXXX.png: the engine reads it through read_bytes()
+    # and writes <frame>.json next to it, the schedulers use .name / .stem
+    def __init__(self, source, path: Path, payload: bytes, thumb):
+        self.source, self.path, self.payload, self.thumb = source, path, payload, thumb
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def stem(self):
+        return self.path.stem
+
+    def __fspath__(self):
+        return str(self.path)
+
+    def with_suffix(self, suffix):
+        return self.path.with_suffix(suffix)
+
+    def read_bytes(self):
+        # Called when the frame is sent to the VLM, so that is when it reaches the disk
+        if not self.path.exists():
+            self.path.write_bytes(self.payload)
+            self.source.saved += 1
+        return self.payload
+
+    def release(self):
+        # For segment members that will only receive a copied JSON
+        self.payload = self.thumb = None
+
+
+def _decode_pyav(video, fps, width, start):
+    import av
+
+    with av.open(str(video)) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        if start > 0:
+            container.seek(int(start * av.time_base))
+        # Sample k is the last frame shown at start + k / fps, as with ffmpeg's fps filter;
+        # only sampled frames are converted
+        k, prev, image = 0, None, None
+        for frame in itertools.chain(container.decode(stream), [None]):
+            if frame is not None:
+                until = frame.time
+            elif prev is not None:
+                # The last frame is shown for its duration
+                until = prev.time + (float(prev.duration * prev.time_base) if prev.duration
+                                     else 1 / float(stream.average_rate or fps))
+            while prev is not None and start + k / fps < until:
+                if image is None:
+                    image = prev.reformat(width=width, height=round(prev.height * width / prev.width),
+                                          format="rgb24").to_ndarray()
+                yield image
+                k += 1
+            prev, image = frame, None
+
+
+def _decode_ffmpeg(video, fps, width, start):
+    # PPM frames carry their own size header, so no ffprobe is needed
+    cmd = ["ffmpeg", "-v", "error", "-ss", str(start), "-i", str(video),
+           "-vf", f"fps={fps},scale={width}:-1", "-f", "image2pipe", "-vcodec", "ppm", "-"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        while proc.stdout.readline().strip() == b"P6":
+            w, h = map(int, proc.stdout.readline().split())
+            proc.stdout.readline()  # maxval (255)
+            yield np.frombuffer(proc.stdout.read(w * h * 3), dtype=np.uint8).reshape(h, w, 3)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+class VideoFrames:
+    """Iterate a recording as Frame objects numbered from 1 like the shell script's output.
+
+    decoder is "pyav", "ffmpeg" or "auto" (PyAV if importable, else the ffmpeg binary).
+    """
+    def __init__(self, video, fps=10, width=1512, start=0.0, image_format="jpeg", quality=90,
+                 decoder="auto", grid=GRID):
+        try:
+            from PIL import Image  # noqa: F401
+        except ImportError:
+            raise SystemExit("--video needs Pillow to encode frames (pip install pillow)")
+        if decoder == "auto":
+            try:
+                import av  # noqa: F401
+                decoder = "pyav"
+            except ImportError:
+                decoder = "ffmpeg"
+        if decoder == "ffmpeg" and shutil.which("ffmpeg") is None:
+            raise SystemExit("--video needs PyAV (pip install av) or an ffmpeg binary on PATH")
+        self.video, self.fps, self.width, self.start = Path(video), fps, width, start
+        self.image_format, self.quality, self.decoder, self.grid = image_format, quality, decoder, grid
+        self.out_dir = self.video.parent / self.video.stem
+        self.decoded = self.saved = 0
+
+    def __iter__(self):
+        from PIL import Image
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        decode = _decode_pyav if self.decoder == "pyav" else _decode_ffmpeg
+        for k, image in enumerate(decode(self.video, self.fps, self.width, self.start), start=1):
+            im = Image.fromarray(image)
+            out = io.BytesIO()
+            im.save(out, format=self.image_format.upper(), quality=self.quality)
+            self.decoded += 1
+            yield Frame(self, self.out_dir / f"frame_{k:06d}{FORMATS[self.image_format]}",
+                        out.getvalue(), grid_thumbnail(im, self.grid))
+
+
+async def extract_video(engine, frames, window=600, all_frames=False, stride=10, max_stride=40,
+                        skip_static=False, threshold=8.0, min_changed=0.0):
+    """Run the directory schedulers over decoded frames, window frames at a time.
+
+    Decoding the next window overlaps the VLM calls of the current one. Windows are
+    chained so results match a run over the whole frame directory: the probe scheduler
+    resumes from the previous window's last frame, and an unfinished segment (--skip_static)
+    carries over into the next window.
+    """
+    frames = iter(frames)
+
+    def take():
+        return list(itertools.islice(frames, window))
+
+    pending = asyncio.create_task(asyncio.to_thread(take))
+    carry, last_result, t0 = [], None, time.perf_counter()
+    while True:
+        chunk = await pending
+        done = len(chunk) < window
+        if not done:
+            pending = asyncio.create_task(asyncio.to_thread(take))
+        print(f"Decoded {len(chunk)} frames ({time.perf_counter() - t0:.1f}s)")
+
+        if skip_static:
+            # Only the open segment's first frame is compared against, so it alone is re-segmented
+            segments = segment_frames(carry[:1] + chunk, threshold, min_changed)
+            if carry:
+                segments[0][1:1] = carry[1:]
+            carry = [] if done else segments.pop()
+            for frame in carry[1:]:
+                frame.release()
+            await extract_segments(engine, segments)
+        elif all_frames:
+            await engine.analyze_many(chunk)
+        else:
+            chunk = carry + chunk
+            stride, last_result = await extract_dir(engine, chunk, stride=stride, max_stride=max_stride,
+                                                    first=last_result if carry else None)
+            carry = chunk[-1:]
+        if done:
+            return
+
+
+def add_video_args(parser):
+    group = parser.add_argument_group("video input (--video)")
+    group.add_argument("--fps", type=float, default=10, help="Frames per second to sample")
+    group.add_argument("--width", type=int, default=1512, help="Frame width (height keeps the aspect ratio)")
+    group.add_argument("--start", type=float, default=0.0, help="Start time in seconds")
+    group.add_argument("--image_format", choices=list(FORMATS), default="jpeg", help="Encoding of the frames sent")
+    group.add_argument("--quality", type=int, default=90, help="JPEG / WebP quality")
+    group.add_argument("--window", type=int, default=600, help="Frames decoded and scheduled at a time")
+    group.add_argument("--decoder", choices=["auto", "pyav", "ffmpeg"], default="auto")
+    return parser
+
+
+def open_video(args):
+    return VideoFrames(args.video, fps=args.fps, width=args.width, start=args.start,
+                       image_format=args.image_format, quality=args.quality, decoder=args.decoder)
@@ -0,0 +1,145 @@
+# vlm_cache.py
+#
+# Persistent VLM response cache (SQLite). Entries are keyed by a hash of the image
+# bytes, prompt, model name and temperature and hold the raw model output plus its
+# parsed JSON, so re-running the extract_ctx_from_* scripts on the same frames makes
+# no model calls unless the prompt or model changes. Least-recently-used entries are
+# evicted once the stored responses exceed max_bytes. Writes are committed every
+# commit_every lookups / inserts and on close(), not once per frame.
+#
+#   python vlm_cache.py --cache responses.sqlite            (print stats)
+#   python vlm_cache.py --cache responses.sqlite --clear
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "vlm_based_inference", "responses.sqlite")
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE, max_bytes=512 << 20, commit_every=100):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path, self.max_bytes, self.commit_every = path, max_bytes, commit_every
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, model TEXT, raw TEXT, parsed TEXT,
+            size INTEGER, created REAL, last_used REAL, hits INTEGER DEFAULT 0)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used)")
+        self.db.commit()
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = self.misses = self.evicted = 0
+        self.pending = 0
+
+    @staticmethod
+    def key(image_bytes, prompt, model, temperature=None):
+        h = hashlib.sha256()
+        for part in (hashlib.sha256(image_bytes).digest(), prompt.encode("utf-8"),
+                     str(model).encode("utf-8"), repr(temperature).encode("utf-8")):
+            # Length-prefixed so that no two field splits hash alike
+            h.update(len(part).to_bytes(8, "little"))
+            h.update(part)
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return (raw, parsed) for a cached response, or None."""
+        row = self.db.execute("SELECT raw, parsed FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        self._written()
+        return row[0], (json.loads(row[1]) if row[1] is not None else None)
+
+    def put(self, key, model, raw, parsed=None):
+        parsed = json.dumps(parsed, ensure_ascii=False) if parsed is not None else None
+        size = len(raw.encode("utf-8")) + len((parsed or "").encode("utf-8"))
+        now = time.time()
+        old = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.db.execute("INSERT OR REPLACE INTO responses (key, model, raw, parsed, size, created, last_used) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, model, raw, parsed, size, now, now))
+        self.total += size - (old[0] if old else 0)
+        if self.total > self.max_bytes:
+            self._evict(self.max_bytes * 9 // 10)
+        self._written()
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.db.commit()
+            self.pending = 0
+
+    def _evict(self, target):
+        # Drop least-recently-used entries until the stored size is under target
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if self.total <= target:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total -= size
+            self.evicted += 1
+
+    def clear(self):
+        self.db.execute("DELETE FROM responses")
+        self.db.commit()
+        self.pending = 0
+        self.db.execute("VACUUM")
+        self.total = 0
+
+    def stats(self):
+        entries, lifetime_hits = self.db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries, "bytes": self.total, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+            "hit_rate": self.hits / lookups if lookups else 0.0, "lifetime_hits": lifetime_hits,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"cache {s['hits']}/{s['hits'] + s['misses']} hits ({s['hit_rate']:.1%}), "
+                f"{s['entries']} entries, {s['bytes'] / 2**20:.1f}/{s['max_bytes'] / 2**20:.0f} MB, "
+                f"{s['evicted']} evicted")
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def add_cache_args(parser):
+    group = parser.add_argument_group("response cache")
+    group.add_argument("--cache", default=DEFAULT_CACHE, help=f"SQLite response cache (default: {DEFAULT_CACHE})")
+    group.add_argument("--cache_max_mb", type=float, default=512, help="Evict least-recently-used entries beyond this")
+    group.add_argument("--no_cache", action="store_true", help="Always query the model")
+    return parser
+
+
+def open_cache(args):
+    return None if args.no_cache else ResponseCache(args.cache, int(args.cache_max_mb * 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the VLM response cache.")
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache)
+    if args.clear:
+        cache.clear()
+    s = cache.stats()
+    print(f"{args.cache}: {s['entries']} entries, {s['bytes'] / 2**20:.1f} MB, {s['lifetime_hits']} hits served")
+    for model, n in cache.db.execute("SELECT model, COUNT(*) FROM responses GROUP BY model ORDER BY 2 DESC"):
+        print(f"  {model}: {n}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+# vlm_engine.py
+#
+# In-process VLM frame analysis shared by the extract_ctx_from_* scripts. A client
+# turns (prompt, base64 image) into the model's raw text; VLMEngine runs many frames
+# concurrently behind a semaphore, retries rate limits / transient errors with
+# exponential backoff, and writes each frame's parsed JSON next to its PNG. With a
+# vlm_cache.ResponseCache, frames already answered for the same prompt/model are not re-sent.
+#
+# Clients only need an async generate(prompt, images_b64) -> str, so a fake one (or
+# --base_url / --host pointing at a local stub server) is enough to exercise the engine.
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+# Appended to the single-frame prompt when several frames share one request
+BATCH_PROMPT = """
+You are given {n} screenshots, in order. Apply the rules above to each screenshot independently.
+ONLY output a JSON array of exactly {n} objects, one per screenshot in the same order, each of the form {{"context": {{...}}}}.
+"""
+
+
+class RetryableError(RuntimeError):
+    # Rate limit or transient failure; retry_after (seconds) is the server's hint, if any
+    def __init__(self, msg, retry_after=None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get("retry-after")) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_json_output(raw_output):
+    raw_output = raw_output.strip()
+    if raw_output.startswith("```"):
+        raw_output = raw_output.strip("`")
+        if raw_output.startswith("json"):
+            raw_output = raw_output[len("json"):].strip()
+    return json.loads(raw_output)
+
+
+def split_batch_output(data, n):
+    # Validate a batched answer and return its n per-frame dicts
+    if isinstance(data, dict) and len(data) == 1 and isinstance(next(iter(data.values())), list):
+        data = next(iter(data.values()))  # tolerate {"frames": [...]} wrappers
+    if not isinstance(data, list) or len(data) != n:
+        raise ValueError(f"expected a JSON array of {n} frames")
+    for item in data:
+        if not isinstance(item, dict) or not isinstance(item.get("context"), dict):
+            raise ValueError("frame entry without a context object")
+    return data
+
+
+def downscale(image_bytes, width):
+    # Re-encoded in its own format at most width px wide (aspect kept); smaller images pass through
+    try:
+        from PIL import Image
+    except ImportError:
+        raise SystemExit("--batch_size > 1 needs Pillow to downscale frames (pip install pillow)")
+    with Image.open(io.BytesIO(image_bytes)) as im:
+        if not width or im.width <= width:
+            return image_bytes
+        out = io.BytesIO()
+        im.resize((width, round(im.height * width / im.width)), Image.LANCZOS).save(out, format=im.format or "PNG")
+        return out.getvalue()
+
+
+def read_image(image_path):
+    # frame_source.Frame keeps its encoded image in memory (and saves it on first read)
+    return image_path.read_bytes() if hasattr(image_path, "read_bytes") else Path(image_path).read_bytes()
+
+
+def _data_url(image_b64):
+    mime = {"/9j/": "jpeg", "iVBO": "png", "UklG": "webp"}.get(image_b64[:4], "jpeg")
+    return f"data:image/{mime};base64,{image_b64}"
+
+
+def write_json(path, data):
+    output_path = Path(path).with_suffix(".json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return output_path
+
+
+def frame_index(path: Path) -> int:
+    return int(path.stem.split("_")[1])
+
+
+# -----------------------------
+# Clients
+# -----------------------------
+class OpenAIClient:
+    def __init__(self, model="gpt-4o-mini", api_key=None, base_url=None, timeout=120.0):
+        try:
+            import openai
+        except ImportError:
+            raise SystemExit("--backend openai needs the openai package (pip install openai)")
+        self.model, self.temperature = model, None
+        # Retries are the engine's job, so they share its backoff and concurrency limit
+        self.client = openai.AsyncOpenAI(api_key=api_key or None, base_url=base_url, timeout=timeout, max_retries=0)
+        self.retryable = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                          openai.InternalServerError)
+
+    async def generate(self, prompt, images_b64):
+        try:
+            resp = await self.client.responses.create(
+                model=self.model,
+                input=[{
+                    "role": "user",
+                    "content": [{"type": "input_text", "text": prompt}] + [
+                        {"type": "input_image", "image_url": _data_url(image_b64)}
+                        for image_b64 in images_b64
+                    ],
+                }],
+            )
+        except self.retryable as e:
+            response = getattr(e, "response", None)
+            raise RetryableError(str(e), _retry_after(response.headers if response is not None else None)) from e
+        return resp.output_text
+
+
+def ollama_generate(host, model, prompt, images_b64, temperature=0.0, timeout=1200):
+    # Blocking POST to Ollama's /api/generate; returns the decoded response body
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "images": list(images_b64),
+        "stream": False,
+        "options": {
+            "temperature": temperature,
+        },
+    }
+
+    url = host.rstrip("/") + "/api/generate"
+    req = urllib.request.Request(
+        url=url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8", errors="replace"))
+    except urllib.error.HTTPError as e:
+        err_body = e.read().decode("utf-8", errors="replace") if e.fp else ""
+        if e.code in RETRY_STATUS:
+            raise RetryableError(f"HTTPError {e.code}: {e.reason}", _retry_after(e.headers)) from e
+        raise RuntimeError(f"HTTPError {e.code}: {e.reason}\n{err_body}") from e
+    except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+        raise RetryableError(f"Failed to call Ollama at {url}: {e}") from e
+
+
+class OllamaClient:
+    def __init__(self, host, model="qwen3-vl:8b", temperature=0.0, timeout=1200):
+        self.host, self.model = host, model
+        self.temperature, self.timeout = temperature, timeout
+
+    async def generate(self, prompt, images_b64):
+        # urllib blocks, so each request runs in a worker thread
+        resp = await asyncio.to_thread(ollama_generate, self.host, self.model, prompt, images_b64,
+                                       self.temperature, self.timeout)
+        return resp.get("response", "")
+
+
+# -----------------------------
+# Engine
+# -----------------------------
+class VLMEngine:
+    def __init__(self, client, prompt, concurrency=8, retries=6, backoff=1.0, max_backoff=60.0, cache=None,
+                 batch_size=1, batch_width=768):
+        self.client, self.prompt, self.cache = client, prompt, cache
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries, self.backoff, self.max_backoff = retries, backoff, max_backoff
+        self.batch_size, self.batch_width = max(batch_size, 1), batch_width
+        self.stats = {"calls": 0, "retries": 0, "failed": 0, "batched_frames": 0}
+
+    async def _generate(self, prompt, images_b64):
+        for attempt in range(self.retries + 1):
+            self.stats["calls"] += 1
+            try:
+                return await self.client.generate(prompt, images_b64)
+            except RetryableError as e:
+                if attempt == self.retries:
+                    raise
+                self.stats["retries"] += 1
+                # Full jitter keeps concurrent workers from retrying in lockstep
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                await asyncio.sleep(max(delay, e.retry_after or 0.0))
+
+    async def analyze(self, image_path: Path):
+        """Run one frame and save <frame>.json; returns the parsed dict, or None on failure.
+
+        Exhausted retries and unparsable output only fail this frame; any other error
+        (bad API key, 4xx) propagates and stops the run.
+        """
+        async with self.semaphore:
+            image = await asyncio.to_thread(read_image, image_path)
+            key = hit = None
+            if self.cache is not None:
+                key = self.cache.key(image, self.prompt, self.client.model, self.client.temperature)
+                hit = self.cache.get(key)
+            try:
+                if hit is not None and hit[1] is not None:
+                    data = hit[1]
+                else:
+                    raw = await self._generate(self.prompt, [base64.b64encode(image).decode("utf-8")])
+                    data = parse_json_output(raw)
+                    if self.cache is not None:
+                        # Only parsable responses are kept, so a bad one is retried next run
+                        self.cache.put(key, self.client.model, raw, data)
+            except (RetryableError, json.JSONDecodeError) as e:
+                self.stats["failed"] += 1
+                print(f"Failed {image_path}: {e}")
+                return None
+
+        print(f"Saved JSON to {write_json(image_path, data)}")
+        return data
+
+    async def analyze_batch(self, paths):
+        """Run several frames as one request of downscaled images (batch_width) and save
+        each frame's JSON; returns the per-frame dicts (None where a frame failed).
+
+        Frames found in the cache are not sent. If the request fails or its answer is not
+        an array of one context per frame, those frames are retried one per request.
+        """
+        # Batched answers come from a different prompt and resolution, so they are cached apart
+        tag = f"{self.prompt}\n[batched, {self.batch_width}px]"
+        results, retry = [None] * len(paths), []
+        async with self.semaphore:
+            images = await asyncio.to_thread(lambda: [read_image(p) for p in paths])
+            keys = [self.cache.key(image, tag, self.client.model, self.client.temperature)
+                    if self.cache is not None else None for image in images]
+            for k, key in enumerate(keys):
+                hit = self.cache.get(key) if key is not None else None
+                if hit is not None and hit[1] is not None:
+                    results[k] = hit[1]
+
+            todo = [k for k, data in enumerate(results) if data is None]
+            if todo:
+                payloads = await asyncio.to_thread(lambda: [
+                    base64.b64encode(downscale(images[k], self.batch_width)).decode("utf-8") for k in todo])
+                try:
+                    raw = await self._generate(self.prompt + BATCH_PROMPT.format(n=len(todo)), payloads)
+                    items = split_batch_output(parse_json_output(raw), len(todo))
+                except (RetryableError, ValueError) as e:
+                    print(f"Batch of {len(todo)} frames failed ({e}); retrying them one per request")
+                    retry = todo
+                else:
+                    self.stats["batched_frames"] += len(todo)
+                    for k, item in zip(todo, items):
+                        results[k] = item
+                        if self.cache is not None:
+                            self.cache.put(keys[k], self.client.model, json.dumps(item, ensure_ascii=False), item)
+
+        # Outside the semaphore: analyze() takes its own slot
+        for k, data in zip(retry, await asyncio.gather(*(self.analyze(paths[k]) for k in retry))):
+            results[k] = data
+            if data is not None and self.cache is not None:
+                # Also under the batched key, so the next batched run finds it
+                self.cache.put(keys[k], self.client.model, json.dumps(data, ensure_ascii=False), data)
+        for k, data in enumerate(results):
+            if data is not None and k not in retry:
+                print(f"Saved JSON to {write_json(paths[k], data)}")
+        return results
+
+    async def analyze_many(self, paths):
+        paths = list(paths)
+        if self.batch_size == 1:
+            return await asyncio.gather(*(self.analyze(p) for p in paths))
+        chunks = [paths[k:k + self.batch_size] for k in range(0, len(paths), self.batch_size)]
+        return [data for chunk in await asyncio.gather(*(self.analyze_batch(c) for c in chunks)) for data in chunk]
+
+
+# -----------------------------
+# Directory scheduling
+# -----------------------------
+def _same(a, b):
+    return a is not None and a == b
+
+
+async def _bisect(engine, png_files, i, j, ri, rj):
+    # Split (i, j) until its ends agree or are neighbours; each part is refined on its own,
+    # so several changes inside one window are all localized. With batching the interval
+    # is cut at batch_size points per request instead of its midpoint.
+    if j - i <= 1 or _same(ri, rj):
+        return
+    k = min(engine.batch_size, j - i - 1)
+    points = [i + (j - i) * s // (k + 1) for s in range(1, k + 1)]
+    ends = [(i, ri)] + list(zip(points, await engine.analyze_many([png_files[m] for m in points]))) + [(j, rj)]
+    await asyncio.gather(*(_bisect(engine, png_files, a, b, ra, rb) for (a, ra), (b, rb) in zip(ends, ends[1:])))
+
+
+async def extract_dir(engine, png_files, all_frames=False, stride=10, max_stride=40, first=None):
+    """Probe frames at an adaptive stride and bisect every probe interval whose ends differ.
+
+    png_files must be sorted by frame index. Afterwards any two consecutive analyzed
+    frames either agree or are neighbours, so fill_gaps_ctx_from_dir.py completes the
+    dense per-frame JSON set. A change that reverts within one interval (A -> B -> A)
+    is not seen, as with fixed-stride probing; max_stride bounds that window.
+    With all_frames every frame is analyzed.
+
+    first is png_files[0]'s result when already known. Returns the final stride and the
+    last frame's result, so a caller can continue on the following frames.
+    """
+    if all_frames:
+        results = await engine.analyze_many(png_files)
+        return stride, (results[-1] if results else None)
+    if not png_files:
+        return stride, first
+
+    last = len(png_files) - 1
+    i, ri = 0, first
+    if ri is None:
+        (ri,) = await engine.analyze_many(png_files[:1])
+    while i < last:
+        # One round probes as many frames ahead as can be in flight at once
+        probes = sorted({min(i + k * stride, last) for k in range(1, engine.concurrency * engine.batch_size + 1)})
+        ends = [(i, ri)] + list(zip(probes, await engine.analyze_many([png_files[j] for j in probes])))
+
+        changed = []
+        for (a, ra), (b, rb) in zip(ends, ends[1:]):
+            same = _same(ra, rb)
+            print(f"Comparison Result: {'SAME' if same else 'DIFFERENT'} "
+                  f"({png_files[a].name} .. {png_files[b].name})")
+            if not same:
+                changed.append(_bisect(engine, png_files, a, b, ra, rb))
+        await asyncio.gather(*changed)
+
+        # Widen the stride while nothing changes, narrow it when most intervals do
+        if not changed:
+            stride = min(stride * 2, max_stride)
+        elif len(changed) * 2 > len(ends) - 1:
+            stride = max(stride // 2, 2)
+        i, ri = ends[-1]
+    return stride, ri
+
+
+async def extract_segments(engine, segments):
+    """Analyze the first frame of each segment (see frame_diff.segment_frames) and
+    write its JSON for every other frame of the segment."""
+    results = await engine.analyze_many([seg[0] for seg in segments])
+    for seg, data in zip(segments, results):
+        if data is not None:
+            for png_file in seg[1:]:
+                write_json(png_file, data)
+
+
+def add_engine_args(parser, model=None):
+    group = parser.add_argument_group("VLM engine")
+    group.add_argument("--backend", choices=["openai", "ollama"], default="openai")
+    group.add_argument("--model", default=model, help="Model name (default: gpt-4o-mini / qwen3-vl:8b)")
+    group.add_argument("--base_url", default=None, help="OpenAI-compatible endpoint (e.g. a local stub server)")
+    group.add_argument("--host", default=os.environ.get("OLLAMA_HOST", "http://localhost:11434"),
+                       help="Ollama host URL (default: env OLLAMA_HOST or http://localhost:11434)")
+    group.add_argument("--concurrency", type=int, default=8, help="Maximum in-flight VLM requests")
+    group.add_argument("--retries", type=int, default=6, help="Retries per frame on rate limits / transient errors")
+    group.add_argument("--backoff", type=float, default=1.0, help="Initial retry delay in seconds (doubles per retry)")
+    group.add_argument("--batch_size", type=int, default=1, help="Frames per request (> 1 asks for a JSON array)")
+    group.add_argument("--batch_width", type=int, default=768, help="Width frames are downscaled to when batching")
+    return parser
+
+
+def build_engine(args: argparse.Namespace, prompt, api_key=None, cache=None):
+    if args.backend == "ollama":
+        client = OllamaClient(args.host, args.model or "qwen3-vl:8b")
+    else:
+        client = OpenAIClient(args.model or "gpt-4o-mini", api_key=api_key, base_url=args.base_url)
+    return VLMEngine(client, prompt, concurrency=args.concurrency, retries=args.retries, backoff=args.backoff,
+                     cache=cache, batch_size=args.batch_size, batch_width=args.batch_width)